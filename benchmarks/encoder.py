@@ -0,0 +1,121 @@
+"""Measures the per-step latency of the frozen camera encoder, encoding the 4 cameras in
+one batch or one by one, and the size of its embeddings against the camera stack.
+
+An example encoder (the strided CNN of CustomFeatureExtractor, pooled per camera) is
+exported to TorchScript, and to ONNX when onnxruntime is installed, unless --encoder
+is given.
+
+Usage: python -m benchmarks.encoder [--encoder encoder.pt] [--threads 1 2 4]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import torch
+from torch import nn
+
+from experiment.encoder import FrozenEncoder
+
+N_CAMERAS = 4
+IMAGE_SHAPE = (256, 256, 3)
+
+
+def export_example_encoders(directory):
+    """Exports an untrained per-camera encoder, returning the paths of the files"""
+    model = nn.Sequential(
+        nn.Conv2d(IMAGE_SHAPE[2], 32, kernel_size=8, stride=4, padding=2),
+        nn.ReLU(),
+        nn.Conv2d(32, 64, kernel_size=4, stride=2, padding=1),
+        nn.ReLU(),
+        nn.Conv2d(64, 64, kernel_size=3, stride=2, padding=1),
+        nn.ReLU(),
+        nn.Conv2d(64, 64, kernel_size=3, stride=2, padding=1),
+        nn.ReLU(),
+        nn.AdaptiveAvgPool2d(1),
+        nn.Flatten(),
+    ).eval()
+    sample = torch.zeros((N_CAMERAS, IMAGE_SHAPE[2]) + IMAGE_SHAPE[:2])
+
+    paths = []
+    torchscript_path = os.path.join(directory, "encoder.pt")
+    with torch.no_grad():
+        torch.jit.save(torch.jit.trace(model, sample), torchscript_path)
+    paths.append(torchscript_path)
+
+    try:
+        import onnxruntime  # noqa: F401
+
+        onnx_path = os.path.join(directory, "encoder.onnx")
+        torch.onnx.export(
+            model,
+            sample,
+            onnx_path,
+            input_names=["images"],
+            output_names=["embeddings"],
+            dynamic_axes={"images": {0: "cameras"}, "embeddings": {0: "cameras"}},
+        )
+        paths.append(onnx_path)
+    except Exception as e:
+        print("Skipping ONNX: {}".format(e))
+    return paths
+
+
+def measure(function, n_steps):
+    """Returns the latencies of the function in ms, after a short warm-up"""
+    for _ in range(10):
+        function()
+    latencies = []
+    for _ in range(n_steps):
+        start_time = time.perf_counter()
+        function()
+        latencies.append(1000 * (time.perf_counter() - start_time))
+    return np.array(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--encoder", nargs="+", default=None)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--steps", type=int, default=200)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    paths = args.encoder or export_example_encoders(directory)
+    images = [
+        np.random.randint(0, 256, size=IMAGE_SHAPE).astype(np.uint8)
+        for _ in range(N_CAMERAS)
+    ]
+    image_bytes = N_CAMERAS * int(np.prod(IMAGE_SHAPE))
+
+    print(
+        "\n{:<14} {:>8} {:>10} {:>10} {:>10} {:>12}".format(
+            "Encoder", "Threads", "Mode", "p50 (ms)", "p95 (ms)", "Obs (bytes)"
+        )
+    )
+    for path in paths:
+        for threads in args.threads:
+            encoder = FrozenEncoder(path, threads=threads)
+            embedding_bytes = encoder.encode(images).nbytes
+            modes = [
+                ("batched", lambda: encoder.encode(images)),
+                ("per-camera", lambda: [encoder.encode([image]) for image in images]),
+            ]
+            for mode, function in modes:
+                latencies = measure(function, args.steps)
+                print(
+                    "{:<14} {:>8} {:>10} {:>10.2f} {:>10.2f} {:>12}".format(
+                        os.path.basename(path),
+                        threads,
+                        mode,
+                        np.percentile(latencies, 50),
+                        np.percentile(latencies, 95),
+                        embedding_bytes,
+                    )
+                )
+    print("\nCamera stack: {} bytes per step".format(image_bytes))
+
+
+if __name__ == "__main__":
+    main()
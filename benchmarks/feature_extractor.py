@@ -0,0 +1,93 @@
+"""Measures the CPU inference and training throughput of the CustomFeatureExtractor
+on the 256x256x12 camera stack.
+
+Usage: python -m benchmarks.feature_extractor [--batch-sizes 1 64] [--threads 4]
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+from gymnasium.spaces import Box, Dict
+
+from models.feature_extractor import CustomFeatureExtractor
+
+
+def make_observation_space(channels_first):
+    shape = (12, 256, 256) if channels_first else (256, 256, 12)
+    return Dict(
+        {
+            "image": Box(low=0, high=255, shape=shape, dtype=np.uint8),
+            "obj_distance": Box(low=-1, high=20, shape=(10,), dtype=np.float32),
+        }
+    )
+
+
+def make_batch(observation_space, batch_size):
+    return {
+        key: torch.as_tensor(np.stack([space.sample() for _ in range(batch_size)]))
+        for key, space in observation_space.spaces.items()
+    }
+
+
+def measure(function, duration):
+    function()  # Warm up
+    iterations = 0
+    start_time = time.perf_counter()
+    while time.perf_counter() - start_time < duration:
+        function()
+        iterations += 1
+    return iterations / (time.perf_counter() - start_time)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 64])
+    parser.add_argument("--threads", type=int, default=torch.get_num_threads())
+    parser.add_argument("--duration", type=float, default=5.0)
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    print("Threads: {}".format(args.threads))
+    print(
+        "{:<14} {:<14} {:>6} {:>18} {:>18}".format(
+            "Input layout",
+            "Memory format",
+            "Batch",
+            "Inference (obs/s)",
+            "Training (obs/s)",
+        )
+    )
+    for channels_first in (False, True):
+        observation_space = make_observation_space(channels_first)
+        for channels_last in (False, True):
+            extractor = CustomFeatureExtractor(
+                observation_space, features_dim=23, channels_last=channels_last
+            )
+            optimizer = torch.optim.Adam(extractor.parameters(), lr=1e-4)
+
+            for batch_size in args.batch_sizes:
+                batch = make_batch(observation_space, batch_size)
+
+                def inference():
+                    with torch.inference_mode():
+                        extractor(batch)
+
+                def training():
+                    optimizer.zero_grad()
+                    extractor(batch).sum().backward()
+                    optimizer.step()
+
+                print(
+                    "{:<14} {:<14} {:>6} {:>18.1f} {:>18.1f}".format(
+                        "NCHW" if channels_first else "NHWC",
+                        "channels_last" if channels_last else "contiguous",
+                        batch_size,
+                        batch_size * measure(inference, args.duration),
+                        batch_size * measure(training, args.duration),
+                    )
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Measures the cold import time of the project's modules, as paid by every new
+subprocess worker.
+
+Usage: python -m benchmarks.import_time [--repeats 10] [--profile carla_integration]
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+MODULES = [
+    "config",
+    "carla_integration",
+    "carla_integration.env",
+    "experiment.experiment",
+    "helper.carla_helper",
+    "helper.sensors.sensor_factory",
+]
+
+
+def time_statement(statement, repeats):
+    timings = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        subprocess.run([sys.executable, "-c", statement], check=True)
+        timings.append(time.perf_counter() - start_time)
+    return timings
+
+
+def profile_import(module, top=15):
+    """Prints the slowest imports (cumulative time) reported by 'python -X importtime'"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + module],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines()[1:]:
+        _, cumulative, name = line.split("|")
+        rows.append((int(cumulative), name.strip()))
+    for cumulative, name in sorted(rows, reverse=True)[:top]:
+        print("{:>10.1f} ms  {}".format(cumulative / 1000, name))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--profile", default=None)
+    args = parser.parse_args()
+
+    interpreter = statistics.median(time_statement("pass", args.repeats))
+    print("{:<35} {:>12} {:>12}".format("Module", "Median (ms)", "Min (ms)"))
+    print("{:<35} {:>12.1f}".format("(interpreter startup)", 1000 * interpreter))
+    for module in MODULES:
+        timings = time_statement("import " + module, args.repeats)
+        print(
+            "{:<35} {:>12.1f} {:>12.1f}".format(
+                module, 1000 * statistics.median(timings), 1000 * min(timings)
+            )
+        )
+
+    if args.profile is not None:
+        print("\nSlowest imports of {}:".format(args.profile))
+        profile_import(args.profile)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Measures the steps/sec of the kinematic parking simulator with random actions, as a
+natively vectorized env with more and more envs and as the single gym env.
+
+Usage: python -m benchmarks.kinematic [--n-envs 1 64 1024 4096] [--steps 200]
+"""
+import argparse
+import time
+
+import gymnasium as gym
+import numpy as np
+
+import carla_integration  # noqa: F401
+from carla_integration.kinematic_env import KinematicVecEnv
+
+
+def measure_vec_env(n_envs, n_steps, seed):
+    env = KinematicVecEnv(n_envs, seed=seed)
+    env.reset()
+    actions = np.random.default_rng(seed).integers(
+        env.action_space.n, size=(n_steps, n_envs)
+    )
+    n_episodes = 0
+    start_time = time.perf_counter()
+    for step_actions in actions:
+        _, _, dones, _ = env.step(step_actions)
+        n_episodes += int(dones.sum())
+    elapsed = time.perf_counter() - start_time
+    return n_steps * n_envs / elapsed, n_episodes
+
+
+def measure_single_env(n_steps, seed):
+    env = gym.make("CarlaKinematic-v0")
+    env.reset(seed=seed)
+    env.action_space.seed(seed)
+    start_time = time.perf_counter()
+    for _ in range(n_steps):
+        _, _, terminated, truncated, _ = env.step(env.action_space.sample())
+        if terminated or truncated:
+            env.reset()
+    return n_steps / (time.perf_counter() - start_time)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n-envs", type=int, nargs="+", default=[1, 64, 1024, 4096])
+    parser.add_argument("--steps", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print("\n{:<14} {:>8} {:>14} {:>10}".format("Env", "Envs", "Steps/s", "Episodes"))
+    for n_envs in args.n_envs:
+        steps_per_sec, n_episodes = measure_vec_env(n_envs, args.steps, args.seed)
+        print(
+            "{:<14} {:>8} {:>14.0f} {:>10}".format(
+                "KinematicVec", n_envs, steps_per_sec, n_episodes
+            )
+        )
+    print(
+        "{:<14} {:>8} {:>14.0f} {:>10}".format(
+            "gym.make", 1, measure_single_env(args.steps * 10, args.seed), "-"
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""Reports the time needed to load the experiment's town for several map layer configurations.
+
+Usage: python -m benchmarks.map_load
+"""
+from carla_integration.core import CarlaCore
+from config import read_config
+from helper.carla_helper import get_map_layers
+
+LAYER_CONFIGURATIONS = [
+    [],
+    ["Ground"],
+    ["Ground", "ParkedVehicles"],
+    ["Ground", "ParkedVehicles", "Buildings"],
+]
+
+
+def main():
+    config = read_config()
+    town = config["experiment"]["town"]
+    core = CarlaCore(config["carla"], config["experiment"])
+
+    results = []
+    try:
+        for layer_names in LAYER_CONFIGURATIONS:
+            map_layers = get_map_layers(layer_names)
+            cold = core.load_map(town, map_layers, force=True)
+            warm = core.load_map(town, map_layers)
+            results.append((layer_names or ["All"], cold, warm))
+    finally:
+        core.stop_server()
+
+    print("\n{:<45} {:>10} {:>10}".format("Layers", "Cold (s)", "Reuse (s)"))
+    for layer_names, cold, warm in results:
+        print("{:<45} {:>10.2f} {:>10.3f}".format(", ".join(layer_names), cold, warm))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""Compares the steps/sec of in-process envs against the same envs served by local
+rollout workers (carla_integration.remote), using the kinematic simulator so that no
+CARLA server is needed. Also measures the codec of the uint8 camera observations on
+synthetic semantic segmentation frames.
+
+Usage: python -m benchmarks.remote [--n-envs 256] [--workers 1 2 4] [--tcp]
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from carla_integration import NATIVE_VEC_ENVS
+from carla_integration.remote import RemoteVecEnv, receive_message, send_message
+
+ENV_ID = "CarlaKinematic-v0"
+
+
+def measure(vec_env, n_steps, seed):
+    vec_env.reset()
+    actions = np.random.default_rng(seed).integers(
+        vec_env.action_space.n, size=(n_steps, vec_env.num_envs)
+    )
+    start_time = time.perf_counter()
+    for step_actions in actions:
+        vec_env.step(step_actions)
+    return n_steps * vec_env.num_envs / (time.perf_counter() - start_time)
+
+
+def start_workers(n_workers, n_envs, use_tcp, directory):
+    """Starts the workers in subprocesses, returning them and their addresses"""
+    processes, addresses = [], []
+    for worker_idx in range(n_workers):
+        if use_tcp:
+            with socket.socket() as sock:
+                sock.bind(("127.0.0.1", 0))
+                address = "127.0.0.1:{}".format(sock.getsockname()[1])
+        else:
+            address = "unix:{}".format(
+                os.path.join(directory, "worker_{}.sock".format(worker_idx))
+            )
+        command = [sys.executable, "-m", "carla_integration.remote"]
+        command += ["--env", ENV_ID, "--n-envs", str(n_envs), "--address", address]
+        processes.append(subprocess.Popen(command, stdout=subprocess.DEVNULL))
+        addresses.append(address)
+    return processes, addresses
+
+
+def connect_remote(addresses, retries=100):
+    for _ in range(retries):
+        try:
+            return RemoteVecEnv(addresses)
+        except (ConnectionRefusedError, FileNotFoundError):
+            time.sleep(0.1)
+    raise ConnectionError("The workers did not start")
+
+
+def segmentation_frames(n_frames, rng, shape=(256, 256, 12)):
+    """Blocky label images, compressing like the semantic segmentation cameras"""
+    labels = rng.integers(0, 23, size=(n_frames, 16, 16, shape[2]), dtype=np.uint8)
+    return labels.repeat(shape[0] // 16, axis=1).repeat(shape[1] // 16, axis=2)
+
+
+def measure_codec(n_frames, rng):
+    frames = segmentation_frames(n_frames, rng)
+    left, right = socket.socketpair()
+    try:
+        for level in (0, 1, 6):
+            # The frames are received in another thread, as by a client
+            receiver = threading.Thread(
+                target=lambda: [receive_message(right) for _ in frames]
+            )
+            start_time = time.perf_counter()
+            receiver.start()
+            size = 0
+            for frame in frames:
+                size += send_message(left, {}, {"image": frame}, level)
+            receiver.join()
+            elapsed = time.perf_counter() - start_time
+            print(
+                "zlib level {}: {:.1f} KB/frame ({:.1f}x), {:.2f} ms/frame".format(
+                    level,
+                    size / n_frames / 1024,
+                    frames[0].nbytes * n_frames / size,
+                    1000 * elapsed / n_frames,
+                )
+            )
+    finally:
+        left.close()
+        right.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n-envs", type=int, default=256)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--steps", type=int, default=200)
+    parser.add_argument(
+        "--tcp", action="store_true", help="TCP instead of Unix sockets"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print("\n{:<24} {:>8} {:>14}".format("Env", "Envs", "Steps/s"))
+    in_process = NATIVE_VEC_ENVS[ENV_ID](args.n_envs, seed=args.seed)
+    print(
+        "{:<24} {:>8} {:>14.0f}".format(
+            "in-process", args.n_envs, measure(in_process, args.steps, args.seed)
+        )
+    )
+
+    directory = tempfile.mkdtemp()
+    for n_workers in args.workers:
+        processes, addresses = start_workers(
+            n_workers, args.n_envs // n_workers, args.tcp, directory
+        )
+        try:
+            remote = connect_remote(addresses)
+            steps_per_sec = measure(remote, args.steps, args.seed)
+            remote.close(shutdown=True)
+        finally:
+            for process in processes:
+                try:
+                    process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+        print(
+            "{:<24} {:>8} {:>14.0f}".format(
+                "{} remote worker(s)".format(n_workers), remote.num_envs, steps_per_sec
+            )
+        )
+
+    print("\nCamera stack codec (256x256x12 semantic segmentation):")
+    measure_codec(50, np.random.default_rng(args.seed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""Checks that the offline reward engine reproduces the online reward and done flags of
+the Experiment on synthetic trajectories, and compares their speed.
+
+The online path runs Experiment.update_events, get_done_status and compute_reward tick
+by tick, reading the recorded hero state through a replay of the hero actor.
+
+Usage: python -m benchmarks.reward_parity [--episodes 50] [--ticks 400] [--geodesic]
+"""
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+import carla
+import numpy as np
+
+from config import read_config
+from experiment.distance_fields import compute_distance_fields
+from experiment.experiment import Experiment
+from experiment.offline_reward import compute_rewards
+from experiment.scenarios import parse_location
+
+
+class ReplayHero(object):
+    """Exposes the recorded state of a tick through the hero actor methods"""
+
+    def __init__(self):
+        self.location = None
+        self.velocity = None
+
+    def get_location(self):
+        return self.location
+
+    def get_velocity(self):
+        return self.velocity
+
+    def get_transform(self):
+        return carla.Transform(self.location)
+
+
+class ReplayCore(object):
+    def __init__(self):
+        self.hero = ReplayHero()
+        self.parked = False
+        self.goal_location = None
+        self.distance_fields = None
+
+
+def make_trajectories(n_episodes, n_ticks, rng):
+    """Random drives with idle stretches, collisions and parking events"""
+    speed = rng.uniform(0, 15, size=(n_episodes, n_ticks))
+    idle = rng.random((n_episodes, n_ticks // 10)) < 0.3
+    speed[np.repeat(idle, 10, axis=1)[:, :n_ticks]] = 0.0
+    heading = np.cumsum(rng.normal(0, 0.1, size=(n_episodes, n_ticks)), axis=1)
+    velocity = np.stack(
+        [speed * np.cos(heading), speed * np.sin(heading), np.zeros_like(speed)],
+        axis=2,
+    )
+    location = np.cumsum(velocity[..., :2] * 0.05, axis=1) + [-38.0, -30.0]
+
+    collision = np.zeros((n_episodes, n_ticks, 4))
+    events = rng.random((n_episodes, n_ticks)) < 0.005
+    collision[events, 0] = rng.integers(1, 3, size=events.sum())
+    collision[events, 1] = rng.uniform(0, 2000, size=events.sum())
+    collision[events, 2] = collision[events, 1]
+    parked = np.zeros((n_episodes, n_ticks), dtype=bool)
+    parked[rng.random(n_episodes) < 0.2, -n_ticks // 4 :] = True
+
+    return {
+        "location": location.astype(np.float32),
+        "velocity": velocity.astype(np.float32),
+        "collision": collision,
+        "goal_location": rng.uniform(-45, -25, size=(n_episodes, 2)).astype(np.float32),
+        "length": rng.integers(n_ticks // 2, n_ticks + 1, size=n_episodes),
+        "parked": parked,
+    }
+
+
+def add_goal_distance(trajectories, exp_config, rng, n_parked=30):
+    """Scores the trajectories with the geodesic goal distance of a random layout
+    around the configured goal, which all the episodes share. Returns its fields"""
+    parking_points = np.stack(
+        [
+            parse_location(point)
+            for point in exp_config["background_activity"]["parking_points"]
+        ]
+    )
+    goal = parse_location(exp_config["hero"]["goal_boundary"]["center"])
+    slots = np.flatnonzero(np.linalg.norm(parking_points - goal, axis=1) > 0.1)
+    parked = parking_points[rng.choice(slots, size=n_parked, replace=False)]
+    fields = compute_distance_fields(exp_config, parked, goal)
+
+    trajectories["goal_location"][:] = goal[:2]
+    trajectories["goal_distance"] = fields.goal_distance(trajectories["location"])
+    return fields
+
+
+def run_online(experiment, trajectories, distance_fields=None):
+    """Scores the trajectories tick by tick with the online methods"""
+    n_episodes, n_ticks = trajectories["parked"].shape
+    results = {
+        key: np.zeros((n_episodes, n_ticks))
+        for key in ("reward", "terminated", "truncated")
+    }
+    core = ReplayCore()
+    core.distance_fields = distance_fields
+    for episode in range(n_episodes):
+        experiment.reset()
+        goal = trajectories["goal_location"][episode]
+        core.goal_location = carla.Location(x=float(goal[0]), y=float(goal[1]))
+        for tick in range(trajectories["length"][episode]):
+            x, y = trajectories["location"][episode, tick]
+            vx, vy, vz = trajectories["velocity"][episode, tick]
+            core.hero.location = carla.Location(x=float(x), y=float(y))
+            core.hero.velocity = carla.Vector3D(float(vx), float(vy), float(vz))
+            core.parked = bool(trajectories["parked"][episode, tick])
+
+            experiment.update_events(
+                {"collision": (tick, trajectories["collision"][episode, tick])}
+            )
+            truncated, terminated = experiment.get_done_status(None, core)
+            reward = experiment.compute_reward(None, core)
+            results["reward"][episode, tick] = reward
+            results["terminated"][episode, tick] = terminated
+            results["truncated"][episode, tick] = truncated
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--episodes", type=int, default=50)
+    parser.add_argument("--ticks", type=int, default=400)
+    parser.add_argument("--max-time-idle", type=int, default=40)
+    parser.add_argument("--max-time-episode", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--geodesic", action="store_true", help="Geodesic distance to the goal"
+    )
+    args = parser.parse_args()
+
+    exp_config = read_config()["experiment"]
+    exp_config["max_time_idle"] = args.max_time_idle
+    exp_config["max_time_episode"] = args.max_time_episode
+    rng = np.random.default_rng(args.seed)
+    trajectories = make_trajectories(args.episodes, args.ticks, rng)
+    distance_fields = None
+    if args.geodesic:
+        exp_config["distance_fields"]["goal_distance"] = "geodesic"
+        distance_fields = add_goal_distance(trajectories, exp_config, rng)
+
+    # The online methods print the done causes and log the collisions to a file
+    experiment = Experiment(exp_config)
+    current_dir = os.getcwd()
+    os.chdir(tempfile.mkdtemp())
+    try:
+        start_time = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            online = run_online(experiment, trajectories, distance_fields)
+        online_time = time.perf_counter() - start_time
+    finally:
+        os.chdir(current_dir)
+
+    start_time = time.perf_counter()
+    offline = compute_rewards(trajectories, exp_config)
+    offline_time = time.perf_counter() - start_time
+
+    n_ticks = int(trajectories["length"].sum())
+    mismatches = 0
+    for key in ("reward", "terminated", "truncated"):
+        different = np.count_nonzero(online[key] != offline[key])
+        mismatches += different
+        print(
+            "{:<12} mismatching ticks: {} (max abs diff {:.3g})".format(
+                key, different, np.abs(online[key] - offline[key]).max()
+            )
+        )
+    print(
+        "\nOnline:  {:.3f}s ({:.0f} ticks/s)".format(online_time, n_ticks / online_time)
+    )
+    print(
+        "Offline: {:.3f}s ({:.0f} ticks/s), {:.0f}x faster".format(
+            offline_time, n_ticks / offline_time, online_time / offline_time
+        )
+    )
+    if mismatches:
+        raise SystemExit("The offline rewards do not match the online ones")
+    print("Parity OK over {} ticks".format(n_ticks))
+
+
+if __name__ == "__main__":
+    main()
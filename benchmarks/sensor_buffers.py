@@ -0,0 +1,157 @@
+"""Compares the memory allocated while parsing sensor data with the preallocated
+double buffers against allocating new arrays every frame (the previous behaviour),
+using tracemalloc. The sensors are fed synthetic measurements, no server is needed.
+
+Usage: python -m benchmarks.sensor_buffers [--frames 500]
+"""
+import argparse
+import copy
+import time
+import tracemalloc
+
+import numpy as np
+
+from helper.sensors.sensors import BaseCamera, Lidar, Radar, SemanticLidar
+
+
+class Attribute(object):
+    def __init__(self, value):
+        self.value = value
+
+    def as_int(self):
+        return int(self.value)
+
+    def as_float(self):
+        return float(self.value)
+
+
+class Blueprint(object):
+    def __init__(self, **attributes):
+        self.attributes = attributes
+
+    def get_attribute(self, name):
+        return Attribute(self.attributes[name])
+
+
+class Measurement(object):
+    """Synthetic sensor measurement exposing the fields used by the parsers"""
+
+    def __init__(self, raw_data, width=0, height=0):
+        self.raw_data = raw_data
+        self.width = width
+        self.height = height
+
+    def convert(self, color_converter):
+        pass
+
+
+def allocating_camera_parse(sensor_data):
+    array = np.frombuffer(sensor_data.raw_data, dtype=np.dtype("uint8"))
+    array = np.reshape(array, (sensor_data.height, sensor_data.width, 4))
+    return np.ascontiguousarray(array[:, :, :3][:, :, ::-1])
+
+
+def allocating_lidar_parse(sensor_data):
+    points = np.frombuffer(sensor_data.raw_data, dtype=np.dtype("f4"))
+    points = copy.deepcopy(points)
+    return np.reshape(points, (int(points.shape[0] / 4), 4))
+
+
+def allocating_radar_parse(sensor_data):
+    points = np.frombuffer(sensor_data.raw_data, dtype=np.dtype("f4"))
+    points = copy.deepcopy(points)
+    points = np.reshape(points, (int(points.shape[0] / 4), 4))
+    return np.ascontiguousarray(np.flip(points, 1))
+
+
+def make_sensor(sensor_class, blueprint):
+    # Only the parsing is benchmarked, so the CARLA actor isn't spawned
+    sensor = sensor_class.__new__(sensor_class)
+    sensor.create_buffers(blueprint)
+    return sensor
+
+
+def measure(parse, measurements):
+    """Returns the time and the memory allocated per frame, and the memory kept alive"""
+    tracemalloc.start()
+    kept = None
+    allocated = 0
+    start_time = time.perf_counter()
+    for measurement in measurements:
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        kept = parse(measurement)
+        _, peak = tracemalloc.get_traced_memory()
+        allocated += peak - current
+    elapsed = time.perf_counter() - start_time
+    kept_memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    n_frames = len(measurements)
+    return elapsed / n_frames, allocated / n_frames, kept_memory
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=500)
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+
+    camera_data = rng.integers(0, 255, (256, 256, 4), dtype=np.uint8).tobytes()
+    lidar_points = [int(n) for n in rng.integers(4500, 5600, args.frames)]
+    lidar_data = rng.random(5600 * 4, dtype=np.float32).tobytes()
+    radar_data = rng.random(1500 * 4, dtype=np.float32).tobytes()
+    semantic_lidar_data = rng.integers(0, 255, 5600 * 24, dtype=np.uint8).tobytes()
+
+    lidar_blueprint = Blueprint(points_per_second=56000, rotation_frequency=10)
+    cases = [
+        (
+            "camera 256x256",
+            make_sensor(BaseCamera, Blueprint(image_size_x=256, image_size_y=256)),
+            allocating_camera_parse,
+            [Measurement(camera_data, 256, 256)] * args.frames,
+        ),
+        (
+            "lidar",
+            make_sensor(Lidar, lidar_blueprint),
+            allocating_lidar_parse,
+            [Measurement(lidar_data[: 16 * n]) for n in lidar_points],
+        ),
+        (
+            "semantic lidar",
+            make_sensor(SemanticLidar, lidar_blueprint),
+            None,
+            [Measurement(semantic_lidar_data[: 24 * n]) for n in lidar_points],
+        ),
+        (
+            "radar",
+            make_sensor(Radar, Blueprint(points_per_second=1500)),
+            allocating_radar_parse,
+            [Measurement(radar_data)] * args.frames,
+        ),
+    ]
+
+    print(
+        "{:<16} {:<12} {:>12} {:>18} {:>14}".format(
+            "Sensor", "Parse", "Time (us)", "Allocated/frame", "Kept (KB)"
+        )
+    )
+    for name, sensor, allocating_parse, measurements in cases:
+        strategies = [("pooled", sensor.parse)]
+        if allocating_parse is not None:
+            strategies.insert(0, ("allocating", allocating_parse))
+        for strategy, parse in strategies:
+            frame_time, allocated, kept_memory = measure(parse, measurements)
+            print(
+                "{:<16} {:<12} {:>12.1f} {:>15.1f} KB {:>14.1f}".format(
+                    name,
+                    strategy,
+                    1e6 * frame_time,
+                    allocated / 1024,
+                    kept_memory / 1024,
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Measures the time to spawn the hero's sensor rig until its first frame, spawning the
+sensors one by one against spawning the whole rig in a single batch.
+
+Usage: python -m benchmarks.sensor_rig [--repeats 20]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from carla_integration.core import CarlaCore
+from config import read_config
+from helper.sensors.sensor_factory import SensorFactory
+
+
+def spawn_sequential(core):
+    """Previous behaviour: a blueprint library lookup and a spawn per sensor"""
+    for name, attributes in core.exp_config["hero"]["sensors"].items():
+        SensorFactory.spawn(name, attributes, core.sensor_interface, core.hero)
+    core.sensor_interface.get_data(core.world.tick(), parse=False)
+
+
+def measure(core, spawn, repeats):
+    """Returns the spawn times in ms"""
+    spawn_times = []
+    for _ in range(repeats):
+        core.sensor_interface.destroy()
+        core.world.tick()
+        start_time = time.perf_counter()
+        spawn(core)
+        spawn_times.append(1000 * (time.perf_counter() - start_time))
+    return np.array(spawn_times)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    config = read_config()
+    core = CarlaCore(config["carla"], config["experiment"])
+
+    results = []
+    try:
+        core.setup_experiment()
+        core.spawn_hero()
+        for label, spawn in (
+            ("sequential", spawn_sequential),
+            ("batched rig", CarlaCore.spawn_sensors),
+        ):
+            results.append((label, measure(core, spawn, args.repeats)))
+    finally:
+        core.stop_server()
+
+    n_sensors = len(config["experiment"]["hero"]["sensors"])
+    print("\n{} sensors".format(n_sensors))
+    print("{:<14} {:>12} {:>12}".format("Spawn", "Mean (ms)", "p95 (ms)"))
+    for label, spawn_times in results:
+        print(
+            "{:<14} {:>12.2f} {:>12.2f}".format(
+                label, spawn_times.mean(), np.percentile(spawn_times, 95)
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
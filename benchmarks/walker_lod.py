@@ -0,0 +1,74 @@
+"""Measures the tick time against the number of background walkers, with and without
+the walker activity level of detail.
+
+Usage: python -m benchmarks.walker_lod [--walkers 0 20 40 60] [--ticks 300]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from carla_integration.core import CarlaCore
+from config import read_config
+
+
+def measure_ticks(core, n_ticks):
+    """Returns the tick times in ms, after a short warm-up"""
+    for _ in range(20):
+        core.tick(None)
+    tick_times = []
+    for _ in range(n_ticks):
+        start_time = time.perf_counter()
+        core.tick(None)
+        tick_times.append(1000 * (time.perf_counter() - start_time))
+    return np.array(tick_times)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--walkers", type=int, nargs="+", default=[0, 20, 40, 60])
+    parser.add_argument("--ticks", type=int, default=300)
+    args = parser.parse_args()
+
+    config = read_config()
+    background_config = config["experiment"]["background_activity"]
+    radius = background_config["walker_lod_radius"] or 40.0
+    core = CarlaCore(config["carla"], config["experiment"])
+
+    results = []
+    try:
+        core.setup_experiment()
+        for n_walkers in args.walkers:
+            background_config["n_walkers"] = [n_walkers]
+            for lod_radius in (0.0, radius):
+                core.walker_lod.radius = lod_radius
+                core.walker_lod.enabled = lod_radius > 0
+
+                core.destroy()
+                core.spawn_hero()
+                core.spawn_walkers()
+                tick_times = measure_ticks(core, args.ticks)
+                n_active = core.walker_lod.n_active if lod_radius > 0 else n_walkers
+                results.append((len(core.walkers), lod_radius, n_active, tick_times))
+    finally:
+        core.stop_server()
+
+    print(
+        "\n{:>8} {:>10} {:>8} {:>12} {:>12}".format(
+            "Walkers", "LOD (m)", "Active", "Mean (ms)", "p95 (ms)"
+        )
+    )
+    for n_walkers, lod_radius, n_active, tick_times in results:
+        print(
+            "{:>8} {:>10} {:>8} {:>12.2f} {:>12.2f}".format(
+                n_walkers,
+                "off" if lod_radius == 0 else lod_radius,
+                n_active,
+                tick_times.mean(),
+                np.percentile(tick_times, 95),
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,44 @@
 from gymnasium import register
 
-from config import read_config
 
-CONFIG = read_config()
+def make_carla_env(**kwargs):
+    """Entry point of Carla-v1. The environment (and its configuration) is only
+    loaded once the environment is made, keeping the package import cheap"""
+    from gymnasium.wrappers import TimeLimit
+
+    from carla_integration.env import CarlaEnv
+
+    env = CarlaEnv(**kwargs)
+    return TimeLimit(env, max_episode_steps=env.max_episode_steps)
+
+
+def make_kinematic_env(**kwargs):
+    """Entry point of CarlaKinematic-v0, the server-free kinematic parking simulator"""
+    from gymnasium.wrappers import TimeLimit
+
+    from carla_integration.kinematic_env import KinematicEnv
+
+    env = KinematicEnv(**kwargs)
+    return TimeLimit(env, max_episode_steps=env.max_episode_steps)
+
+
+def make_kinematic_vec_env(n_envs, seed=None):
+    from carla_integration.kinematic_env import KinematicVecEnv
+
+    return KinematicVecEnv(n_envs, seed=seed)
+
+
+# Envs with their own vectorized implementation, created instead of make_vec_env
+NATIVE_VEC_ENVS = {"CarlaKinematic-v0": make_kinematic_vec_env}
+
 
 register(
     id="Carla-v1",
-    entry_point="carla_integration.env:CarlaEnv",
-    max_episode_steps=CONFIG["experiment"]["max_time_episode"],
+    entry_point=make_carla_env,
+    reward_threshold=300.0,
+)
+register(
+    id="CarlaKinematic-v0",
+    entry_point=make_kinematic_env,
     reward_threshold=300.0,
 )
@@ -1,4 +1,5 @@
 import logging
+import math
 import os
 import random
 import subprocess
@@ -7,11 +8,36 @@ import time
 import carla
 import numpy as np
 
-from helper.carla_helper import is_used
+from carla_integration.render_budget import RenderBudget
+from carla_integration.snapshot import EpisodeSnapshot
+from carla_integration.walker_lod import WalkerLOD
+from carla_integration.watchdog import TickWatchdog
+from experiment.distance_fields import DistanceFieldCache, is_enabled
+from helper.carla_helper import get_map_layers, is_used, kill_process_tree
 from helper.sensors.sensor_factory import SensorFactory
 from helper.sensors.sensor_interface import SensorInterface
 
 
+def transform_to_array(transform):
+    location, rotation = transform.location, transform.rotation
+    return [
+        location.x,
+        location.y,
+        location.z,
+        rotation.pitch,
+        rotation.yaw,
+        rotation.roll,
+    ]
+
+
+def array_to_transform(array):
+    x, y, z, pitch, yaw, roll = map(float, array)
+    return carla.Transform(
+        carla.Location(x=x, y=y, z=z),
+        carla.Rotation(pitch=pitch, yaw=yaw, roll=roll),
+    )
+
+
 class CarlaCore:
     def __init__(self, carla_config, exp_config):
         self.carla_config = carla_config
@@ -19,8 +45,11 @@ class CarlaCore:
 
         self.client = None
         self.world = None
+        self.blueprint_library = None
         self.map = None
         self.traffic_manager = None
+        self.map_layers = carla.MapLayer.All
+        self.map_load_time = None
 
         self.hero = None
         self.spawn_point = None
@@ -28,8 +57,18 @@ class CarlaCore:
         self.parked = False
         self.goal_boundary = None
         self.goal_location = None
-
-        self.sensor_interface = SensorInterface()
+        self.scenario_layout = None
+        self.distance_field_cache = None
+        self.distance_fields = None
+        # Random choices of the live layouts, seeded by the env's reset
+        self.random = random.Random()
+        self.ground_heights = {}  # {(town, x, y): z}
+
+        self.sensor_interface = SensorInterface(
+            queue_timeout=self.carla_config["tick_deadline"]
+        )
+        self.watchdog = TickWatchdog(self, self.carla_config)
+        self.render_budget = RenderBudget(self.carla_config, self.exp_config)
 
         self.mode = self.exp_config["mode"]
         self.scenario = self.exp_config["scenario"]
@@ -40,9 +79,13 @@ class CarlaCore:
         self.walkers = []
         self.all_id = []
         self.all_walkers = []
+        self.walker_targets = []
+        self.walker_speeds = []
 
+        self.server_process = None
         self.init_server()
         self.connect_client()
+        self.walker_lod = WalkerLOD(self.client, self.exp_config["background_activity"])
 
     def init_server(self):
         self.server_port = random.randint(15000, 32000)
@@ -77,22 +120,28 @@ class CarlaCore:
         server_command += [
             "--carla-rpc-port={}".format(self.server_port),
         ]
+        # Boot straight into the experiment's town so the first load_map can reuse it.
+        # Unreal only reads the map when it is the first argument
+        server_command.insert(1, "/Game/Carla/Maps/{}".format(self.exp_config["town"]))
 
         server_command_text = " ".join(map(str, server_command))
         print(server_command_text)
-        server_process = subprocess.Popen(
+        self.server_process = subprocess.Popen(
             server_command_text,
             shell=True,
             creationflags=subprocess.CREATE_NEW_PROCESS_GROUP,
             stdout=open(os.devnull, "w"),
         )
 
-    def connect_client(self):
-        for i in range(self.carla_config["retries_on_error"]):
+    def connect_client(self, retries=None):
+        if retries is None:
+            retries = self.carla_config["retries_on_error"]
+        for i in range(retries):
             try:
                 self.client = carla.Client(self.carla_config["host"], self.server_port)
                 self.client.set_timeout(self.carla_config["timeout"])
                 self.world = self.client.get_world()
+                self.blueprint_library = self.world.get_blueprint_library()
 
                 settings = self.world.get_settings()
                 settings.no_rendering_mode = not self.carla_config["enable_rendering"]
@@ -105,7 +154,7 @@ class CarlaCore:
             except Exception as e:
                 print(
                     " Waiting for server to be ready: {}, attempt {} of {}".format(
-                        e, i + 1, self.carla_config["retries_on_error"]
+                        e, i + 1, retries
                     )
                 )
                 time.sleep(5)
@@ -114,16 +163,49 @@ class CarlaCore:
             "Cannot connect to server. Try increasing 'timeout' or 'retries_on_error' at the carla configuration"
         )
 
+    def load_map(self, town, map_layers, force=False):
+        """Loads the town with the given map layers, reusing the map already loaded
+        in the server when possible (the server boots into the experiment's town with
+        all the layers). Returns the time spent, in seconds"""
+        start_time = time.time()
+
+        current_town = self.world.get_map().name.split("/")[-1]
+        if force or current_town != town:
+            self.world = self.client.load_world(
+                map_name=town,
+                reset_settings=False,
+                map_layers=map_layers,
+            )
+            action = "Loaded"
+        elif self.map_layers != map_layers:
+            # Layers can only be toggled on the '_Opt' versions of the towns
+            self.world.unload_map_layer(carla.MapLayer.All)
+            self.world.load_map_layer(map_layers)
+            self.world.tick()
+            action = "Reused (layers updated)"
+        else:
+            action = "Reused"
+        self.map_layers = map_layers
+
+        self.map_load_time = time.time() - start_time
+        print(
+            "{} map {} with layers {} in {:.2f}s".format(
+                action, town, map_layers, self.map_load_time
+            )
+        )
+        return self.map_load_time
+
     def setup_experiment(self):
-        self.world = self.client.load_world(
-            map_name=self.exp_config["town"],
-            reset_settings=False,
-            map_layers=carla.MapLayer.All
-            if self.carla_config["enable_map_assets"]
-            else carla.MapLayer.NONE,
+        self.load_map(
+            self.exp_config["town"],
+            get_map_layers(
+                self.carla_config["map_layers"],
+                self.carla_config["enable_map_assets"],
+            ),
         )
 
         self.map = self.world.get_map()
+        self.render_budget.set_world(self.world)
 
         weather = getattr(carla.WeatherParameters, self.exp_config["weather"])
         self.world.set_weather(weather)
@@ -159,27 +241,85 @@ class CarlaCore:
         # for point in self.goal_boundary:
         #     self.world.debug.draw_point(point, size=0.05, life_time=0)
 
-        top_left = eval(self.exp_config["hero"]["goal_boundary"]["top_left"])
-        top_right = eval(self.exp_config["hero"]["goal_boundary"]["top_right"])
-        bottom_left = eval(self.exp_config["hero"]["goal_boundary"]["bottom_left"])
-        bottom_right = eval(self.exp_config["hero"]["goal_boundary"]["bottom_right"])
+        # The distance fields of each layout are computed with its goal
+        if is_enabled(self.exp_config["distance_fields"]):
+            self.distance_field_cache = DistanceFieldCache(self.exp_config)
+
         center = eval(self.exp_config["hero"]["goal_boundary"]["center"])
+        self.set_goal(center)
+
+    def set_town(self, town):
+        """Switches the experiment to another town. The map is only loaded if needed"""
+        if town == self.exp_config["town"]:
+            return
+        self.forget_actors(destroy=True)
+        self.exp_config["town"] = town
+        self.load_map(
+            town,
+            get_map_layers(
+                self.carla_config["map_layers"],
+                self.carla_config["enable_map_assets"],
+            ),
+        )
+        self.map = self.world.get_map()
+        self.render_budget.set_world(self.world)
+        self.world.set_weather(
+            getattr(carla.WeatherParameters, self.exp_config["weather"])
+        )
+
+    def set_goal(self, center):
+        """Places the goal boundary, as defined at the configuration, around the center"""
+        goal_config = self.exp_config["hero"]["goal_boundary"]
+        default_center = eval(goal_config["center"])
+        offset = center - default_center
+
+        top_left = eval(goal_config["top_left"]) + offset
+        top_right = eval(goal_config["top_right"]) + offset
+        bottom_left = eval(goal_config["bottom_left"]) + offset
+        bottom_right = eval(goal_config["bottom_right"]) + offset
 
+        self.goal_boundary = [top_left, top_right, bottom_left, bottom_right, center]
         self.goal_location = center
 
         extent_x = (top_left.x - top_right.x) / 2
         extent_y = (top_left.y - bottom_left.y) / 2
         extent_z = 0
 
-        self.world.debug.draw_box(
-            carla.BoundingBox(
-                center,
-                carla.Vector3D(extent_x, extent_y, extent_z),
-            ),
-            carla.Rotation(pitch=0, yaw=0, roll=0),
-            thickness=0.2,
-            color=carla.Color(r=255, g=0, b=0),
-            life_time=0,
+        if self.render_budget.should_draw(("goal", center.x, center.y)):
+            self.world.debug.draw_box(
+                carla.BoundingBox(
+                    center,
+                    carla.Vector3D(extent_x, extent_y, extent_z),
+                ),
+                carla.Rotation(pitch=0, yaw=0, roll=0),
+                thickness=0.2,
+                color=carla.Color(r=255, g=0, b=0),
+                life_time=0,
+            )
+
+        self.update_distance_fields()
+
+    def set_scenario(self, scenario):
+        """Uses the layout of a precomputed Scenario for the next spawns"""
+        self.scenario_layout = scenario
+        if scenario is not None:
+            self.set_goal(carla.Location(*map(float, scenario.goal_location)))
+        else:
+            self.update_distance_fields()
+
+    def update_distance_fields(self):
+        """Gets the distance fields of the current layout, if enabled"""
+        if self.distance_field_cache is None:
+            return
+        parked_locations, parking_points = [], None
+        if self.scenario_layout is not None:
+            parked_locations = self.scenario_layout.parked_locations
+            parking_points = self.scenario_layout.parking_points
+        self.distance_fields = self.distance_field_cache.get(
+            self.exp_config["town"],
+            parked_locations,
+            [self.goal_location.x, self.goal_location.y],
+            parking_points,
         )
 
     def spawn_hero(self):
@@ -187,18 +327,24 @@ class CarlaCore:
         if self.hero is not None:
             self.hero.destroy()
             self.hero = None
+        self.parked = False
 
         # Destroy all hero's sensors
         self.sensor_interface.destroy()
 
         self.world.tick()
 
-        spawn_point_loc = eval(self.exp_config["hero"]["spawn_point_loc"])
-        spawn_point_rot = eval(self.exp_config["hero"]["spawn_point_rot"])
+        if self.scenario_layout is not None:
+            x, y, z, pitch, yaw, roll = map(float, self.scenario_layout.hero_start)
+            spawn_point_loc = carla.Location(x=x, y=y, z=z)
+            spawn_point_rot = carla.Rotation(pitch=pitch, yaw=yaw, roll=roll)
+        else:
+            spawn_point_loc = eval(self.exp_config["hero"]["spawn_point_loc"])
+            spawn_point_rot = eval(self.exp_config["hero"]["spawn_point_rot"])
         hero_spawn_point = carla.Transform(spawn_point_loc, spawn_point_rot)
 
         hero_model = "".join(self.exp_config["hero"]["model"])
-        hero_blueprint = self.world.get_blueprint_library().find(hero_model)
+        hero_blueprint = self.blueprint_library.find(hero_model)
         hero_blueprint.set_attribute("role_name", "hero")
 
         self.hero = self.world.spawn_actor(hero_blueprint, hero_spawn_point)
@@ -207,70 +353,236 @@ class CarlaCore:
                 f"Error spawning hero: {hero_blueprint} at point {hero_spawn_point} index {self.hero_spawn_point_id}"
             )
 
-        self.world.tick()
+        print("Hero spawned!")
+        self.spawn_sensors()
+
+    def spawn_sensors(self):
+        """Spawns the hero's sensor rig in a single batch and waits for its first frame,
+        which is also the first one of the hero"""
+        SensorFactory.spawn_rig(
+            self.exp_config["hero"]["sensors"],
+            self.sensor_interface,
+            self.hero,
+            self.client,
+            self.blueprint_library,
+        )
+        frame = self.world.tick()
+        self.sensor_interface.wait_for_frame(frame)
 
-        if self.hero is not None:
-            print("Hero spawned!")
-            for name, attributes in self.exp_config["hero"]["sensors"].items():
-                sensor = SensorFactory.spawn(
-                    name, attributes, self.sensor_interface, self.hero
+    def rebuild_sensors(self):
+        """Destroys and spawns again the hero's sensors"""
+        print("Rebuilding the hero's sensors")
+        self.sensor_interface.destroy()
+        self.spawn_sensors()
+
+    def reconnect(self):
+        """Connects a new client to the server. The actors of the episode are destroyed"""
+        print("Reconnecting to the server")
+        self.connect_client(retries=self.carla_config["reconnect_retries"])
+        self.walker_lod.client = self.client
+        self.forget_actors(destroy=True)
+        self.render_budget.set_world(self.world)
+
+    def restart_server(self):
+        """Kills the server of this core and starts a new one"""
+        print("Restarting the server")
+        self.stop_server()
+        self.forget_actors(destroy=False)
+        self.init_server()
+        self.connect_client()
+        self.walker_lod.client = self.client
+        self.map_layers = carla.MapLayer.All
+        self.setup_experiment()
+
+    def stop_server(self):
+        """Kills the server process started by this core (and its children)"""
+        if self.server_process is None:
+            return
+        kill_process_tree(self.server_process.pid)
+        self.server_process = None
+
+    def forget_actors(self, destroy):
+        """Drops the references to the actors of the episode, destroying them first
+        through the current client if required"""
+        if destroy:
+            actor_ids = list(self.parked_cars_id) + list(self.all_id)
+            if self.hero is not None:
+                actor_ids.append(self.hero.id)
+            for sensor in self.sensor_interface.sensors.values():
+                if getattr(sensor, "sensor", None) is not None:
+                    actor_ids.append(sensor.sensor.id)
+            self.client.apply_batch(
+                [carla.command.DestroyActor(actor_id) for actor_id in actor_ids]
+            )
+
+        self.sensor_interface.forget()
+        self.hero = None
+        self.parked_cars_id = []
+        self.walkers = []
+        self.all_id = []
+        self.all_walkers = []
+        self.walker_targets = []
+        self.walker_speeds = []
+        self.walker_lod.clear()
+
+    def save_snapshot(self):
+        """Returns an EpisodeSnapshot of the actors, read from the world snapshot of
+        the last tick without any extra round trip"""
+        world_snapshot = self.world.get_snapshot()
+
+        def get_transform(actor_id):
+            return transform_to_array(world_snapshot.find(actor_id).get_transform())
+
+        hero = world_snapshot.find(self.hero.id)
+        velocity = hero.get_velocity()
+        angular_velocity = hero.get_angular_velocity()
+        control = self.hero.get_control()
+
+        walker_transforms = []
+        walker_speeds = []
+        for walker in self.walkers:
+            walker_snapshot = world_snapshot.find(walker["id"])
+            walker_transforms.append(
+                transform_to_array(walker_snapshot.get_transform())
+            )
+            walker_speeds.append(walker_snapshot.get_velocity().length())
+
+        return EpisodeSnapshot(
+            hero_transform=transform_to_array(hero.get_transform()),
+            hero_velocity=[velocity.x, velocity.y, velocity.z],
+            hero_angular_velocity=[
+                angular_velocity.x,
+                angular_velocity.y,
+                angular_velocity.z,
+            ],
+            hero_control=[
+                control.throttle,
+                control.steer,
+                control.brake,
+                control.hand_brake,
+                control.reverse,
+            ],
+            parked_cars=[get_transform(actor_id) for actor_id in self.parked_cars_id],
+            walker_transforms=walker_transforms,
+            walker_speeds=walker_speeds,
+            goal_location=[
+                self.goal_location.x,
+                self.goal_location.y,
+                self.goal_location.z,
+            ],
+            parked=self.parked,
+            town=self.exp_config["town"],
+            scenario_index=getattr(self.scenario_layout, "index", None),
+        )
+
+    def restore_snapshot(self, snapshot):
+        """Moves the spawned actors to the state of the snapshot in one batch. The
+        episode has to be spawned with the layout of the snapshot. If it has fewer
+        walkers, the extra ones keep their spawn state"""
+        if len(snapshot.parked_cars) != len(self.parked_cars_id):
+            raise ValueError(
+                "The snapshot has {} parked cars but the episode has {}".format(
+                    len(snapshot.parked_cars), len(self.parked_cars_id)
                 )
+            )
+        self.set_goal(carla.Location(*map(float, snapshot.goal_location)))
+        self.parked = snapshot.parked
 
-    def hero_parked(self):
-        # Hero's bounding box and transform
-        hero_bounding_box = self.hero.bounding_box
-        extent_x = hero_bounding_box.extent.x
-        extent_y = hero_bounding_box.extent.y
-        hero_location = hero_bounding_box.location
-        hero_rotation = hero_bounding_box.rotation
-
-        left_x = hero_location.x - extent_x
-        right_x = hero_location.x + extent_x
-        top_y = hero_location.y - extent_y
-        bottom_y = hero_location.y + extent_y
-
-        # Goal's bounding box
-        top_left = self.goal_boundary[0]
-        top_right = self.goal_boundary[1]
-        bottom_left = self.goal_boundary[2]
-        bottom_right = self.goal_boundary[3]
-        center = self.goal_boundary[4]
-
-        # Check if the hero is parked
-        if (
-            hero_location.x <= (center.x - 0.25) or hero_location.x >= (center.x + 0.25)
-        ) and (
-            hero_location.y <= (center.y - 0.25) or hero_location.y >= (center.y + 0.25)
+        throttle, steer, brake, hand_brake, reverse = snapshot.hero_control
+        batch = [
+            carla.command.ApplyTransform(
+                self.hero.id, array_to_transform(snapshot.hero_transform)
+            ),
+            carla.command.ApplyTargetVelocity(
+                self.hero.id, carla.Vector3D(*map(float, snapshot.hero_velocity))
+            ),
+            carla.command.ApplyTargetAngularVelocity(
+                self.hero.id,
+                carla.Vector3D(*map(float, snapshot.hero_angular_velocity)),
+            ),
+            carla.command.ApplyVehicleControl(
+                self.hero.id,
+                carla.VehicleControl(
+                    throttle=float(throttle),
+                    steer=float(steer),
+                    brake=float(brake),
+                    hand_brake=bool(hand_brake),
+                    reverse=bool(reverse),
+                ),
+            ),
+        ]
+        for actor_id, transform in zip(self.parked_cars_id, snapshot.parked_cars):
+            batch.append(
+                carla.command.ApplyTransform(actor_id, array_to_transform(transform))
+            )
+        for walker, transform, speed in zip(
+            self.walkers, snapshot.walker_transforms, snapshot.walker_speeds
         ):
-            if (
-                (left_x >= top_left.x)
-                and (right_x <= bottom_right.x)
-                and (top_y >= top_right.y)
-                and (bottom_y <= bottom_left.y)
-            ):
-                self.parked = True
+            batch.append(
+                carla.command.ApplyWalkerState(
+                    walker["id"], array_to_transform(transform), float(speed)
+                )
+            )
 
-    def tick(self, control):
+        for result in self.client.apply_batch_sync(batch, False):
+            if result.error:
+                logging.error(result.error)
+
+    def hero_parked(self):
+        """Whether the hero's footprint is inside the goal boundary, grown by goal_margin.
+        Updates the parked flag, read by the experiment at every step"""
+        transform = self.hero.get_transform()
+        bounding_box = self.hero.bounding_box
+        center = transform.transform(bounding_box.location)
+        yaw = math.radians(transform.rotation.yaw)
+        cos, sin = abs(math.cos(yaw)), abs(math.sin(yaw))
+        footprint_x = bounding_box.extent.x * cos + bounding_box.extent.y * sin
+        footprint_y = bounding_box.extent.x * sin + bounding_box.extent.y * cos
+
+        corners = self.goal_boundary[:4]
+        margin = self.exp_config["hero"]["goal_margin"]
+        min_x = min(corner.x for corner in corners) - margin
+        max_x = max(corner.x for corner in corners) + margin
+        min_y = min(corner.y for corner in corners) - margin
+        max_y = max(corner.y for corner in corners) + margin
+
+        self.parked = (
+            center.x - footprint_x >= min_x
+            and center.x + footprint_x <= max_x
+            and center.y - footprint_y >= min_y
+            and center.y + footprint_y <= max_y
+        )
+        return self.parked
+
+    def tick(self, control, parse=True):
         # Move hero car
         if control is None:
             pass
         else:
             self.apply_hero_control(control)
 
+        return self.watchdog.tick(parse)
+
+    def tick_once(self, parse=True):
         # Tick once the simulation
-        self.world.tick()
+        frame = self.world.tick(self.carla_config["tick_deadline"])
+        self.hero_parked()
+
+        # Freeze or wake up the background walkers
+        if self.walker_lod.enabled:
+            self.walker_lod.update(self.world.get_snapshot(), self.hero.id)
 
         # Move the spectator
-        if self.carla_config["enable_rendering"]:
+        if self.render_budget.enabled:
             self.set_spectator_camera_view()
 
         # Return the new sensor data
-        return self.get_sensor_data()
+        return self.get_sensor_data(frame, parse)
 
     def set_spectator_camera_view(self):
-        transform = self.hero.get_transform()
-
         # Back-view camera
+        # transform = self.hero.get_transform()
+
         # Get the camera position
         # server_view_x = transform.location.x - 5 * transform.get_forward_vector().x
         # server_view_y = transform.location.y - 5 * transform.get_forward_vector().y
@@ -292,9 +604,8 @@ class CarlaCore:
         server_view_yaw = -90
         server_view_pitch = -90
 
-        # Get the spectator and place it on the desired position
-        self.spectator = self.world.get_spectator()
-        self.spectator.set_transform(
+        # Place the spectator on the desired position
+        self.render_budget.update_spectator(
             carla.Transform(
                 carla.Location(x=server_view_x, y=server_view_y, z=server_view_z),
                 carla.Rotation(
@@ -303,74 +614,158 @@ class CarlaCore:
             )
         )
 
-    def get_sensor_data(self):
-        sensor_data = self.sensor_interface.get_data()
+    def get_sensor_data(self, frame=None, parse=True):
+        sensor_data = self.sensor_interface.get_data(frame, parse)
         return sensor_data
 
     def apply_hero_control(self, control):
         self.hero.apply_control(control)
 
     def spawn_parked_cars(self):
-        parking_points = self.exp_config["background_activity"]["parking_points"]
-        parking_points.remove(self.exp_config["hero"]["goal_boundary"]["center"])
+        if self.scenario_layout is not None:
+            self.spawn_scenario_parked_cars(self.scenario_layout)
+            return
+
+        parking_points = [
+            point
+            for point in self.exp_config["background_activity"]["parking_points"]
+            if point != self.exp_config["hero"]["goal_boundary"]["center"]
+        ]
+        if not self.render_budget.should_draw("parking_points"):
+            return
         for point in parking_points:
             point = eval(point)
             self.world.debug.draw_point(
                 point, size=0.05, color=carla.Color(r=0, g=255, b=0), life_time=0
             )
 
-    def spawn_walkers(self):
-        walker_blueprints = self.world.get_blueprint_library().filter(
-            "walker.pedestrian.*"
-        )
+    def spawn_scenario_parked_cars(self, scenario):
+        """Spawns a parked car at each of the slots occupied in the scenario"""
+        vehicle_blueprints = [
+            blueprint
+            for blueprint in self.blueprint_library.filter("vehicle.*")
+            if int(blueprint.get_attribute("number_of_wheels")) == 4
+        ]
+        yaw = self.exp_config["background_activity"]["parked_car_yaw"]
+        scenario_random = random.Random(scenario.seed)
 
-        n_walkers = random.choice(self.exp_config["background_activity"]["n_walkers"])
+        batch = []
+        transforms = []
+        for x, y, z in scenario.parked_locations:
+            blueprint = scenario_random.choice(vehicle_blueprints)
+            blueprint.set_attribute("role_name", "parked")
+            transform = carla.Transform(
+                carla.Location(x=float(x), y=float(y), z=float(z)),
+                carla.Rotation(yaw=yaw),
+            )
+            transforms.append(transform)
+            batch.append(
+                carla.command.SpawnActor(blueprint, transform).then(
+                    carla.command.SetSimulatePhysics(carla.command.FutureActor, False)
+                )
+            )
+        results = self.client.apply_batch_sync(batch, True)
+        spawned = {}
+        for result, transform in zip(results, transforms):
+            if result.error:
+                logging.error(result.error)
+            else:
+                self.parked_cars_id.append(result.actor_id)
+                spawned[result.actor_id] = transform
+
+        # Without physics the cars never settle, lay their boxes on the ground
+        batch = []
+        for actor in self.world.get_actors(list(spawned)):
+            transform = spawned[actor.id]
+            box = actor.bounding_box
+            location = transform.location
+            ground_z = self.get_ground_height(location.x, location.y, location.z)
+            location.z = ground_z - (box.location.z - box.extent.z)
+            batch.append(carla.command.ApplyTransform(actor.id, transform))
+        self.client.apply_batch(batch)
+
+    def get_ground_height(self, x, y, z):
+        """Height of the ground under the point (its own height if none is found),
+        cached per town"""
+        key = (self.exp_config["town"], round(x, 2), round(y, 2))
+        if key not in self.ground_heights:
+            ground = self.world.ground_projection(carla.Location(x=x, y=y, z=z), 5.0)
+            self.ground_heights[key] = z if ground is None else ground.location.z
+        return self.ground_heights[key]
+
+    def spawn_walkers(self):
+        walker_blueprints = self.blueprint_library.filter("walker.pedestrian.*")
 
         percentage_walker_running = 0.0
         percentage_walker_crossing = 0.0
 
         SpawnActor = carla.command.SpawnActor
 
-        spawn_points = []
-        for i in range(n_walkers):
-            spawn_point = carla.Transform()
-            loc = self.world.get_random_location_from_navigation()
-            if loc is not None:
-                spawn_point.location = loc
-                spawn_points.append(spawn_point)
+        if self.scenario_layout is not None:
+            spawn_points = []
+            spawn_blueprints = []
+            for (x, y, z), blueprint_id in zip(
+                self.scenario_layout.walker_start,
+                self.scenario_layout.walker_blueprints,
+            ):
+                spawn_points.append(
+                    carla.Transform(carla.Location(x=float(x), y=float(y), z=float(z)))
+                )
+                spawn_blueprints.append(self.blueprint_library.find(str(blueprint_id)))
+            walker_speed = [float(speed) for speed in self.scenario_layout.walker_speed]
+            walker_target = [
+                carla.Location(x=float(x), y=float(y), z=float(z))
+                for x, y, z in self.scenario_layout.walker_target
+            ]
+        else:
+            n_walkers = self.random.choice(
+                self.exp_config["background_activity"]["n_walkers"]
+            )
+
+            spawn_points = []
+            for i in range(n_walkers):
+                spawn_point = carla.Transform()
+                loc = self.world.get_random_location_from_navigation()
+                if loc is not None:
+                    spawn_point.location = loc
+                    spawn_points.append(spawn_point)
+
+            spawn_blueprints = []
+            walker_speed = []
+            for spawn_point in spawn_points:
+                walker_blueprint = self.random.choice(walker_blueprints)
+                if walker_blueprint.has_attribute("speed"):
+                    speeds = walker_blueprint.get_attribute("speed").recommended_values
+                    if self.random.random() > percentage_walker_running:
+                        walker_speed.append(speeds[1])
+                    else:
+                        walker_speed.append(speeds[2])
+                else:
+                    walker_speed.append(0.0)
+                spawn_blueprints.append(walker_blueprint)
+            walker_target = None
 
         batch = []
-        walker_speed = []
-        for spawn_point in spawn_points:
-            walker_blueprint = random.choice(walker_blueprints)
+        for walker_blueprint, spawn_point in zip(spawn_blueprints, spawn_points):
             if walker_blueprint.has_attribute("is_invicible"):
                 walker_blueprint.set_attribute("is_invicible", "false")
-            if walker_blueprint.has_attribute("speed"):
-                if random.random() > percentage_walker_running:
-                    walker_speed.append(
-                        walker_blueprint.get_attribute("speed").recommended_values[1]
-                    )
-                else:
-                    walker_speed.append(
-                        walker_blueprint.get_attribute("speed").recommended_values[2]
-                    )
-            else:
-                walker_speed.append(0.0)
             batch.append(SpawnActor(walker_blueprint, spawn_point))
         results = self.client.apply_batch_sync(batch, True)
         walker_speed_dummy = []
+        walker_target_dummy = []
         for i in range(len(results)):
             if results[i].error:
                 logging.error(results[i].error)
             else:
                 self.walkers.append({"id": results[i].actor_id})
                 walker_speed_dummy.append(walker_speed[i])
+                if walker_target is not None:
+                    walker_target_dummy.append(walker_target[i])
         walker_speed = walker_speed_dummy
+        walker_target = walker_target_dummy
 
         batch = []
-        controller_blueprint = self.world.get_blueprint_library().find(
-            "controller.ai.walker"
-        )
+        controller_blueprint = self.blueprint_library.find("controller.ai.walker")
         for i in range(len(self.walkers)):
             batch.append(
                 SpawnActor(
@@ -389,13 +784,26 @@ class CarlaCore:
             self.all_id.append(self.walkers[i]["id"])
         self.all_walkers = self.world.get_actors(self.all_id)
 
+        if not walker_target:
+            walker_target = [
+                self.world.get_random_location_from_navigation()
+                for _ in range(len(self.walkers))
+            ]
+        self.walker_targets = walker_target
+        self.walker_speeds = [float(speed) for speed in walker_speed]
+
         self.world.set_pedestrians_cross_factor(percentage_walker_crossing)
         for i in range(0, len(self.all_id), 2):
             self.all_walkers[i].start()
-            self.all_walkers[i].go_to_location(
-                self.world.get_random_location_from_navigation()
-            )
-            self.all_walkers[i].set_max_speed(float(walker_speed[int(i / 2)]))
+            self.all_walkers[i].go_to_location(self.walker_targets[int(i / 2)])
+            self.all_walkers[i].set_max_speed(self.walker_speeds[int(i / 2)])
+
+        self.walker_lod.set_walkers(
+            [walker["id"] for walker in self.walkers],
+            [self.all_walkers[i] for i in range(0, len(self.all_id), 2)],
+            self.walker_targets,
+            self.walker_speeds,
+        )
 
     def destroy(self):
         # Destroy all actors
@@ -404,7 +812,7 @@ class CarlaCore:
             self.client.apply_batch(
                 [carla.command.DestroyActor(x) for x in self.parked_cars_id]
             )
-            self.cars_list = []
+            self.parked_cars_id = []
 
         if len(self.walkers) != 0:
             for i in range(0, len(self.all_id), 2):
@@ -416,3 +824,6 @@ class CarlaCore:
             self.walkers = []
             self.all_id = []
             self.all_walkers = []
+            self.walker_targets = []
+            self.walker_speeds = []
+        self.walker_lod.clear()
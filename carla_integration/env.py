@@ -7,53 +7,292 @@ import gymnasium as gym
 import numpy as np
 
 from carla_integration.core import CarlaCore
+from carla_integration.snapshot import load_snapshots
+from carla_integration.watchdog import EpisodeInterrupted
 from config import read_config
 from experiment.experiment import Experiment
-from helper.carla_helper import kill_server
+from experiment.scenarios import ScenarioBank
+from helper.carla_helper import concat_cameras
+from helper.episode_metrics import EpisodeMetrics
+from helper.video_recorder import VideoRecorder
 
 
 class CarlaEnv(gym.Env):
     metadata = {"render_modes": ["rgb_array"], "render_fps": 30}
 
-    def __init__(self, render_mode: Optional[str] = None):
+    def __init__(self, render_mode: Optional[str] = None, mode: Optional[str] = None):
         self.config = read_config()
         self.carla_config = self.config["carla"]
         self.exp_config = self.config["experiment"]
+        if mode is not None:
+            # Overrides the mode of config.toml, e.g. to evaluate a policy
+            if mode not in ("train", "test"):
+                raise ValueError(
+                    "Unknown mode '{}'. Use 'train' or 'test'".format(mode)
+                )
+            self.exp_config["mode"] = mode
 
         self.core = CarlaCore(self.carla_config, self.exp_config)
         self.core.setup_experiment()
 
         self.experiment = Experiment(self.exp_config)
         self.scenario = self.exp_config["scenario"]
+        self.action_repeat = self.exp_config["action_repeat"]
+        # Steps of max_time_episode, also the limit of the TimeLimit wrapper
+        self.max_episode_steps = -(
+            -self.exp_config["max_time_episode"] // self.action_repeat
+        )
+        self.scenario_banks = {}
+        self.scenario_bank = None
+        self.scenario_bank_path = self.exp_config["scenario_bank"] or None
+        if self.scenario_bank_path:
+            self.scenario_bank = self.load_scenario_bank(self.scenario_bank_path)
+
+        self.snapshots = []
+        if self.exp_config["snapshot_file"]:
+            self.snapshots = load_snapshots(self.exp_config["snapshot_file"])
 
         self.action_space = self.experiment.get_action_space()
         self.observation_space = self.experiment.get_observation_space()
         self.render_mode = render_mode
         self.spec = None
 
+        self.last_observation = None
+        self.recorder = None
+
+        self.metrics = None
+        if self.exp_config["metrics_dir"]:
+            self.metrics = EpisodeMetrics(self.exp_config["metrics_dir"])
+        self.episode = None
+        self.next_options = None
+
     def reset(self, *, seed=None, options=None):
+        reset_start_time = time.perf_counter()
+        if self.episode is not None and self.episode["length"] > 0:
+            # Cut short from the outside, e.g. by the TimeLimit wrapper
+            self.end_episode("interrupted")
+
+        super().reset(seed=seed)
+        if seed is not None:
+            self.core.random.seed(seed)
+        if not options and self.next_options is not None:
+            options, self.next_options = self.next_options, None
+        options = dict(options or {})
+        snapshot = self.get_start_snapshot(options)
+        if snapshot is not None:
+            # Spawn the layout of the snapshot, its state is restored on top
+            options.setdefault("town", snapshot.town)
+            if snapshot.scenario_index is not None:
+                options.setdefault("scenario_index", snapshot.scenario_index)
+            if snapshot.scenario_bank is not None:
+                options.setdefault("scenario_bank", snapshot.scenario_bank)
+        if options.get("town"):
+            self.core.set_town(options["town"])
+        if "scenario_bank" in options:
+            self.scenario_bank_path = options["scenario_bank"]
+            self.scenario_bank = self.load_scenario_bank(self.scenario_bank_path)
+        self.core.set_scenario(self.get_scenario(seed, options))
+
+        # A stall during the reset is recovered by the watchdog, try once more
+        for attempt in range(2):
+            try:
+                sensor_data = self.core.watchdog.run(self.spawn_episode, snapshot)
+                break
+            except EpisodeInterrupted:
+                if attempt == 1:
+                    raise
+        if snapshot is not None:
+            self.experiment.set_state(snapshot.experiment)
+        self.experiment.update_events(sensor_data)
+        observation, info = self.experiment.get_observation(self.core, sensor_data)
+        self.update_render(observation)
+
+        self.core.watchdog.start_episode()
+        now = time.perf_counter()
+        self.episode = {
+            "episode_return": 0.0,
+            "length": 0,
+            "ticks": 0,
+            "reset_time": now - reset_start_time,
+            "start_time": now,
+        }
+
+        return observation, info
+
+    def set_next_options(self, options):
+        """Options of the next reset called without any, e.g. the auto-reset of a
+        VecEnv, which cannot pass them itself"""
+        self.next_options = options
+
+    def spawn_episode(self, snapshot):
+        """Spawns the actors of the episode and returns the sensor data of its first
+        tick"""
         self.experiment.reset()
         self.core.destroy()
         self.core.spawn_hero()
         self.core.spawn_parked_cars()
         self.core.spawn_walkers()
+        if snapshot is not None:
+            self.core.restore_snapshot(snapshot)
+        return self.core.tick(None)
 
-        sensor_data = self.core.tick(None)
-        observation, info = self.experiment.get_observation(self.core, sensor_data)
+    def load_scenario_bank(self, path):
+        """Loads a scenario bank, keeping it in memory for the next episodes"""
+        if path not in self.scenario_banks:
+            self.scenario_banks[path] = ScenarioBank.load(path)
+        return self.scenario_banks[path]
 
-        return observation, info
+    def get_start_snapshot(self, options):
+        """Returns the snapshot to start the episode from, if any: the 'snapshot'
+        option, or one of the snapshot_file with probability snapshot_probability.
+        Only the snapshots of the episode's town and scenario bank are sampled"""
+        if "snapshot" in options:
+            return options.pop("snapshot")
+        if not self.snapshots or (
+            self.np_random.random() >= self.exp_config["snapshot_probability"]
+        ):
+            return None
+        town = options.get("town") or self.exp_config["town"]
+        scenario_bank = options.get("scenario_bank", self.scenario_bank_path)
+        snapshots = [
+            snapshot
+            for snapshot in self.snapshots
+            if snapshot.town in (None, town) and snapshot.scenario_bank == scenario_bank
+        ]
+        if not snapshots:
+            return None
+        return snapshots[int(self.np_random.integers(len(snapshots)))]
+
+    def get_snapshot(self):
+        """Returns an EpisodeSnapshot of the current state of the episode"""
+        snapshot = self.core.save_snapshot()
+        snapshot.experiment = self.experiment.get_state()
+        if snapshot.scenario_index is not None:
+            snapshot.scenario_bank = self.scenario_bank_path
+        return snapshot
+
+    def get_scenario(self, seed, options):
+        """Picks the layout of the episode from the scenario bank, if any. The layout
+        is chosen by the 'scenario_index' option, the seed or randomly"""
+        if self.scenario_bank is None:
+            return None
+
+        if "scenario_index" in options:
+            index = options["scenario_index"]
+        elif seed is not None:
+            index = self.scenario_bank.index_from_seed(seed)
+        else:
+            index = int(self.np_random.integers(len(self.scenario_bank)))
+        return self.scenario_bank.get(index)
 
     def step(self, action):
         control = self.experiment.compute_action(action)
-        sensor_data = self.core.tick(control)
+        # Repeat the control for action_repeat ticks. The done status and reward are
+        # checked every tick, but the sensor data is only parsed at the last one
+        reward = 0
+        try:
+            for repeat in range(self.action_repeat):
+                sensor_data = self.core.tick(
+                    control if repeat == 0 else None, parse=False
+                )
+                self.experiment.update_events(sensor_data)
+                truncated, terminated = self.experiment.get_done_status(None, self.core)
+                reward += self.experiment.compute_reward(None, self.core)
+                if terminated or truncated:
+                    break
+        except EpisodeInterrupted as e:
+            # The simulation was recovered but the episode is lost, truncate it
+            self.update_episode(reward, repeat + 1)
+            info = {"watchdog": e.level, "episode_stats": self.end_episode("stalled")}
+            return self.last_observation, reward, False, True, info
+
+        sensor_data = self.core.sensor_interface.parse_data(sensor_data)
         observation, info = self.experiment.get_observation(self.core, sensor_data)
-        truncated, terminated = self.experiment.get_done_status(observation, self.core)
-        reward = self.experiment.compute_reward(observation, self.core)
+        self.update_render(observation)
+
+        self.update_episode(reward, repeat + 1)
+        if terminated or truncated:
+            info["episode_stats"] = self.end_episode(
+                self.experiment.get_termination_cause()
+            )
+        elif self.episode["length"] >= self.max_episode_steps:
+            # The TimeLimit wrapper truncates this step, before the experiment's own
+            # max_time_episode check (one tick later)
+            truncated = True
+            info["episode_stats"] = self.end_episode("max_time")
 
         return observation, reward, terminated, truncated, info
 
+    def update_episode(self, reward, ticks):
+        self.episode["episode_return"] += reward
+        self.episode["length"] += 1
+        self.episode["ticks"] += ticks
+
+    def end_episode(self, termination):
+        """Returns the metrics of the current episode and records them, if enabled"""
+        episode, self.episode = self.episode, None
+        wall_time = time.perf_counter() - episode["start_time"]
+        sim_time = episode["ticks"] * self.carla_config["timestep"]
+        stats = {
+            "episode_return": episode["episode_return"],
+            "length": episode["length"],
+            "ticks": episode["ticks"],
+            "termination": termination,
+            "wall_time": wall_time,
+            "sim_time": sim_time,
+            "real_time_factor": sim_time / wall_time if wall_time > 0 else 0.0,
+            "reset_time": episode["reset_time"],
+            "collisions": self.experiment.collision_count,
+            "end_timestamp": time.time(),
+            "recoveries": self.core.watchdog.episode_recoveries,
+        }
+        for name, value in self.core.watchdog.get_episode_stats().items():
+            stats["tick_{}_ms".format(name.replace(".", ""))] = value
+        if self.metrics is not None:
+            self.metrics.record(**stats)
+        return stats
+
+    def update_render(self, observation):
+        """Keeps the last observation for render and sends it to the recorder, if any.
+        The mosaic is only built when needed. Encoded observations have no images"""
+        self.last_observation = observation
+        if self.recorder is not None and "image" in observation:
+            self.recorder.add_frame(observation["image"])
+
     def render(self):
-        pass
+        if self.render_mode != "rgb_array" or self.last_observation is None:
+            return None
+        if "image" not in self.last_observation:
+            return None
+        return concat_cameras(self.last_observation["image"])
+
+    def start_recording(self, path, fps=None, max_queue_size=64):
+        """Streams the camera mosaic of every step to a video file, from a background thread"""
+        self.stop_recording()
+        self.recorder = VideoRecorder(
+            path,
+            fps=fps or self.metadata["render_fps"],
+            max_queue_size=max_queue_size,
+            transform=concat_cameras,
+        )
+
+    def stop_recording(self):
+        if self.recorder is not None:
+            recorder, self.recorder = self.recorder, None
+            recorder.close()
 
     def close(self):
-        kill_server()
+        if self.episode is not None and self.episode["length"] > 0:
+            self.end_episode("interrupted")
+        try:
+            self.stop_recording()
+        finally:
+            print(
+                "Tick latency (ms) and recoveries: {}".format(
+                    self.core.watchdog.get_stats()
+                )
+            )
+            if self.metrics is not None:
+                self.metrics.close()
+            # Only this env's server, other envs of the machine may still be running
+            self.core.stop_server()
@@ -0,0 +1,183 @@
+from typing import Optional
+
+import gymnasium as gym
+import numpy as np
+from stable_baselines3.common.vec_env import VecEnv
+
+from config import read_config
+from experiment.kinematic import KinematicParkingSim
+from helper.episode_metrics import TERMINATION_CAUSES
+
+
+class KinematicEpisodes(object):
+    """Episode stats of the simulated envs, with the keys of CarlaEnv.end_episode
+    that make sense without a server"""
+
+    def __init__(self, n_envs, timestep):
+        self.timestep = timestep
+        self.episode_return = np.zeros(n_envs)
+        self.length = np.zeros(n_envs, dtype=np.int64)
+        self.ticks = np.zeros(n_envs, dtype=np.int64)
+
+    def reset(self, env_ids):
+        self.episode_return[env_ids] = 0.0
+        self.length[env_ids] = 0
+        self.ticks[env_ids] = 0
+
+    def update(self, reward, ticks):
+        self.episode_return += reward
+        self.length += 1
+        self.ticks += ticks
+
+    def get_stats(self, env_id, termination, collisions):
+        return {
+            "episode_return": float(self.episode_return[env_id]),
+            "length": int(self.length[env_id]),
+            "ticks": int(self.ticks[env_id]),
+            "termination": termination,
+            "sim_time": self.ticks[env_id] * self.timestep,
+            "collisions": int(collisions),
+        }
+
+
+class KinematicEnv(gym.Env):
+    """Single-env version of the kinematic parking simulator (CarlaKinematic-v0),
+    with the configuration and reset options of CarlaEnv"""
+
+    metadata = {"render_modes": []}
+
+    def __init__(self, render_mode: Optional[str] = None):
+        self.config = read_config()
+        self.exp_config = self.config["experiment"]
+        self.action_repeat = self.exp_config["action_repeat"]
+        self.sim = KinematicParkingSim(
+            self.exp_config, 1, self.config["carla"]["timestep"]
+        )
+        self.episodes = KinematicEpisodes(1, self.sim.timestep)
+        # Also the limit of the TimeLimit wrapper
+        self.max_episode_steps = -(
+            -self.exp_config["max_time_episode"] // self.sim.action_repeat
+        )
+
+        self.action_space = self.sim.get_action_space()
+        self.observation_space = self.sim.get_observation_space()
+        self.render_mode = render_mode
+
+    def reset(self, *, seed=None, options=None):
+        super().reset(seed=seed)
+        if seed is not None:
+            self.sim.rng = np.random.default_rng(seed)
+        options = options or {}
+        self.sim.reset([0], scenario_index=options.get("scenario_index"))
+        self.episodes.reset([0])
+        return self.get_observation(), {}
+
+    def step(self, action):
+        reward, terminated, truncated, ticks = self.sim.step([action])
+        self.episodes.update(reward, ticks)
+
+        info = {}
+        cause = TERMINATION_CAUSES[self.sim.get_termination_cause()[0]]
+        if not (terminated[0] or truncated[0]) and (
+            self.episodes.length[0] >= self.max_episode_steps
+        ):
+            # Truncated by the TimeLimit wrapper, as in KinematicVecEnv
+            truncated[0] = True
+            cause = "max_time"
+        if terminated[0] or truncated[0]:
+            info["episode_stats"] = self.episodes.get_stats(
+                0, cause, self.sim.collision_count[0]
+            )
+        return (
+            self.get_observation(),
+            float(reward[0]),
+            bool(terminated[0]),
+            bool(truncated[0]),
+            info,
+        )
+
+    def get_observation(self):
+        return {key: value[0] for key, value in self.sim.get_observation().items()}
+
+
+class KinematicVecEnv(VecEnv):
+    """The kinematic parking simulator as a natively vectorized SB3 VecEnv, stepping
+    all its envs in lockstep with numpy. Done envs are reset automatically, as in
+    DummyVecEnv, and episodes are truncated after max_time_episode ticks like the
+    TimeLimit wrapper of Carla-v1"""
+
+    def __init__(self, n_envs, seed=None):
+        self.config = read_config()
+        self.exp_config = self.config["experiment"]
+        self.sim = KinematicParkingSim(
+            self.exp_config, n_envs, self.config["carla"]["timestep"], seed=seed
+        )
+        self.episodes = KinematicEpisodes(n_envs, self.sim.timestep)
+        self.max_episode_steps = -(
+            -self.exp_config["max_time_episode"] // self.sim.action_repeat
+        )
+        self.render_mode = None
+        self.actions = None
+        super().__init__(
+            n_envs, self.sim.get_observation_space(), self.sim.get_action_space()
+        )
+
+    def reset(self):
+        if self._seeds[0] is not None:
+            self.sim.rng = np.random.default_rng(self._seeds[0])
+        self._reset_seeds()
+        self.sim.reset(np.arange(self.num_envs))
+        self.episodes.reset(np.arange(self.num_envs))
+        return self.sim.get_observation()
+
+    def step_async(self, actions):
+        self.actions = actions
+
+    def step_wait(self):
+        reward, terminated, truncated, ticks = self.sim.step(self.actions)
+        self.episodes.update(reward, ticks)
+        time_limit = self.episodes.length >= self.max_episode_steps
+        dones = terminated | truncated | time_limit
+
+        infos = [{} for _ in range(self.num_envs)]
+        done_ids = np.flatnonzero(dones)
+        if len(done_ids) > 0:
+            terminal_observation = self.sim.get_observation(done_ids)
+            causes = self.sim.get_termination_cause()
+            causes[time_limit & (causes == 0)] = TERMINATION_CAUSES.index("max_time")
+            for i, env_id in enumerate(done_ids):
+                infos[env_id] = {
+                    "terminal_observation": {
+                        key: value[i] for key, value in terminal_observation.items()
+                    },
+                    "TimeLimit.truncated": bool(
+                        (truncated[env_id] or time_limit[env_id])
+                        and not terminated[env_id]
+                    ),
+                    "episode_stats": self.episodes.get_stats(
+                        env_id,
+                        TERMINATION_CAUSES[causes[env_id]],
+                        self.sim.collision_count[env_id],
+                    ),
+                }
+            self.sim.reset(done_ids)
+            self.episodes.reset(done_ids)
+
+        return self.sim.get_observation(), reward.astype(np.float32), dones, infos
+
+    def close(self):
+        pass
+
+    def get_attr(self, attr_name, indices=None):
+        return [getattr(self, attr_name)] * len(self._get_indices(indices))
+
+    def set_attr(self, attr_name, value, indices=None):
+        setattr(self, attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        """Calls the method of the vec env once, as its envs share it (see get_attr)"""
+        result = getattr(self, method_name)(*method_args, **method_kwargs)
+        return [result] * len(self._get_indices(indices))
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [False] * len(self._get_indices(indices))
@@ -0,0 +1,465 @@
+"""Rollout workers serving vectorized envs over TCP or Unix sockets.
+
+A worker hosts n envs (a VecEnv) and a RemoteVecEnv client fans the steps out to
+several workers, possibly on other hosts, as a single SB3 VecEnv. Every message is a
+length-prefixed frame holding a JSON header and the raw bytes of its numpy arrays.
+uint8 arrays (the camera observations) are zlib-compressed.
+
+Starts a worker:
+    python -m carla_integration.remote --env Carla-v1 --n-envs 1 --address 127.0.0.1:5555
+Addresses are 'host:port' or 'unix:<path>'. Workers only listen on the loopback by
+default. When serving other hosts (e.g. --address 0.0.0.0:5555), set the same shared
+token in the ROLLOUT_WORKER_TOKEN environment variable of the worker and the client.
+"""
+import argparse
+import hmac
+import json
+import os
+import socket
+import struct
+import zlib
+
+import numpy as np
+from gymnasium.spaces import Box, Dict, Discrete
+from stable_baselines3.common.env_util import make_vec_env
+from stable_baselines3.common.vec_env import DummyVecEnv, VecEnv, VecMonitor
+
+from carla_integration import NATIVE_VEC_ENVS
+from experiment.encoder import ENV_WORKER_VARIABLE
+
+FRAME_HEADER = struct.Struct(">II")  # Total size, JSON header size
+TOKEN_VARIABLE = "ROLLOUT_WORKER_TOKEN"
+# Env methods a client can call in the workers
+ENV_METHODS = {"set_next_options"}
+
+
+def parse_address(address):
+    """Returns the socket family and address of 'host:port' or 'unix:<path>'"""
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[len("unix:") :]
+    host, port = address.rsplit(":", 1)
+    return socket.AF_INET, (host, int(port))
+
+
+def connect(address, timeout=None):
+    family, connect_address = parse_address(address)
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    sock.connect(connect_address)
+    if family == socket.AF_INET:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
+def to_json(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError("{} is not JSON serializable".format(type(value).__name__))
+
+
+def send_message(sock, message, arrays=None, compression_level=1):
+    """Sends a JSON-serializable message and a dict of numpy arrays as one frame"""
+    blobs = []
+    message = dict(message, arrays=[])
+    for name, array in (arrays or {}).items():
+        array = np.ascontiguousarray(array)
+        data = array.tobytes()
+        compressed = array.dtype == np.uint8 and compression_level > 0
+        if compressed:
+            data = zlib.compress(data, compression_level)
+        message["arrays"].append(
+            [name, array.dtype.str, list(array.shape), compressed, len(data)]
+        )
+        blobs.append(data)
+
+    header = json.dumps(message, default=to_json).encode()
+    size = FRAME_HEADER.size + len(header) + sum(len(blob) for blob in blobs)
+    sock.sendall(b"".join([FRAME_HEADER.pack(size, len(header)), header] + blobs))
+    return size
+
+
+def receive_exactly(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:], size - received)
+        if n == 0:
+            raise ConnectionError("The connection was closed")
+        received += n
+    return buffer
+
+
+def receive_message(sock):
+    """Returns the message and the dict of arrays of the next frame"""
+    size, header_size = FRAME_HEADER.unpack(receive_exactly(sock, FRAME_HEADER.size))
+    frame = receive_exactly(sock, size - FRAME_HEADER.size)
+    message = json.loads(bytes(frame[:header_size]))
+
+    arrays = {}
+    offset = header_size
+    for name, dtype, shape, compressed, n_bytes in message.pop("arrays"):
+        data = frame[offset : offset + n_bytes]
+        offset += n_bytes
+        if compressed:
+            data = zlib.decompress(data)
+        arrays[name] = np.frombuffer(data, dtype=dtype).reshape(shape)
+    return message, arrays
+
+
+def space_to_dict(space):
+    """Describes the Box, Discrete and Dict spaces of the envs as JSON"""
+    if isinstance(space, Dict):
+        return {
+            "type": "Dict",
+            "spaces": {key: space_to_dict(value) for key, value in space.items()},
+        }
+    if isinstance(space, Discrete):
+        return {"type": "Discrete", "n": int(space.n)}
+    if isinstance(space, Box):
+        # Uniform bounds (e.g. of the images) are sent as scalars
+        low = space.low.flat[0] if np.all(space.low == space.low.flat[0]) else space.low
+        high = (
+            space.high.flat[0]
+            if np.all(space.high == space.high.flat[0])
+            else space.high
+        )
+        return {
+            "type": "Box",
+            "low": low,
+            "high": high,
+            "shape": list(space.shape),
+            "dtype": space.dtype.str,
+        }
+    raise TypeError("Unsupported space {}".format(space))
+
+
+def space_from_dict(data):
+    if data["type"] == "Dict":
+        return Dict(
+            {key: space_from_dict(value) for key, value in data["spaces"].items()}
+        )
+    if data["type"] == "Discrete":
+        return Discrete(data["n"])
+    dtype = np.dtype(data["dtype"])
+    shape = tuple(data["shape"])
+    return Box(
+        low=np.broadcast_to(np.asarray(data["low"], dtype=dtype), shape),
+        high=np.broadcast_to(np.asarray(data["high"], dtype=dtype), shape),
+        shape=shape,
+        dtype=dtype,
+    )
+
+
+def observation_to_arrays(observation, prefix):
+    if isinstance(observation, dict):
+        return {
+            "{}/{}".format(prefix, key): value for key, value in observation.items()
+        }
+    return {prefix: observation}
+
+
+def observation_from_arrays(arrays, prefix):
+    if prefix in arrays:
+        return arrays[prefix]
+    start = prefix + "/"
+    return {
+        name[len(start) :]: value
+        for name, value in arrays.items()
+        if name.startswith(start)
+    }
+
+
+def make_worker_env(env_id, n_envs, seed=None):
+    """VecEnv of a worker. The natively vectorized envs are monitored here, the
+    others get a Monitor per env from make_vec_env"""
+    if env_id in NATIVE_VEC_ENVS:
+        return VecMonitor(NATIVE_VEC_ENVS[env_id](n_envs, seed=seed))
+    return make_vec_env(env_id, n_envs=n_envs, seed=seed, vec_env_cls=DummyVecEnv)
+
+
+class RolloutWorker(object):
+    """Serves a VecEnv to one client at a time. Each step message carries the
+    actions of all the envs of the worker, and its reply their observations, rewards,
+    dones and infos. The terminal observations of the infos travel as arrays"""
+
+    def __init__(self, vec_env, address, compression_level=1, token=None):
+        self.vec_env = vec_env
+        self.address = address
+        self.compression_level = compression_level
+        self.token = token
+
+        family, bind_address = parse_address(address)
+        if family == socket.AF_UNIX and os.path.exists(bind_address):
+            os.remove(bind_address)
+        self.listener = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(bind_address)
+        self.listener.listen(1)
+
+    def serve(self):
+        """Serves clients until one sends 'shutdown'"""
+        print("Rollout worker listening on {}".format(self.address))
+        try:
+            while True:
+                connection, _ = self.listener.accept()
+                if connection.family == socket.AF_INET:
+                    connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                try:
+                    if not self.handle(connection):
+                        return
+                except ConnectionError as e:
+                    print("Client disconnected ({})".format(e))
+                finally:
+                    connection.close()
+        finally:
+            self.listener.close()
+            self.vec_env.close()
+
+    def handle(self, connection):
+        """Answers the messages of a client. Returns False to shut the worker down.
+        With a token, the client has to send it in its hello before anything else"""
+        authenticated = not self.token
+        while True:
+            message, arrays = receive_message(connection)
+            command = message["command"]
+            if command == "hello" and not authenticated:
+                authenticated = hmac.compare_digest(
+                    str(message.get("token")), self.token
+                )
+            if not authenticated:
+                raise ConnectionError("Refused a client without the worker's token")
+
+            if command == "hello":
+                self.send(
+                    connection,
+                    {
+                        "n_envs": self.vec_env.num_envs,
+                        "observation_space": space_to_dict(
+                            self.vec_env.observation_space
+                        ),
+                        "action_space": space_to_dict(self.vec_env.action_space),
+                    },
+                )
+            elif command == "reset":
+                if message.get("seed") is not None:
+                    self.vec_env.seed(message["seed"])
+                observation = self.vec_env.reset()
+                self.send(connection, {}, observation_to_arrays(observation, "obs"))
+            elif command == "step":
+                self.step(connection, arrays["actions"])
+            elif command == "env_method":
+                if message["method"] not in ENV_METHODS:
+                    error = "env_method '{}' not allowed".format(message["method"])
+                    self.send(connection, {"error": error})
+                    continue
+                results = self.vec_env.env_method(
+                    message["method"],
+                    *message["args"],
+                    indices=message["indices"],
+                    **message["kwargs"],
+                )
+                self.send(connection, {"results": results})
+            elif command == "close":
+                return True
+            elif command == "shutdown":
+                return False
+            else:
+                raise ValueError("Unknown command '{}'".format(command))
+
+    def step(self, connection, actions):
+        observation, rewards, dones, infos = self.vec_env.step(actions)
+        arrays = observation_to_arrays(observation, "obs")
+        arrays["rewards"] = rewards
+        arrays["dones"] = dones
+        infos = [dict(info) for info in infos]
+        for env_idx, info in enumerate(infos):
+            if "terminal_observation" in info:
+                arrays.update(
+                    observation_to_arrays(
+                        info.pop("terminal_observation"), "terminal/{}".format(env_idx)
+                    )
+                )
+        self.send(connection, {"infos": infos}, arrays)
+
+    def send(self, connection, message, arrays=None):
+        send_message(connection, message, arrays, self.compression_level)
+
+
+class RemoteVecEnv(VecEnv):
+    """VecEnv whose envs run in RolloutWorkers. The step is sent to every worker
+    before waiting for any of them, so the workers step in parallel"""
+
+    def __init__(self, addresses, compression_level=1, timeout=None, token=None):
+        """The token defaults to the ROLLOUT_WORKER_TOKEN environment variable"""
+        if token is None:
+            token = os.environ.get(TOKEN_VARIABLE)
+        self.compression_level = compression_level
+        self.sockets = []
+        self.worker_envs = []
+        spaces = None
+        for address in addresses:
+            sock = connect(address, timeout)
+            self.sockets.append(sock)
+
+            send_message(sock, {"command": "hello", "token": token})
+            hello, _ = receive_message(sock)
+            worker_spaces = (hello["observation_space"], hello["action_space"])
+            if spaces is not None and worker_spaces != spaces:
+                raise ValueError("The worker at {} serves other spaces".format(address))
+            spaces = worker_spaces
+            self.worker_envs.append(hello["n_envs"])
+
+        self.env_offsets = np.cumsum([0] + self.worker_envs)
+        self.render_mode = None
+        self.closed = False
+        super().__init__(
+            int(self.env_offsets[-1]),
+            space_from_dict(spaces[0]),
+            space_from_dict(spaces[1]),
+        )
+
+    def reset(self):
+        for worker_idx, sock in enumerate(self.sockets):
+            seed = self._seeds[self.env_offsets[worker_idx]]
+            send_message(sock, {"command": "reset", "seed": seed})
+        self._reset_seeds()
+        observations = [
+            observation_from_arrays(receive_message(sock)[1], "obs")
+            for sock in self.sockets
+        ]
+        return self.concatenate(observations)
+
+    def step_async(self, actions):
+        actions = np.asarray(actions)
+        for worker_idx, sock in enumerate(self.sockets):
+            start, end = self.env_offsets[worker_idx : worker_idx + 2]
+            send_message(
+                sock,
+                {"command": "step"},
+                {"actions": actions[start:end]},
+                self.compression_level,
+            )
+
+    def step_wait(self):
+        observations, rewards, dones, infos = [], [], [], []
+        for sock in self.sockets:
+            message, arrays = receive_message(sock)
+            for env_idx, info in enumerate(message["infos"]):
+                terminal_observation = observation_from_arrays(
+                    arrays, "terminal/{}".format(env_idx)
+                )
+                if len(terminal_observation) > 0:
+                    info["terminal_observation"] = terminal_observation
+                infos.append(info)
+            observations.append(observation_from_arrays(arrays, "obs"))
+            rewards.append(arrays["rewards"])
+            dones.append(arrays["dones"])
+        return (
+            self.concatenate(observations),
+            np.concatenate(rewards),
+            np.concatenate(dones),
+            infos,
+        )
+
+    def concatenate(self, observations):
+        if isinstance(observations[0], dict):
+            return {
+                key: np.concatenate([observation[key] for observation in observations])
+                for key in observations[0]
+            }
+        return np.concatenate(observations)
+
+    def close(self, shutdown=False):
+        """Disconnects from the workers, also stopping them if shutdown is set"""
+        if self.closed:
+            return
+        for sock in self.sockets:
+            try:
+                send_message(sock, {"command": "shutdown" if shutdown else "close"})
+            except OSError:
+                pass
+            sock.close()
+        self.closed = True
+
+    def get_attr(self, attr_name, indices=None):
+        return [getattr(self, attr_name)] * len(self._get_indices(indices))
+
+    def set_attr(self, attr_name, value, indices=None):
+        setattr(self, attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        """Calls the method of the envs in their workers. Only the ENV_METHODS are
+        allowed, and their arguments and results have to be JSON-serializable"""
+        if method_name not in ENV_METHODS:
+            raise ValueError(
+                "env_method '{}' not allowed, only {}".format(
+                    method_name, sorted(ENV_METHODS)
+                )
+            )
+        indices = list(self._get_indices(indices))
+        worker_indices = {}
+        for index in indices:
+            worker_idx = int(np.searchsorted(self.env_offsets, index, side="right")) - 1
+            worker_indices.setdefault(worker_idx, []).append(index)
+
+        for worker_idx, env_indices in worker_indices.items():
+            offset = int(self.env_offsets[worker_idx])
+            send_message(
+                self.sockets[worker_idx],
+                {
+                    "command": "env_method",
+                    "method": method_name,
+                    "args": method_args,
+                    "kwargs": method_kwargs,
+                    "indices": [index - offset for index in env_indices],
+                },
+            )
+        results, errors = {}, []
+        for worker_idx, env_indices in worker_indices.items():
+            message, _ = receive_message(self.sockets[worker_idx])
+            if "error" in message:
+                errors.append(message["error"])
+                continue
+            results.update(zip(env_indices, message["results"]))
+        if errors:
+            raise RuntimeError("The workers refused the call: {}".format(errors))
+        return [results[index] for index in indices]
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [False] * len(self._get_indices(indices))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--env", default="Carla-v1")
+    parser.add_argument("--n-envs", type=int, default=1)
+    parser.add_argument(
+        "--address",
+        default="127.0.0.1:5555",
+        help="Use e.g. 0.0.0.0:5555 to serve other hosts, with ROLLOUT_WORKER_TOKEN set",
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument(
+        "--compression-level",
+        type=int,
+        default=1,
+        help="zlib level of the uint8 observations, 0 disables the compression",
+    )
+    args = parser.parse_args()
+
+    os.environ[ENV_WORKER_VARIABLE] = "1"
+    vec_env = make_worker_env(args.env, args.n_envs, seed=args.seed)
+    RolloutWorker(
+        vec_env,
+        args.address,
+        args.compression_level,
+        token=os.environ.get(TOKEN_VARIABLE),
+    ).serve()
+
+
+if __name__ == "__main__":
+    main()
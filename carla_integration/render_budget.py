@@ -0,0 +1,63 @@
+class RenderBudget(object):
+    """Limits the rendering work requested by the client. The spectator is cached and
+    only moved when its view changes (or every N ticks), and the debug overlays are
+    drawn once per world instead of once per reset. Everything is disabled when
+    training, unless forced by the 'debug_rendering' option."""
+
+    def __init__(self, carla_config, exp_config):
+        debug_rendering = carla_config["debug_rendering"]
+        if debug_rendering == "auto":
+            self.enabled = (
+                carla_config["enable_rendering"] and exp_config["mode"] != "train"
+            )
+        elif debug_rendering in ("on", "off"):
+            self.enabled = debug_rendering == "on"
+        else:
+            raise ValueError(
+                "Unknown debug_rendering '{}'. Use 'auto', 'on' or 'off'".format(
+                    debug_rendering
+                )
+            )
+        self.spectator_update_interval = carla_config["spectator_update_interval"]
+
+        self.world_id = None
+        self.spectator = None
+        self.spectator_transform = None
+        self.ticks_since_update = 0
+        self.drawn = set()
+
+    def set_world(self, world):
+        """Resets the caches if the world has changed, as its overlays are gone"""
+        if world.id == self.world_id:
+            return
+        self.world_id = world.id
+        self.spectator = world.get_spectator() if self.enabled else None
+        self.spectator_transform = None
+        self.ticks_since_update = 0
+        self.drawn = set()
+
+    def update_spectator(self, transform):
+        """Moves the spectator if the transform changed or the update interval elapsed"""
+        if not self.enabled:
+            return
+        self.ticks_since_update += 1
+        interval_elapsed = (
+            self.spectator_update_interval > 0
+            and self.ticks_since_update >= self.spectator_update_interval
+        )
+        if (
+            self.spectator_transform is None
+            or transform != self.spectator_transform
+            or interval_elapsed
+        ):
+            self.spectator.set_transform(transform)
+            self.spectator_transform = transform
+            self.ticks_since_update = 0
+
+    def should_draw(self, key):
+        """Returns whether or not the overlay identified by key has to be drawn. Each
+        overlay is only drawn once per world"""
+        if not self.enabled or key in self.drawn:
+            return False
+        self.drawn.add(key)
+        return True
@@ -0,0 +1,122 @@
+import numpy as np
+
+
+def get_bank_size(path):
+    """Number of layouts of a scenario bank, without loading the whole file"""
+    with np.load(path, allow_pickle=False) as arrays:
+        return len(arrays["goal_slot"])
+
+
+class TownScheduler(object):
+    """Assigns the episodes of a multi-town scenario mix to a pool of servers,
+    preferring the town each server already has loaded.
+
+    mix is a list of {"town", "scenario_bank", "weight"} entries (the bank is
+    optional). Servers start spread over the towns in proportion to their weights.
+    Each server keeps its town while that town is not over-served by more than
+    'tolerance' episodes, and within a town the entry furthest behind its share is
+    picked. Only when the town is over-served and another one is under-served by more
+    than 'tolerance' episodes is the server moved, so map reloads stay rare while the
+    long-run mix follows the weights. Layouts are drawn from a shuffled cycle of each
+    bank, covering all of them.
+    """
+
+    def __init__(self, mix, n_servers, tolerance=10, seed=None):
+        if not mix:
+            raise ValueError("The scenario mix is empty")
+        self.mix = [dict(entry) for entry in mix]
+        self.n_servers = n_servers
+        self.tolerance = tolerance
+        self.rng = np.random.default_rng(seed)
+
+        weights = np.array(
+            [entry.get("weight", 1.0) for entry in self.mix], dtype=float
+        )
+        self.entry_share = weights / weights.sum()
+        self.entry_counts = np.zeros(len(self.mix), dtype=np.int64)
+
+        self.towns = sorted({entry["town"] for entry in self.mix})
+        self.entry_town = np.array(
+            [self.towns.index(entry["town"]) for entry in self.mix]
+        )
+        self.town_share = np.bincount(
+            self.entry_town, weights=self.entry_share, minlength=len(self.towns)
+        )
+
+        self.bank_sizes = [
+            get_bank_size(entry["scenario_bank"]) if entry.get("scenario_bank") else 0
+            for entry in self.mix
+        ]
+        self.layout_cycles = [[] for _ in self.mix]
+
+        self.server_town = self.allocate_servers()
+        self.n_episodes = 0
+        self.n_reloads = 0
+
+    def allocate_servers(self):
+        """Initial town of each server, proportional to the town shares (largest
+        remainder). With more towns than servers, the largest towns are loaded"""
+        quotas = self.town_share * self.n_servers
+        counts = np.floor(quotas).astype(int)
+        remainders = np.argsort(-(quotas - counts), kind="stable")
+        counts[remainders[: self.n_servers - counts.sum()]] += 1
+        return [town for town, count in enumerate(counts) for _ in range(count)]
+
+    def town_deficit(self):
+        """Episodes each town is behind (positive) or ahead (negative) of its share,
+        counting this episode"""
+        town_counts = np.bincount(
+            self.entry_town, weights=self.entry_counts, minlength=len(self.towns)
+        )
+        return self.town_share * (self.n_episodes + 1) - town_counts
+
+    def next_episode(self, server_id):
+        """Returns the reset options of the next episode of the server"""
+        town = self.server_town[server_id]
+        deficit = self.town_deficit()
+        if deficit[town] < -self.tolerance:
+            # Towns not loaded by any other server come first
+            loaded = np.bincount(self.server_town, minlength=len(self.towns))
+            candidates = np.where(loaded == 0, deficit, deficit - self.tolerance)
+            candidates[town] = -np.inf
+            best_town = int(np.argmax(candidates))
+            if deficit[best_town] > self.tolerance:
+                town = best_town
+                self.server_town[server_id] = town
+                self.n_reloads += 1
+
+        entries = np.flatnonzero(self.entry_town == town)
+        entry_deficit = (
+            self.entry_share[entries] * (self.n_episodes + 1)
+            - self.entry_counts[entries]
+        )
+        entry = int(entries[np.argmax(entry_deficit)])
+        self.entry_counts[entry] += 1
+        self.n_episodes += 1
+
+        options = {"town": self.mix[entry]["town"]}
+        if self.bank_sizes[entry] > 0:
+            if not self.layout_cycles[entry]:
+                self.layout_cycles[entry] = list(
+                    self.rng.permutation(self.bank_sizes[entry])
+                )
+            options["scenario_bank"] = self.mix[entry]["scenario_bank"]
+            options["scenario_index"] = int(self.layout_cycles[entry].pop())
+        return options
+
+    def get_stats(self):
+        return {
+            "episodes": self.n_episodes,
+            "map_reloads": self.n_reloads,
+            "town_share": {
+                town: float(count) / max(self.n_episodes, 1)
+                for town, count in zip(
+                    self.towns,
+                    np.bincount(
+                        self.entry_town,
+                        weights=self.entry_counts,
+                        minlength=len(self.towns),
+                    ),
+                )
+            },
+        }
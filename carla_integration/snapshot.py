@@ -0,0 +1,120 @@
+"""Episode snapshots, to start episodes from recorded mid-manoeuvre states.
+
+A snapshot holds the state of the actors (hero, parked cars and walkers) and the
+experiment counters, and is restored on top of a freshly spawned episode of the same
+layout. Snapshots are stored as JSON lists, so they can be curated by hand.
+
+Records the snapshots of a policy near the goal:
+    python -m carla_integration.snapshot model.zip [--episodes 20] [--every 10]
+        [--max-goal-distance 15] [--output snapshots.json]
+"""
+import argparse
+import json
+
+import numpy as np
+
+
+class EpisodeSnapshot(object):
+    """State of an episode at a tick. Transforms are [x, y, z, pitch, yaw, roll]"""
+
+    def __init__(
+        self,
+        hero_transform,
+        hero_velocity,
+        hero_angular_velocity,
+        hero_control,
+        parked_cars,
+        walker_transforms,
+        walker_speeds,
+        goal_location,
+        parked=False,
+        experiment=None,
+        town=None,
+        scenario_index=None,
+        scenario_bank=None,
+    ):
+        self.hero_transform = np.asarray(hero_transform, dtype=np.float64)
+        self.hero_velocity = np.asarray(hero_velocity, dtype=np.float64)
+        self.hero_angular_velocity = np.asarray(hero_angular_velocity, dtype=np.float64)
+        # [throttle, steer, brake, hand_brake, reverse]
+        self.hero_control = list(hero_control)
+        self.parked_cars = np.asarray(parked_cars, dtype=np.float64).reshape(-1, 6)
+        self.walker_transforms = np.asarray(
+            walker_transforms, dtype=np.float64
+        ).reshape(-1, 6)
+        self.walker_speeds = np.asarray(walker_speeds, dtype=np.float64)
+        self.goal_location = np.asarray(goal_location, dtype=np.float64)
+        self.parked = parked
+        self.experiment = experiment or {}
+        self.town = town
+        self.scenario_index = scenario_index
+        self.scenario_bank = scenario_bank  # Path of the bank of scenario_index
+
+    def to_dict(self):
+        return {
+            key: value.tolist() if isinstance(value, np.ndarray) else value
+            for key, value in vars(self).items()
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+
+def save_snapshots(path, snapshots):
+    with open(path, "w") as f:
+        json.dump([snapshot.to_dict() for snapshot in snapshots], f)
+
+
+def load_snapshots(path):
+    with open(path, "r") as f:
+        return [EpisodeSnapshot.from_dict(data) for data in json.load(f)]
+
+
+def main():
+    """Runs a policy and records a snapshot every few steps while the hero is close
+    to the goal"""
+    from stable_baselines3 import PPO
+
+    from carla_integration.env import CarlaEnv
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("model")
+    parser.add_argument("--episodes", type=int, default=20)
+    parser.add_argument("--every", type=int, default=10)
+    parser.add_argument("--max-goal-distance", type=float, default=15.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="snapshots.json")
+    args = parser.parse_args()
+
+    model = PPO.load(args.model)
+    env = CarlaEnv(mode="test")
+    snapshots = []
+    try:
+        for episode in range(args.episodes):
+            observation, _ = env.reset(seed=args.seed + episode)
+            done = False
+            step = 0
+            while not done:
+                action, _ = model.predict(observation, deterministic=True)
+                observation, _, terminated, truncated, _ = env.step(action)
+                done = terminated or truncated
+                step += 1
+                if done or step % args.every != 0:
+                    continue
+                snapshot = env.get_snapshot()
+                distance = np.linalg.norm(
+                    snapshot.hero_transform[:2] - snapshot.goal_location[:2]
+                )
+                if distance <= args.max_goal_distance:
+                    snapshots.append(snapshot)
+            print("Episode {}: {} snapshots".format(episode, len(snapshots)))
+    finally:
+        env.close()
+
+    save_snapshots(args.output, snapshots)
+    print("Saved {} snapshots to {}".format(len(snapshots), args.output))
+
+
+if __name__ == "__main__":
+    main()
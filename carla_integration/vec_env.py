@@ -0,0 +1,68 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import numpy as np
+from stable_baselines3.common.vec_env import DummyVecEnv
+
+
+class ThreadedVecEnv(DummyVecEnv):
+    """In-process vectorized env whose envs step concurrently, each one in its own
+    thread. The whole step of an env (tick, sensor wait and observation) runs in its
+    thread, so the envs wait for their servers at the same time instead of one after
+    the other (the CARLA client releases the GIL while waiting). Auto-resets also run
+    in the env's thread.
+
+    step_wait still returns once every env has stepped, so the steps do not overlap
+    with the policy's inference, which SB3 runs on the whole batch."""
+
+    def __init__(self, env_fns):
+        super().__init__(env_fns)
+        self.executors = [
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix="env_{}".format(i))
+            for i in range(self.num_envs)
+        ]
+        self.pending_steps = None
+
+    def step_async(self, actions):
+        self.actions = actions
+        self.pending_steps = [
+            executor.submit(self._step_env, env_idx, action)
+            for env_idx, (executor, action) in enumerate(zip(self.executors, actions))
+        ]
+
+    def _step_env(self, env_idx, action):
+        env = self.envs[env_idx]
+        obs, reward, terminated, truncated, info = env.step(action)
+        done = terminated or truncated
+        info["TimeLimit.truncated"] = truncated and not terminated
+
+        reset_info = None
+        if done:
+            info["terminal_observation"] = obs
+            obs, reset_info = env.reset()
+        return obs, reward, done, info, reset_info
+
+    def step_wait(self):
+        # Every step finishes before any error is raised, so that none of them is
+        # still running at the next step_async
+        pending_steps, self.pending_steps = self.pending_steps, None
+        wait(pending_steps)
+        for env_idx, pending_step in enumerate(pending_steps):
+            obs, reward, done, info, reset_info = pending_step.result()
+            self.buf_rews[env_idx] = reward
+            self.buf_dones[env_idx] = done
+            self.buf_infos[env_idx] = info
+            if reset_info is not None:
+                self.reset_infos[env_idx] = reset_info
+            self._save_obs(env_idx, obs)
+
+        return (
+            self._obs_from_buf(),
+            np.copy(self.buf_rews),
+            np.copy(self.buf_dones),
+            [info.copy() for info in self.buf_infos],
+        )
+
+    def close(self):
+        for executor in self.executors:
+            executor.shutdown(wait=True)
+        super().close()
@@ -0,0 +1,99 @@
+import carla
+import numpy as np
+
+
+class WalkerLOD(object):
+    """Activity level of detail of the background walkers.
+
+    Walkers further than 'walker_lod_radius' from the hero are frozen: their physics
+    are disabled (in one batch) and their AI controller stopped, so the server no
+    longer simulates nor navigates them. They are woken up again, closest first and
+    at most 'walker_lod_batch_size' per update, once the hero gets within the radius.
+    Positions are read from the world snapshot of the tick, without extra requests.
+    A radius of 0 disables it.
+    """
+
+    def __init__(self, client, background_config):
+        self.client = client
+        self.radius = background_config["walker_lod_radius"]
+        self.hysteresis = background_config["walker_lod_hysteresis"]
+        self.update_interval = max(1, background_config["walker_lod_interval"])
+        self.batch_size = background_config["walker_lod_batch_size"]
+        self.enabled = self.radius > 0
+
+        self.clear()
+
+    def clear(self):
+        self.walker_ids = np.empty(0, dtype=np.int64)
+        self.controllers = []
+        self.targets = []
+        self.speeds = []
+        self.active = np.empty(0, dtype=bool)
+        self.ticks_since_update = 0
+
+    def set_walkers(self, walker_ids, controllers, targets, speeds):
+        """Registers the walkers spawned for the episode. All of them start active"""
+        self.walker_ids = np.array(walker_ids, dtype=np.int64)
+        self.controllers = list(controllers)
+        self.targets = list(targets)
+        self.speeds = [float(speed) for speed in speeds]
+        self.active = np.ones(len(self.walker_ids), dtype=bool)
+        self.ticks_since_update = self.update_interval  # Update at the first tick
+
+    @property
+    def n_active(self):
+        return int(self.active.sum())
+
+    def update(self, snapshot, hero_id):
+        """Freezes and wakes up the walkers given the positions of the tick's snapshot"""
+        if not self.enabled or len(self.walker_ids) == 0:
+            return
+        self.ticks_since_update += 1
+        if self.ticks_since_update < self.update_interval:
+            return
+        self.ticks_since_update = 0
+
+        hero_snapshot = snapshot.find(hero_id)
+        if hero_snapshot is None:
+            return
+        hero_location = hero_snapshot.get_transform().location
+
+        distance = np.full(len(self.walker_ids), np.inf, dtype=np.float32)
+        for i, walker_id in enumerate(self.walker_ids):
+            walker_snapshot = snapshot.find(int(walker_id))
+            if walker_snapshot is not None:
+                location = walker_snapshot.get_transform().location
+                distance[i] = np.hypot(
+                    location.x - hero_location.x, location.y - hero_location.y
+                )
+
+        freeze = np.flatnonzero(
+            self.active & (distance > self.radius + self.hysteresis)
+        )
+        wake = np.flatnonzero(~self.active & (distance < self.radius))
+        wake = wake[np.argsort(distance[wake])][: self.batch_size]
+
+        if len(freeze) > 0:
+            for i in freeze:
+                self.controllers[i].stop()
+            self.client.apply_batch(
+                [
+                    carla.command.SetSimulatePhysics(int(self.walker_ids[i]), False)
+                    for i in freeze
+                ]
+            )
+            self.active[freeze] = False
+
+        if len(wake) > 0:
+            self.client.apply_batch(
+                [
+                    carla.command.SetSimulatePhysics(int(self.walker_ids[i]), True)
+                    for i in wake
+                ]
+            )
+            for i in wake:
+                controller = self.controllers[i]
+                controller.start()
+                controller.go_to_location(self.targets[i])
+                controller.set_max_speed(self.speeds[i])
+            self.active[wake] = True
@@ -0,0 +1,131 @@
+import time
+
+import numpy as np
+
+from helper.sensors.sensor_interface import SensorTimeout
+
+RECOVERY_LEVELS = ["retick", "rebuild_rig", "reconnect", "restart_server"]
+
+
+class EpisodeInterrupted(Exception):
+    """Raised once the simulation has been recovered from a stall that broke the
+    episode. The env has to be reset"""
+
+    def __init__(self, level):
+        super().__init__("Episode interrupted, recovered by '{}'".format(level))
+        self.level = level
+
+
+def is_timeout(error):
+    """Whether the error is a missed deadline: a sensor's data or the client's time-out
+    waiting for the server"""
+    return isinstance(error, SensorTimeout) or (
+        isinstance(error, RuntimeError) and "time-out" in str(error)
+    )
+
+
+class TickWatchdog(object):
+    """Enforces a deadline on every tick (the server's tick and the sensor data).
+
+    A missed deadline is recovered escalating through RECOVERY_LEVELS: the tick is
+    retried, then the hero's sensors are rebuilt, then the client reconnects and, as a
+    last resort, the server is restarted. Only a successful retick lets the episode go
+    on, the other levels raise EpisodeInterrupted. Other errors are not recovered. The
+    tick latencies are tracked to report their tail percentiles.
+    """
+
+    def __init__(self, core, carla_config, window=10000):
+        self.core = core
+        self.deadline = carla_config["tick_deadline"]
+
+        self.latencies = np.zeros(window, dtype=np.float64)
+        self.n_latencies = 0
+        self.episode_latencies = []
+        self.recoveries = {level: 0 for level in RECOVERY_LEVELS}
+        self.episode_recoveries = 0
+
+    def start_episode(self):
+        self.episode_latencies = []
+        self.episode_recoveries = 0
+
+    def tick(self, parse=True):
+        start_time = time.perf_counter()
+        try:
+            return self.core.tick_once(parse)
+        except RuntimeError as e:
+            if not is_timeout(e):
+                raise
+            print(
+                "Tick missed its {}s deadline ({}), recovering".format(self.deadline, e)
+            )
+            return self.recover(parse)
+        finally:
+            self.record(time.perf_counter() - start_time)
+
+    def recover(self, parse):
+        self.episode_recoveries += 1
+        try:
+            sensor_data = self.core.tick_once(parse)
+            self.recoveries["retick"] += 1
+            return sensor_data
+        except RuntimeError as e:
+            if not is_timeout(e):
+                raise
+
+        try:
+            self.core.rebuild_sensors()
+            self.core.tick_once(parse)
+            level = "rebuild_rig"
+        except RuntimeError:
+            level = self.reconnect()
+        self.interrupt(level)
+
+    def run(self, function, *args):
+        """Calls the function (e.g. spawning an episode) under the watchdog. A missed
+        deadline is recovered from the reconnect level, as the hero may not exist yet"""
+        try:
+            return function(*args)
+        except RuntimeError as e:
+            if not is_timeout(e):
+                raise
+            print("Missed a deadline outside of a tick ({}), recovering".format(e))
+        self.episode_recoveries += 1
+        self.interrupt(self.reconnect())
+
+    def reconnect(self):
+        """Reconnects the client or, failing that, restarts the server. Returns the
+        recovery level"""
+        try:
+            self.core.reconnect()
+            return "reconnect"
+        except Exception as e:
+            print("Could not reconnect to the server ({}), restarting it".format(e))
+            self.core.restart_server()
+            return "restart_server"
+
+    def interrupt(self, level):
+        self.recoveries[level] += 1
+        print("Recovered by '{}'".format(level))
+        raise EpisodeInterrupted(level)
+
+    def record(self, latency):
+        self.latencies[self.n_latencies % len(self.latencies)] = latency
+        self.n_latencies += 1
+        self.episode_latencies.append(latency)
+
+    def get_percentiles(self, latencies):
+        """p50, p99 and p99.9 of the latencies, in ms"""
+        if len(latencies) == 0:
+            return {"p50": 0.0, "p99": 0.0, "p99.9": 0.0}
+        p50, p99, p999 = 1000 * np.percentile(latencies, [50, 99, 99.9])
+        return {"p50": float(p50), "p99": float(p99), "p99.9": float(p999)}
+
+    def get_episode_stats(self):
+        return self.get_percentiles(self.episode_latencies)
+
+    def get_stats(self):
+        """Percentiles of the last ticks (up to the window size) and recovery counts"""
+        latencies = self.latencies[: min(self.n_latencies, len(self.latencies))]
+        stats = self.get_percentiles(latencies)
+        stats.update(self.recoveries)
+        return stats
@@ -0,0 +1,268 @@
+"""Evaluates a saved policy on fixed-seed episodes, running several simulator
+instances in parallel and batching the policy inference across them.
+
+Usage: python evaluate.py logs/final_model.zip [--episodes 200] [--workers 4]
+"""
+import argparse
+import json
+import multiprocessing
+import time
+import traceback
+
+import numpy as np
+from stable_baselines3 import PPO
+
+from carla_integration.scheduler import TownScheduler
+from config import read_config
+from helper.carla_helper import kill_process_tree
+from helper.episode_metrics import (
+    METRICS_COLUMNS,
+    TERMINATION_CAUSES,
+    summarize_metrics,
+)
+
+
+def run_worker(remote, worker_id):
+    """Owns one CarlaEnv (and its server) and executes the commands of the pool"""
+    from carla_integration.env import CarlaEnv
+
+    env = None
+    try:
+        env = CarlaEnv(mode="test")
+        remote.send(("ready", env.core.server_process.pid))
+        while True:
+            command, data = remote.recv()
+            if command == "reset":
+                seed, options = data
+                observation, _ = env.reset(seed=seed, options=options)
+                remote.send(("ok", observation))
+            elif command == "step":
+                observation, reward, terminated, truncated, info = env.step(data)
+                remote.send(("ok", (observation, terminated or truncated, info)))
+            elif command == "close":
+                break
+            else:
+                raise ValueError("Unknown command '{}'".format(command))
+    except Exception:
+        remote.send(
+            ("error", "Worker {}:\n{}".format(worker_id, traceback.format_exc()))
+        )
+    finally:
+        if env is not None:
+            env.close()
+        remote.close()
+
+
+class EvaluationPool(object):
+    """Pool of worker processes, each one running its own simulator. Unlike a
+    SubprocVecEnv, every episode is reset with its own seed and each worker is
+    released (closing its server) as soon as there are no episodes left for it"""
+
+    def __init__(self, n_workers):
+        context = multiprocessing.get_context("spawn")
+        self.remotes = []
+        self.processes = []
+        self.released = set()
+        for worker_id in range(n_workers):
+            remote, worker_remote = context.Pipe()
+            process = context.Process(
+                target=run_worker, args=(worker_remote, worker_id), daemon=True
+            )
+            process.start()
+            worker_remote.close()
+            self.remotes.append(remote)
+            self.processes.append(process)
+
+        # Server of each worker, killed if its worker does not close it
+        self.server_pids = [self.receive(worker_id) for worker_id in range(n_workers)]
+
+    def send(self, worker_id, command, data=None):
+        self.remotes[worker_id].send((command, data))
+
+    def receive(self, worker_id):
+        status, data = self.remotes[worker_id].recv()
+        if status == "error":
+            raise RuntimeError(data)
+        return data
+
+    def release(self, worker_id):
+        """Closes the worker (and its server) once it has no more episodes to run"""
+        if worker_id in self.released:
+            return
+        self.released.add(worker_id)
+        try:
+            self.remotes[worker_id].send(("close", None))
+        except (BrokenPipeError, EOFError):
+            pass
+
+    def close(self):
+        for worker_id in range(len(self.remotes)):
+            self.release(worker_id)
+        for process, server_pid in zip(self.processes, self.server_pids):
+            process.join(timeout=30)
+            if process.is_alive():
+                process.terminate()
+                kill_process_tree(server_pid)
+
+
+def stack_observations(observations):
+    return {
+        key: np.stack([observation[key] for observation in observations])
+        for key in observations[0]
+    }
+
+
+def evaluate(model, pool, seeds, deterministic=True, scheduler=None):
+    """Runs an episode per seed and returns the episode stats, in the order of seeds.
+    With a scheduler, the town and layout of each episode are picked by it"""
+    pending_seeds = list(enumerate(seeds))
+    results = [None] * len(seeds)
+    episode_options = [{} for _ in seeds]
+    n_workers = len(pool.remotes)
+
+    def start_episode(worker_id):
+        episode, seed = pending_seeds.pop(0)
+        if scheduler is not None:
+            episode_options[episode] = scheduler.next_episode(worker_id)
+        pool.send(worker_id, "reset", (seed, episode_options[episode]))
+        return episode
+
+    # Worker id -> [episode index, last observation]
+    active = {}
+    for worker_id in range(n_workers):
+        if pending_seeds:
+            active[worker_id] = [start_episode(worker_id), None]
+    for worker_id in active:
+        active[worker_id][1] = pool.receive(worker_id)
+
+    while active:
+        worker_ids = list(active)
+        actions, _ = model.predict(
+            stack_observations([active[worker_id][1] for worker_id in worker_ids]),
+            deterministic=deterministic,
+        )
+        for worker_id, action in zip(worker_ids, actions):
+            pool.send(worker_id, "step", action)
+
+        resets = []
+        for worker_id in worker_ids:
+            observation, done, info = pool.receive(worker_id)
+            active[worker_id][1] = observation
+            if not done:
+                continue
+
+            episode = active[worker_id][0]
+            stats = dict(
+                info["episode_stats"],
+                seed=seeds[episode],
+                worker=worker_id,
+                **episode_options[episode]
+            )
+            results[episode] = stats
+            print(
+                "Episode {} (seed {}): {}, return {:.1f}, {:.1f}s".format(
+                    episode,
+                    stats["seed"],
+                    stats["termination"],
+                    stats["episode_return"],
+                    stats["sim_time"],
+                )
+            )
+
+            if pending_seeds:
+                active[worker_id][0] = start_episode(worker_id)
+                resets.append(worker_id)
+            else:
+                del active[worker_id]
+                pool.release(worker_id)
+
+        for worker_id in resets:
+            active[worker_id][1] = pool.receive(worker_id)
+
+    return results
+
+
+def summarize_results(results):
+    """Success rate, time-to-park and collision statistics of the episodes"""
+    columns = {
+        name: np.array([stats[name] for stats in results], dtype=dtype)
+        for name, dtype in METRICS_COLUMNS.items()
+        if name != "termination"
+    }
+    columns["termination"] = np.array(
+        [TERMINATION_CAUSES.index(stats["termination"]) for stats in results],
+        dtype=np.uint8,
+    )
+    columns["worker"] = np.array([stats["worker"] for stats in results])
+    summary = summarize_metrics(columns)
+
+    parked = columns["termination"] == TERMINATION_CAUSES.index("parked")
+    if parked.any():
+        time_to_park = columns["sim_time"][parked]
+        summary["median_time_to_park"] = float(np.median(time_to_park))
+        summary["p90_time_to_park"] = float(np.percentile(time_to_park, 90))
+    summary["mean_collisions"] = float(columns["collisions"].mean())
+
+    towns = [stats.get("town") for stats in results]
+    if any(towns):
+        summary["town_success_rate"] = {
+            town: float(np.mean([p for p, t in zip(parked, towns) if t == town]))
+            for town in sorted(set(towns))
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("model")
+    parser.add_argument("--episodes", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the first episode")
+    parser.add_argument("--stochastic", action="store_true")
+    parser.add_argument("--device", default="auto")
+    parser.add_argument("--output", default="evaluation.json")
+    parser.add_argument(
+        "--town-tolerance",
+        type=int,
+        default=10,
+        help="Episodes a town can be ahead of its share before its server switches map",
+    )
+    args = parser.parse_args()
+
+    model = PPO.load(args.model, device=args.device)
+    seeds = list(range(args.seed, args.seed + args.episodes))
+    n_workers = min(args.workers, args.episodes)
+
+    # Multi-town mix, if configured
+    scheduler = None
+    scenario_mix = read_config()["experiment"]["scenario_mix"]
+    if scenario_mix:
+        scheduler = TownScheduler(
+            scenario_mix, n_workers, tolerance=args.town_tolerance, seed=args.seed
+        )
+
+    start_time = time.time()
+    pool = EvaluationPool(n_workers)
+    try:
+        results = evaluate(
+            model,
+            pool,
+            seeds,
+            deterministic=not args.stochastic,
+            scheduler=scheduler,
+        )
+    finally:
+        pool.close()
+
+    summary = summarize_results(results)
+    summary["wall_time"] = time.time() - start_time
+    if scheduler is not None:
+        summary["scheduler"] = scheduler.get_stats()
+    print(json.dumps(summary, indent=4))
+    with open(args.output, "w") as f:
+        json.dump({"summary": summary, "episodes": results}, f, indent=4, default=float)
+    print("Saved the evaluation to {}".format(args.output))
+
+
+if __name__ == "__main__":
+    main()
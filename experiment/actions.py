@@ -0,0 +1,65 @@
+# Discrete actions of the experiment, kept free of carla so that the kinematic
+# simulator can share them. [throttle, steer, brake, hand_brake, reverse]
+DISCRETE_ACTIONS = {
+    0: [0.0, 0.00, 0.0, False, False],  # Coast
+    1: [0.0, 0.00, 0.25, False, False],  # Apply Break
+    2: [0.0, 0.00, 0.5, False, False],  # Apply Break
+    3: [0.0, 0.00, 0.75, False, False],  # Apply Break
+    4: [0.0, 0.75, 0.0, False, False],  # Right
+    5: [0.0, 0.50, 0.0, False, False],  # Right
+    6: [0.0, 0.25, 0.0, False, False],  # Right
+    7: [0.0, -0.75, 0.0, False, False],  # Left
+    8: [0.0, -0.50, 0.0, False, False],  # Left
+    9: [0.0, -0.25, 0.0, False, False],  # Left
+    10: [0.25, 0.00, 0.0, False, False],  # Straight
+    11: [0.25, 0.75, 0.0, False, False],  # Right
+    12: [0.25, 0.50, 0.0, False, False],  # Right
+    13: [0.25, 0.25, 0.0, False, False],  # Right
+    14: [0.25, -0.75, 0.0, False, False],  # Left
+    15: [0.25, -0.50, 0.0, False, False],  # Left
+    16: [0.25, -0.25, 0.0, False, False],  # Left
+    17: [0.5, 0.00, 0.0, False, False],  # Straight
+    18: [0.5, 0.75, 0.0, False, False],  # Right
+    19: [0.5, 0.50, 0.0, False, False],  # Right
+    20: [0.5, 0.25, 0.0, False, False],  # Right
+    21: [0.5, -0.75, 0.0, False, False],  # Left
+    22: [0.5, -0.50, 0.0, False, False],  # Left
+    23: [0.5, -0.25, 0.0, False, False],  # Left
+    24: [0.75, 0.00, 0.0, False, False],  # Straight
+    25: [0.75, 0.75, 0.0, False, False],  # Right
+    26: [0.75, 0.50, 0.0, False, False],  # Right
+    27: [0.75, 0.25, 0.0, False, False],  # Right
+    28: [0.75, -0.75, 0.0, False, False],  # Left
+    29: [0.75, -0.50, 0.0, False, False],  # Left
+    30: [0.75, -0.25, 0.0, False, False],  # Left
+    31: [0.0, 0.00, 0.25, False, True],  # Apply Break (Reverse)
+    32: [0.0, 0.00, 0.5, False, True],  # Apply Break (Reverse)
+    33: [0.0, 0.00, 0.75, False, True],  # Apply Break (Reverse)
+    34: [0.0, 0.75, 0.0, False, True],  # Right (Reverse)
+    35: [0.0, 0.50, 0.0, False, True],  # Right (Reverse)
+    36: [0.0, 0.25, 0.0, False, True],  # Right (Reverse)
+    37: [0.0, -0.75, 0.0, False, True],  # Left (Reverse)
+    38: [0.0, -0.50, 0.0, False, True],  # Left (Reverse)
+    39: [0.0, -0.25, 0.0, False, True],  # Left (Reverse)
+    40: [0.25, 0.00, 0.0, False, True],  # Straight (Reverse)
+    41: [0.25, 0.75, 0.0, False, True],  # Right (Reverse)
+    42: [0.25, 0.50, 0.0, False, True],  # Right (Reverse)
+    43: [0.25, 0.25, 0.0, False, True],  # Right (Reverse)
+    44: [0.25, -0.75, 0.0, False, True],  # Left (Reverse)
+    45: [0.25, -0.50, 0.0, False, True],  # Left (Reverse)
+    46: [0.25, -0.25, 0.0, False, True],  # Left (Reverse)
+    47: [0.5, 0.00, 0.0, False, True],  # Straight (Reverse)
+    48: [0.5, 0.75, 0.0, False, True],  # Right (Reverse)
+    49: [0.5, 0.50, 0.0, False, True],  # Right (Reverse)
+    50: [0.5, 0.25, 0.0, False, True],  # Right (Reverse)
+    51: [0.5, -0.75, 0.0, False, True],  # Left (Reverse)
+    52: [0.5, -0.50, 0.0, False, True],  # Left (Reverse)
+    53: [0.5, -0.25, 0.0, False, True],  # Left (Reverse)
+    54: [0.75, 0.00, 0.0, False, True],  # Straight (Reverse)
+    55: [0.75, 0.75, 0.0, False, True],  # Right (Reverse)
+    56: [0.75, 0.50, 0.0, False, True],  # Right (Reverse)
+    57: [0.75, 0.25, 0.0, False, True],  # Right (Reverse)
+    58: [0.75, -0.75, 0.0, False, True],  # Left (Reverse)
+    59: [0.75, -0.50, 0.0, False, True],  # Left (Reverse)
+    60: [0.75, -0.25, 0.0, False, True],  # Left (Reverse)
+}
@@ -22,6 +22,11 @@ class BaseExperiment:
         """Given the action, returns a carla.VehicleControl() which will be applied to the hero"""
         raise NotImplementedError
 
+    def update_events(self, sensor_data):
+        """Updates the experiment with the data of the event sensors (e.g. collisions).
+        Called every tick, before get_done_status and compute_reward"""
+        pass
+
     def get_observation(self, sensor_data):
         """Function to do all the post processing of the observations (sensor data).
         Should return a tuple or list with two items, the processed observations,
@@ -35,3 +40,15 @@ class BaseExperiment:
     def compute_reward(self, observation, core):
         """Computes the reward"""
         return NotImplementedError
+
+    def get_termination_cause(self):
+        """Returns why the episode ended, one of helper.episode_metrics.TERMINATION_CAUSES"""
+        return "none"
+
+    def get_state(self):
+        """Returns the episode counters as a JSON-serializable dict, for snapshots"""
+        return {}
+
+    def set_state(self, state):
+        """Restores the episode counters returned by get_state, after reset"""
+        pass
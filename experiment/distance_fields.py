@@ -0,0 +1,325 @@
+"""Precomputed distance fields of the parking lot, looked up in O(1) at every step.
+
+The lot (the parking points and a margin around them) is rasterized into a grid,
+on which two fields are computed per layout (parked cars and goal):
+    geodesic   distance to the goal going around the parked cars, grown by the
+               hero's half width, along the 8-connected grid
+    clearance  signed distance to the closest parked car (negative inside one)
+
+The fields of each layout are computed once and cached on disk. Lookups are
+bilinear interpolations of the grid values.
+
+Fills the cache with the layouts of a scenario bank:
+    python -m experiment.distance_fields scenarios.npz [--town Town05]
+"""
+import argparse
+import collections
+import hashlib
+import json
+import math
+import os
+import tempfile
+
+import numpy as np
+
+from experiment.scenarios import ScenarioBank, parse_location
+
+
+def is_enabled(fields_config):
+    """Whether the reward or the observation use the distance fields"""
+    return (
+        fields_config["goal_distance"] == "geodesic"
+        or fields_config["clearance_observation"]
+    )
+
+
+def lot_grid(exp_config, parking_points=None):
+    """Origin (x, y) and shape (rows along y, columns along x) of the grid covering the
+    parking points (the configuration's ones if None, e.g. without a scenario bank)
+    and the margin around them"""
+    fields_config = exp_config["distance_fields"]
+    if parking_points is None:
+        parking_points = [
+            parse_location(point)
+            for point in exp_config["background_activity"]["parking_points"]
+        ]
+    parking_points = np.asarray(parking_points, dtype=np.float64)[:, :2]
+    low = parking_points.min(axis=0) - fields_config["margin"]
+    high = parking_points.max(axis=0) + fields_config["margin"]
+    n_x, n_y = np.ceil((high - low) / fields_config["cell_size"]).astype(int) + 1
+    return low, (int(n_y), int(n_x))
+
+
+def box_distance(points, centers, yaw, extent):
+    """Signed distance from [..., 2] points to the closest of the [K, 2] boxes, all with
+    the same yaw (degrees) and half extent. Negative inside a box, inf without boxes"""
+    if len(centers) == 0:
+        return np.full(points.shape[:-1], np.inf)
+    cos_yaw, sin_yaw = math.cos(math.radians(yaw)), math.sin(math.radians(yaw))
+    # [..., K, 2] offsets, in the frame of the boxes
+    offset = points[..., np.newaxis, :] - centers
+    local_x = np.abs(offset[..., 0] * cos_yaw + offset[..., 1] * sin_yaw) - extent[0]
+    local_y = np.abs(offset[..., 1] * cos_yaw - offset[..., 0] * sin_yaw) - extent[1]
+    outside = np.hypot(np.maximum(local_x, 0.0), np.maximum(local_y, 0.0))
+    inside = np.minimum(np.maximum(local_x, local_y), 0.0)
+    return (outside + inside).min(axis=-1)
+
+
+def sweep_rows(distance, free, straight, diagonal):
+    """One Gauss-Seidel pass of the 8-connected distance down the rows and another one
+    up, relaxing each row from the previous one. Rows of a transposed view relax the
+    columns. Returns whether any distance decreased"""
+    changed = False
+    n_rows = distance.shape[0]
+    for rows in (range(1, n_rows), range(n_rows - 2, -1, -1)):
+        step = 1 if rows.step > 0 else -1
+        for row in rows:
+            previous = distance[row - step]
+            candidate = previous + straight
+            np.minimum(candidate[1:], previous[:-1] + diagonal, out=candidate[1:])
+            np.minimum(candidate[:-1], previous[1:] + diagonal, out=candidate[:-1])
+            improved = free[row] & (candidate < distance[row])
+            if improved.any():
+                distance[row][improved] = candidate[improved]
+                changed = True
+    return changed
+
+
+def relax(initial, free, cell_size, max_passes=1000):
+    """Shortest distances through the free cells of the grid, from cells with a finite
+    initial distance. Cells out of reach stay at inf"""
+    distance = initial.copy()
+    straight, diagonal = cell_size, cell_size * math.sqrt(2)
+    for _ in range(max_passes):
+        changed = sweep_rows(distance, free, straight, diagonal)
+        changed |= sweep_rows(distance.T, free.T, straight, diagonal)
+        if not changed:
+            break
+    return distance
+
+
+class DistanceFields(object):
+    """Geodesic distance-to-goal and clearance fields of a layout, on a grid of
+    cell_size meters starting at origin (x, y), indexed [row (y), column (x)]"""
+
+    def __init__(self, geodesic, clearance, origin, cell_size):
+        self.geodesic = np.asarray(geodesic, dtype=np.float32)
+        self.clearance = np.asarray(clearance, dtype=np.float32)
+        self.origin = np.asarray(origin, dtype=np.float64)
+        self.cell_size = float(cell_size)
+
+    def grid_position(self, points):
+        """Fractional grid coordinates (column, row) of [..., 2] points, clamped to the
+        grid, and the distance from the points to their clamped position"""
+        points = np.asarray(points, dtype=np.float64)
+        position = (points - self.origin) / self.cell_size
+        high = np.array(self.geodesic.shape[::-1]) - 1
+        clamped = np.clip(position, 0, high)
+        outside = self.cell_size * np.linalg.norm(position - clamped, axis=-1)
+        return clamped, outside
+
+    def sample(self, field, position):
+        """Bilinear interpolation of the field at the (column, row) grid coordinates"""
+        high = np.array(field.shape[::-1]) - 2
+        index = np.minimum(np.floor(position).astype(np.intp), high)
+        weight = position - index
+        column, row = index[..., 0], index[..., 1]
+        weight_x, weight_y = weight[..., 0], weight[..., 1]
+        top = field[row, column] * (1 - weight_x) + field[row, column + 1] * weight_x
+        bottom = (
+            field[row + 1, column] * (1 - weight_x)
+            + field[row + 1, column + 1] * weight_x
+        )
+        return top * (1 - weight_y) + bottom * weight_y
+
+    def goal_distance(self, points):
+        """Geodesic distance to the goal of [..., 2] points. Outside of the grid, the
+        straight-line distance to its border is added"""
+        position, outside = self.grid_position(points)
+        return self.sample(self.geodesic, position) + outside
+
+    def clearance_at(self, points):
+        """Signed distance of [..., 2] points to the closest parked car"""
+        position, _ = self.grid_position(points)
+        return self.sample(self.clearance, position)
+
+    def save(self, path):
+        """Writes the fields to a temporary file next to the path and moves it into
+        place, so that concurrent readers never load a partial file"""
+        fd, temp_path = tempfile.mkstemp(
+            suffix=".npz", dir=os.path.dirname(path) or "."
+        )
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(
+                    f,
+                    geodesic=self.geodesic,
+                    clearance=self.clearance,
+                    origin=self.origin,
+                    cell_size=self.cell_size,
+                )
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as arrays:
+            return cls(
+                arrays["geodesic"],
+                arrays["clearance"],
+                arrays["origin"],
+                float(arrays["cell_size"]),
+            )
+
+
+def compute_distance_fields(
+    exp_config, parked_locations, goal_location, parking_points=None
+):
+    """Rasterizes the layout on the grid of its parking points and computes its
+    DistanceFields"""
+    fields_config = exp_config["distance_fields"]
+    cell_size = fields_config["cell_size"]
+    origin, shape = lot_grid(exp_config, parking_points)
+    rows, columns = np.indices(shape)
+    points = origin + cell_size * np.stack([columns, rows], axis=-1)
+
+    parked_locations = np.asarray(parked_locations, dtype=np.float64).reshape(-1, 3)
+    clearance = box_distance(
+        points,
+        parked_locations[:, :2],
+        exp_config["background_activity"]["parked_car_yaw"],
+        fields_config["parked_extent"],
+    )
+    free = clearance > fields_config["inflation"]
+
+    # The cells around the goal start at their straight-line distance to it
+    goal = np.asarray(goal_location, dtype=np.float64)[:2]
+    goal_offset = np.linalg.norm(points - goal, axis=-1)
+    near_goal = goal_offset <= 1.5 * cell_size
+    initial = np.where(near_goal, goal_offset, np.inf)
+    free |= near_goal
+    geodesic = relax(initial, free, cell_size)
+
+    # Cells inside the grown cars or cut off from the goal continue from the closest
+    # reachable cell, so that the field is finite everywhere
+    reachable = np.isfinite(geodesic)
+    if not reachable.all():
+        geodesic = relax(geodesic, np.ones(shape, dtype=bool), cell_size)
+
+    return DistanceFields(
+        geodesic,
+        np.minimum(clearance, fields_config["max_clearance"]),
+        origin,
+        cell_size,
+    )
+
+
+def outline_points(x, y, yaw, extent):
+    """[6, 2] points of a box: its 4 corners and the middle of its front and rear"""
+    length, width = extent
+    local = np.array(
+        [
+            [length, width],
+            [length, -width],
+            [-length, width],
+            [-length, -width],
+            [length, 0.0],
+            [-length, 0.0],
+        ]
+    )
+    cos_yaw, sin_yaw = math.cos(math.radians(yaw)), math.sin(math.radians(yaw))
+    rotation = np.array([[cos_yaw, sin_yaw], [-sin_yaw, cos_yaw]])
+    return np.array([x, y]) + local @ rotation
+
+
+class DistanceFieldCache(object):
+    """DistanceFields of the layouts, computed once and kept on disk at cache_dir
+    (in memory only if empty). The last memory_size layouts stay in memory"""
+
+    def __init__(self, exp_config, memory_size=16):
+        self.exp_config = exp_config
+        self.fields_config = exp_config["distance_fields"]
+        self.cache_dir = self.fields_config["cache_dir"]
+        self.memory_size = memory_size
+        self.fields = collections.OrderedDict()
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def get_key(self, town, parked_locations, goal_location, parking_points=None):
+        """Identifies the layout and the grid settings, at a centimeter resolution"""
+        origin, shape = lot_grid(self.exp_config, parking_points)
+        layout = {
+            "town": town,
+            "parked": np.round(np.asarray(parked_locations)[..., :2], 2).tolist(),
+            "goal": np.round(np.asarray(goal_location)[:2], 2).tolist(),
+            "yaw": self.exp_config["background_activity"]["parked_car_yaw"],
+            "origin": np.round(origin, 2).tolist(),
+            "shape": shape,
+        }
+        for key in ("cell_size", "parked_extent", "inflation", "max_clearance"):
+            layout[key] = self.fields_config[key]
+        digest = hashlib.sha1(json.dumps(layout, sort_keys=True).encode()).hexdigest()
+        return "{}_{}".format(town, digest[:16])
+
+    def get(self, town, parked_locations, goal_location, parking_points=None):
+        """DistanceFields of the layout, on the grid of its parking points (see
+        lot_grid)"""
+        key = self.get_key(town, parked_locations, goal_location, parking_points)
+        if key in self.fields:
+            self.fields.move_to_end(key)
+            return self.fields[key]
+
+        path = os.path.join(self.cache_dir, key + ".npz") if self.cache_dir else None
+        if path is not None and os.path.exists(path):
+            fields = DistanceFields.load(path)
+        else:
+            fields = compute_distance_fields(
+                self.exp_config, parked_locations, goal_location, parking_points
+            )
+            if path is not None:
+                fields.save(path)
+
+        self.fields[key] = fields
+        if len(self.fields) > self.memory_size:
+            self.fields.popitem(last=False)
+        return fields
+
+
+def main():
+    """Computes the distance fields of every layout of a scenario bank"""
+    import time
+
+    from config import read_config
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("scenario_bank")
+    parser.add_argument("--town", default=None, help="Town of the bank's layouts")
+    args = parser.parse_args()
+
+    exp_config = read_config()["experiment"]
+    town = args.town or exp_config["town"]
+    bank = ScenarioBank.load(args.scenario_bank)
+    cache = DistanceFieldCache(exp_config, memory_size=1)
+
+    start_time = time.perf_counter()
+    for index in range(len(bank)):
+        scenario = bank.get(index)
+        cache.get(
+            town,
+            scenario.parked_locations,
+            scenario.goal_location,
+            scenario.parking_points,
+        )
+        if (index + 1) % 100 == 0:
+            print("{} / {} layouts".format(index + 1, len(bank)))
+    print(
+        "Computed the distance fields of {} layouts in {:.1f}s".format(
+            len(bank), time.perf_counter() - start_time
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
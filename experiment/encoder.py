@@ -0,0 +1,87 @@
+import multiprocessing
+import os
+
+import numpy as np
+
+# Set by the processes that only run envs (e.g. the rollout workers)
+ENV_WORKER_VARIABLE = "CARLA_ENV_WORKER"
+
+
+def is_env_worker():
+    """Whether this process only runs envs: a child process (e.g. of SubprocVecEnv)
+    or a rollout worker. Otherwise the learner may run in the same process"""
+    return (
+        multiprocessing.parent_process() is not None
+        or os.environ.get(ENV_WORKER_VARIABLE) == "1"
+    )
+
+
+class FrozenEncoder(object):
+    """Pre-exported image encoder, run on the CPU of the env worker.
+
+    The model (TorchScript .pt or ONNX .onnx) receives all the cameras of a step as a
+    single float32 batch [n_cameras, C, H, W], holding the images as post-processed by
+    the experiment, and returns one embedding per camera [n_cameras, D]. The embeddings
+    are flattened into a single vector of n_cameras * D values.
+
+    torch's thread count is process-wide, so a TorchScript encoder only sets it to
+    'threads' in env worker processes (see is_env_worker). In the learner's process,
+    e.g. with a DummyVecEnv, torch keeps its own setting.
+    """
+
+    def __init__(self, path, threads=1):
+        self.path = path
+        self.threads = threads
+        self._input = None
+
+        extension = os.path.splitext(path)[1]
+        if extension == ".onnx":
+            import onnxruntime
+
+            options = onnxruntime.SessionOptions()
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+            self.session = onnxruntime.InferenceSession(
+                path, options, providers=["CPUExecutionProvider"]
+            )
+            self.input_name = self.session.get_inputs()[0].name
+            self._run = self._run_onnx
+        elif extension in (".pt", ".ts"):
+            import torch
+
+            if is_env_worker():
+                torch.set_num_threads(threads)
+            self.torch = torch
+            self.model = torch.jit.load(path, map_location="cpu").eval()
+            self._run = self._run_torchscript
+        else:
+            raise ValueError(
+                "Unknown encoder format '{}'. Use a TorchScript (.pt) or ONNX (.onnx) file".format(
+                    extension
+                )
+            )
+
+    def _run_onnx(self, batch):
+        return self.session.run(None, {self.input_name: batch})[0]
+
+    def _run_torchscript(self, batch):
+        with self.torch.inference_mode():
+            return self.model(self.torch.from_numpy(batch)).numpy()
+
+    def get_output_dim(self, image_shape, n_cameras):
+        """Size of the embedding vector, given the HxWxC shape of each camera"""
+        sample = [np.zeros(image_shape, dtype=np.float32)] * n_cameras
+        return self.encode(sample).shape[0]
+
+    def encode(self, images):
+        """Encodes the HxWxC images of the cameras in a single batch"""
+        n_cameras = len(images)
+        height, width, channels = images[0].shape
+        shape = (n_cameras, channels, height, width)
+        if self._input is None or self._input.shape != shape:
+            self._input = np.empty(shape, dtype=np.float32)
+        for i, image in enumerate(images):
+            self._input[i] = image.transpose(2, 0, 1)
+
+        embedding = self._run(self._input)
+        return np.asarray(embedding, dtype=np.float32).reshape(-1)
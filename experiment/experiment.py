@@ -1,14 +1,33 @@
-import datetime
 import math
 
 import carla
-import imageio
 import numpy as np
 from gymnasium.spaces import Box, Dict, Discrete, Tuple
 
+from experiment.actions import DISCRETE_ACTIONS
 from experiment.base_experiment import BaseExperiment
+from experiment.distance_fields import outline_points
+from experiment.encoder import FrozenEncoder
 from helper.carla_helper import post_process_image
 
+# Episode counters of reset that snapshots save, besides the locations
+STATE_KEYS = [
+    "time_idle",
+    "time_episode",
+    "collision_impulse",
+    "collision_count",
+    "hero_collided",
+    "hero_parked",
+    "done_time_idle",
+    "done_time_episode",
+    "done_collision",
+    "done_parked",
+    "terminated",
+    "truncated",
+    "last_goal_distance",
+    "last_velocity",
+]
+
 
 class Experiment(BaseExperiment):
     def __init__(self, exp_config):
@@ -20,13 +39,31 @@ class Experiment(BaseExperiment):
 
         self.allowed_types = [carla.LaneType.Driving, carla.LaneType.Parking]
 
+        # Distance fields of the layout, precomputed by the core
+        self.fields_config = self.exp_config["distance_fields"]
+        if self.fields_config["goal_distance"] not in ("euclidean", "geodesic"):
+            raise ValueError(
+                "Unknown goal_distance '{}'. Use 'euclidean' or 'geodesic'".format(
+                    self.fields_config["goal_distance"]
+                )
+            )
+
         self.last_action = None
 
+        # Optional frozen encoder, replacing the images by their embeddings
+        self.encoder = None
+        if self.exp_config["hero"]["encoder_path"]:
+            self.encoder = FrozenEncoder(
+                self.exp_config["hero"]["encoder_path"],
+                threads=self.exp_config["hero"]["encoder_threads"],
+            )
+
     def reset(self):
         # Ending variables
         self.time_idle = 0
         self.time_episode = 0
         self.collision_impulse = 0
+        self.collision_count = 0
         self.hero_collided = False
         self.hero_parked = False
 
@@ -49,6 +86,28 @@ class Experiment(BaseExperiment):
         self.prev_image_1 = None
         self.prev_image_2 = None
 
+    def get_state(self):
+        state = {}
+        for key in STATE_KEYS:
+            value = getattr(self, key)
+            state[key] = value.item() if isinstance(value, np.generic) else value
+        for key in ("last_location", "goal_location"):
+            location = getattr(self, key)
+            if location is not None:
+                state[key] = [location.x, location.y, location.z]
+        return state
+
+    def set_state(self, state):
+        for key in STATE_KEYS:
+            setattr(self, key, state[key])
+        for key in ("last_location", "goal_location"):
+            location = state.get(key)
+            setattr(
+                self,
+                key,
+                None if location is None else carla.Location(*map(float, location)),
+            )
+
     def get_action_space(self):
         if self.exp_config["continuous"]:
             return Tuple(
@@ -82,74 +141,38 @@ class Experiment(BaseExperiment):
             dtype=np.float32,
         )
 
-        obs_space = Dict({"image": image_space, "obj_distance": distance_space})
+        spaces = {"obj_distance": distance_space}
+        if self.fields_config["clearance_observation"]:
+            max_clearance = self.fields_config["max_clearance"]
+            spaces["clearance"] = Box(
+                low=-max_clearance, high=max_clearance, shape=(6,), dtype=np.float32
+            )
+        if self.exp_config["hero"]["goal_observation"]:
+            spaces["goal"] = Box(low=-np.inf, high=np.inf, shape=(5,), dtype=np.float32)
+
+        if not self.exp_config["hero"]["camera_observation"]:
+            return Dict(spaces)
+
+        if self.encoder is not None:
+            camera_shape = (
+                self.exp_config["hero"]["sensors"]["front_cam"]["image_size_y"],
+                self.exp_config["hero"]["sensors"]["front_cam"]["image_size_x"],
+                num_channels,
+            )
+            embedding_space = Box(
+                low=-np.inf,
+                high=np.inf,
+                shape=(self.encoder.get_output_dim(camera_shape, num_cameras),),
+                dtype=np.float32,
+            )
+            return Dict({"embedding": embedding_space, **spaces})
+
+        obs_space = Dict({"image": image_space, **spaces})
 
         return obs_space
 
     def get_actions(self):
-        return {
-            0: [0.0, 0.00, 0.0, False, False],  # Coast
-            1: [0.0, 0.00, 0.25, False, False],  # Apply Break
-            2: [0.0, 0.00, 0.5, False, False],  # Apply Break
-            3: [0.0, 0.00, 0.75, False, False],  # Apply Break
-            4: [0.0, 0.75, 0.0, False, False],  # Right
-            5: [0.0, 0.50, 0.0, False, False],  # Right
-            6: [0.0, 0.25, 0.0, False, False],  # Right
-            7: [0.0, -0.75, 0.0, False, False],  # Left
-            8: [0.0, -0.50, 0.0, False, False],  # Left
-            9: [0.0, -0.25, 0.0, False, False],  # Left
-            10: [0.25, 0.00, 0.0, False, False],  # Straight
-            11: [0.25, 0.75, 0.0, False, False],  # Right
-            12: [0.25, 0.50, 0.0, False, False],  # Right
-            13: [0.25, 0.25, 0.0, False, False],  # Right
-            14: [0.25, -0.75, 0.0, False, False],  # Left
-            15: [0.25, -0.50, 0.0, False, False],  # Left
-            16: [0.25, -0.25, 0.0, False, False],  # Left
-            17: [0.5, 0.00, 0.0, False, False],  # Straight
-            18: [0.5, 0.75, 0.0, False, False],  # Right
-            19: [0.5, 0.50, 0.0, False, False],  # Right
-            20: [0.5, 0.25, 0.0, False, False],  # Right
-            21: [0.5, -0.75, 0.0, False, False],  # Left
-            22: [0.5, -0.50, 0.0, False, False],  # Left
-            23: [0.5, -0.25, 0.0, False, False],  # Left
-            24: [0.75, 0.00, 0.0, False, False],  # Straight
-            25: [0.75, 0.75, 0.0, False, False],  # Right
-            26: [0.75, 0.50, 0.0, False, False],  # Right
-            27: [0.75, 0.25, 0.0, False, False],  # Right
-            28: [0.75, -0.75, 0.0, False, False],  # Left
-            29: [0.75, -0.50, 0.0, False, False],  # Left
-            30: [0.75, -0.25, 0.0, False, False],  # Left
-            31: [0.0, 0.00, 0.25, False, True],  # Apply Break (Reverse)
-            32: [0.0, 0.00, 0.5, False, True],  # Apply Break (Reverse)
-            33: [0.0, 0.00, 0.75, False, True],  # Apply Break (Reverse)
-            34: [0.0, 0.75, 0.0, False, True],  # Right (Reverse)
-            35: [0.0, 0.50, 0.0, False, True],  # Right (Reverse)
-            36: [0.0, 0.25, 0.0, False, True],  # Right (Reverse)
-            37: [0.0, -0.75, 0.0, False, True],  # Left (Reverse)
-            38: [0.0, -0.50, 0.0, False, True],  # Left (Reverse)
-            39: [0.0, -0.25, 0.0, False, True],  # Left (Reverse)
-            40: [0.25, 0.00, 0.0, False, True],  # Straight (Reverse)
-            41: [0.25, 0.75, 0.0, False, True],  # Right (Reverse)
-            42: [0.25, 0.50, 0.0, False, True],  # Right (Reverse)
-            43: [0.25, 0.25, 0.0, False, True],  # Right (Reverse)
-            44: [0.25, -0.75, 0.0, False, True],  # Left (Reverse)
-            45: [0.25, -0.50, 0.0, False, True],  # Left (Reverse)
-            46: [0.25, -0.25, 0.0, False, True],  # Left (Reverse)
-            47: [0.5, 0.00, 0.0, False, True],  # Straight (Reverse)
-            48: [0.5, 0.75, 0.0, False, True],  # Right (Reverse)
-            49: [0.5, 0.50, 0.0, False, True],  # Right (Reverse)
-            50: [0.5, 0.25, 0.0, False, True],  # Right (Reverse)
-            51: [0.5, -0.75, 0.0, False, True],  # Left (Reverse)
-            52: [0.5, -0.50, 0.0, False, True],  # Left (Reverse)
-            53: [0.5, -0.25, 0.0, False, True],  # Left (Reverse)
-            54: [0.75, 0.00, 0.0, False, True],  # Straight (Reverse)
-            55: [0.75, 0.75, 0.0, False, True],  # Right (Reverse)
-            56: [0.75, 0.50, 0.0, False, True],  # Right (Reverse)
-            57: [0.75, 0.25, 0.0, False, True],  # Right (Reverse)
-            58: [0.75, -0.75, 0.0, False, True],  # Left (Reverse)
-            59: [0.75, -0.50, 0.0, False, True],  # Left (Reverse)
-            60: [0.75, -0.25, 0.0, False, True],  # Left (Reverse)
-        }
+        return DISCRETE_ACTIONS
 
     def compute_action(self, action):
         vehicle_control = carla.VehicleControl()
@@ -182,23 +205,26 @@ class Experiment(BaseExperiment):
 
         return vehicle_control
 
-    def get_observation(self, core, sensor_data):
-        world = core.world
-        hero = core.hero
-        hero_location = hero.get_location()
-
-        collision = sensor_data.get("collision")
-        if collision is not None:
+    def update_events(self, sensor_data):
+        # collision: [number of events, max impulse, sum of impulses, other actor id]
+        collision = sensor_data["collision"][1]
+        if collision[0] > 0:
             self.hero_collided = True
-            self.collision_impulse = sensor_data["collision"][1][1]
+            self.collision_impulse = collision[1]
+            self.collision_count += int(collision[0])
             collision_data = [
-                "Object: " + str(sensor_data["collision"][1][0]),
-                "Intensity: " + str(sensor_data["collision"][1][1]),
+                "Object: " + str(int(collision[3])),
+                "Intensity: " + str(collision[1]),
             ]
             with open("collision_history.txt", "a") as f:
                 f.writelines("\n".join(collision_data))
                 f.write("\n")
 
+    def get_observation(self, core, sensor_data):
+        world = core.world
+        hero = core.hero
+        hero_location = hero.get_location()
+
         lidar_data = sensor_data["lidar"][1]
         lidar_actor_idx = lidar_data["ObjIdx"]
         actor_idx = []
@@ -232,8 +258,16 @@ class Experiment(BaseExperiment):
             actor_distance_list = sorted(actor_distance_list)[:max_lidar_actors]
 
         actor_distance_list = np.array(actor_distance_list, dtype=np.float32)
+        observation = {"obj_distance": actor_distance_list}
 
-        stacked_image = None
+        if self.fields_config["clearance_observation"]:
+            observation["clearance"] = self.get_clearance(core)
+        if self.exp_config["hero"]["goal_observation"]:
+            observation["goal"] = self.get_goal_state(core)
+        if not self.exp_config["hero"]["camera_observation"]:
+            return observation, {}
+
+        images = []
         for key in sensor_data.keys():
             if "cam" not in key:
                 continue
@@ -244,12 +278,50 @@ class Experiment(BaseExperiment):
                 normalized=self.exp_config["hero"]["camera_normalized"],
                 grayscale=self.exp_config["hero"]["camera_grayscale"],
             )
-            if stacked_image is None:
-                stacked_image = image
-            else:
-                stacked_image = np.dstack([stacked_image, image])
+            images.append(image)
+
+        if self.encoder is not None:
+            observation["embedding"] = self.encoder.encode(images)
+        else:
+            observation["image"] = np.dstack(images)
+        return observation, {}
+
+    def get_goal_state(self, core):
+        """Goal position in the hero's frame (m), cos and sin of the parked cars' yaw
+        relative to the hero and the hero's signed speed (m/s), as the "goal" vector
+        of CarlaKinematic-v0"""
+        transform = core.hero.get_transform()
+        velocity = core.hero.get_velocity()
+        forward = transform.get_forward_vector()
+        yaw = math.radians(transform.rotation.yaw)
+        cos_yaw, sin_yaw = math.cos(yaw), math.sin(yaw)
+        offset_x = core.goal_location.x - transform.location.x
+        offset_y = core.goal_location.y - transform.location.y
+        parked_yaw = self.exp_config["background_activity"]["parked_car_yaw"]
+        relative_yaw = math.radians(parked_yaw) - yaw
+        return np.array(
+            [
+                cos_yaw * offset_x + sin_yaw * offset_y,
+                -sin_yaw * offset_x + cos_yaw * offset_y,
+                math.cos(relative_yaw),
+                math.sin(relative_yaw),
+                velocity.x * forward.x + velocity.y * forward.y,
+            ],
+            dtype=np.float32,
+        )
 
-        return {"image": stacked_image, "obj_distance": actor_distance_list}, {}
+    def get_clearance(self, core):
+        """Signed distance of the hero's corners and bumpers to the parked cars, looked up
+        in the clearance field of the layout"""
+        transform = core.hero.get_transform()
+        extent = core.hero.bounding_box.extent
+        points = outline_points(
+            transform.location.x,
+            transform.location.y,
+            transform.rotation.yaw,
+            (extent.x, extent.y),
+        )
+        return core.distance_fields.clearance_at(points).astype(np.float32)
 
     def get_done_status(self, observation, core):
         hero = core.hero
@@ -299,13 +371,18 @@ class Experiment(BaseExperiment):
             self.last_location = hero_location
         self.goal_location = core.goal_location
 
-        # Distance to goal
-        goal_distance = float(
-            np.sqrt(
-                np.square(hero_location.x - self.goal_location.x)
-                + np.square(hero_location.y - self.goal_location.y)
+        # Distance to goal, straight or around the parked cars
+        if self.fields_config["goal_distance"] == "geodesic":
+            goal_distance = float(
+                core.distance_fields.goal_distance([hero_location.x, hero_location.y])
+            )
+        else:
+            goal_distance = float(
+                np.sqrt(
+                    np.square(hero_location.x - self.goal_location.x)
+                    + np.square(hero_location.y - self.goal_location.y)
+                )
             )
-        )
         if self.last_goal_distance is None:
             self.last_goal_distance = goal_distance
 
@@ -340,3 +417,14 @@ class Experiment(BaseExperiment):
             reward += 100
 
         return reward
+
+    def get_termination_cause(self):
+        if self.done_parked:
+            return "parked"
+        if self.done_collision:
+            return "collision"
+        if self.done_time_idle:
+            return "idle"
+        if self.done_time_episode:
+            return "max_time"
+        return "none"
@@ -0,0 +1,456 @@
+import math
+
+import numpy as np
+from gymnasium.spaces import Box, Dict, Discrete
+
+from experiment.actions import DISCRETE_ACTIONS
+from experiment.scenarios import ScenarioBank, parse_location, parse_rotation
+from helper.episode_metrics import TERMINATION_CAUSES
+
+
+def boxes_overlap(center, yaw, extent, box_centers, box_extent):
+    """Separating axis test between the hero's oriented box and axis-aligned boxes.
+
+    center [N, 2] and yaw [N] are in the frame of the boxes, box_centers is [K, 2].
+    Returns an [N, K] mask of the overlapping pairs"""
+    cos = np.abs(np.cos(yaw))[:, np.newaxis]
+    sin = np.abs(np.sin(yaw))[:, np.newaxis]
+    dx = box_centers[np.newaxis, :, 0] - center[:, np.newaxis, 0]
+    dy = box_centers[np.newaxis, :, 1] - center[:, np.newaxis, 1]
+    ax = np.cos(yaw)[:, np.newaxis]
+    ay = np.sin(yaw)[:, np.newaxis]
+
+    separated = np.abs(dx) > box_extent[0] + extent[0] * cos + extent[1] * sin
+    separated |= np.abs(dy) > box_extent[1] + extent[0] * sin + extent[1] * cos
+    separated |= np.abs(dx * ax + dy * ay) > (
+        extent[0] + box_extent[0] * cos + box_extent[1] * sin
+    )
+    separated |= np.abs(dy * ax - dx * ay) > (
+        extent[1] + box_extent[0] * sin + box_extent[1] * cos
+    )
+    return ~separated
+
+
+def cast_rays(origin, angles, box_centers, box_extent, mask, max_range):
+    """2D ray cast (slab method) against axis-aligned boxes, in float32.
+
+    origin [N, 2], angles [N, R], box_centers [N, K, 2] and mask [N, K], the boxes
+    present in each env. Returns the [N, R] index of the first box hit by each ray, -1
+    if none within max_range"""
+    with np.errstate(divide="ignore"):
+        inverse_x = (1 / np.cos(angles)).astype(np.float32)[:, :, np.newaxis]
+        inverse_y = (1 / np.sin(angles)).astype(np.float32)[:, :, np.newaxis]
+    offset = (box_centers - origin[:, np.newaxis]).astype(np.float32)
+    extent = np.asarray(box_extent, dtype=np.float32)
+
+    with np.errstate(invalid="ignore"):
+        t1 = (offset[:, np.newaxis, :, 0] - extent[0]) * inverse_x
+        t2 = (offset[:, np.newaxis, :, 0] + extent[0]) * inverse_x
+        t_near = np.minimum(t1, t2)
+        t_far = np.maximum(t1, t2)
+        t1 = (offset[:, np.newaxis, :, 1] - extent[1]) * inverse_y
+        t2 = (offset[:, np.newaxis, :, 1] + extent[1]) * inverse_y
+        np.maximum(t_near, np.minimum(t1, t2), out=t_near)
+        np.minimum(t_far, np.maximum(t1, t2), out=t_far)
+
+    np.maximum(t_near, 0.0, out=t_near)
+    hit = (t_far >= t_near) & (t_near <= max_range) & mask[:, np.newaxis, :]
+    distance = np.where(hit, t_near, np.inf)
+    first_box = np.argmin(distance, axis=2)
+    return np.where(hit.any(axis=2), first_box, -1)
+
+
+class KinematicParkingSim(object):
+    """Pure-numpy stand-in for CARLA and the Experiment, stepping N envs in lockstep.
+
+    The hero is a kinematic bicycle model driven by the discrete actions of the
+    Experiment. The parked cars are boxes on the occupied parking_points and the goal
+    is the goal_boundary box around the goal slot, both from the experiment config
+    (or a scenario bank). Collisions are oriented box tests, and obj_distance is
+    computed by casting 2D lidar rays against the parked cars: the distances from
+    the hero to the cars hit by a ray, sorted, padded with -1. The done flags and
+    reward follow Experiment.get_done_status and Experiment.compute_reward tick by
+    tick. There are no cameras, so the observation has a "goal" vector instead of
+    the images: the goal position in the hero's frame (m), the cos and sin of the
+    slot's yaw relative to the hero and the hero's speed (m/s).
+    """
+
+    def __init__(self, exp_config, n_envs, timestep, seed=None):
+        self.exp_config = exp_config
+        self.n_envs = n_envs
+        self.timestep = timestep
+        self.rng = np.random.default_rng(seed)
+
+        if exp_config["continuous"]:
+            raise ValueError("The kinematic simulator only has the discrete actions")
+        self.action_repeat = exp_config["action_repeat"]
+        self.max_time_idle = exp_config["max_time_idle"]
+        self.max_time_episode = exp_config["max_time_episode"]
+        self.max_lidar_actors = exp_config["hero"]["max_lidar_actors"]
+        self.lidar_range = exp_config["hero"]["sensors"]["lidar"]["range"]
+
+        config = exp_config["kinematic"]
+        self.wheelbase = config["wheelbase"]
+        self.rear_length = config["center_of_mass"] * self.wheelbase
+        self.max_steer_angle = math.radians(config["max_steer_angle"])
+        self.max_acceleration = config["max_acceleration"]
+        self.max_braking = config["max_braking"]
+        self.rolling_resistance = config["rolling_resistance"]
+        self.drag = config["drag"]
+        self.mass = config["mass"]
+        self.hero_extent = np.array(config["hero_extent"])
+        self.parked_extent = np.array(config["parked_extent"])
+        self.goal_margin = exp_config["hero"]["goal_margin"]
+        self.hero_jitter = config["hero_jitter"]
+        self.ray_offsets = np.linspace(
+            0, 2 * np.pi, config["lidar_rays"], endpoint=False
+        )
+        self.batch_size = config["batch_size"]
+
+        self.actions = np.array(
+            [DISCRETE_ACTIONS[i] for i in range(len(DISCRETE_ACTIONS))],
+            dtype=np.float64,
+        )
+
+        # Layouts, from the scenario bank or sampled as generate_scenarios does
+        background_config = exp_config["background_activity"]
+        hero_config = exp_config["hero"]
+        self.scenario_bank = None
+        if exp_config["scenario_bank"]:
+            self.scenario_bank = ScenarioBank.load(exp_config["scenario_bank"])
+            parking_points = self.scenario_bank.parking_points
+        else:
+            parking_points = np.stack(
+                [parse_location(point) for point in background_config["parking_points"]]
+            )
+        self.n_parked_cars = background_config["n_parked_cars"]
+        self.parked_yaw = math.radians(background_config["parked_car_yaw"])
+        self.parking_points = parking_points[:, :2].astype(np.float64)
+        # Parking points in the frame of the parked cars, where they are axis-aligned
+        self.parked_rotation = np.array(
+            [
+                [math.cos(self.parked_yaw), math.sin(self.parked_yaw)],
+                [-math.sin(self.parked_yaw), math.cos(self.parked_yaw)],
+            ]
+        )
+        self.parking_points_local = self.parking_points @ self.parked_rotation.T
+
+        goal_config = hero_config["goal_boundary"]
+        corners = np.stack(
+            [
+                parse_location(goal_config[corner])[:2]
+                for corner in ("top_left", "top_right", "bottom_left", "bottom_right")
+            ]
+        )
+        default_center = parse_location(goal_config["center"])[:2]
+        self.goal_extent = (corners.max(axis=0) - corners.min(axis=0)) / 2
+        self.goal_offset = (corners.max(axis=0) + corners.min(axis=0)) / 2
+        self.goal_offset -= default_center
+        self.default_goal_slot = int(
+            np.argmin(np.linalg.norm(self.parking_points - default_center, axis=1))
+        )
+        self.default_hero_start = np.concatenate(
+            [
+                parse_location(hero_config["spawn_point_loc"]),
+                parse_rotation(hero_config["spawn_point_rot"]),
+            ]
+        )
+
+        n_slots = len(self.parking_points)
+        self.goal_slot = np.zeros(n_envs, dtype=np.int64)
+        self.occupancy = np.zeros((n_envs, n_slots), dtype=bool)
+
+        # Hero state
+        self.location = np.zeros((n_envs, 2))
+        self.yaw = np.zeros(n_envs)
+        self.speed = np.zeros(n_envs)  # Signed, along the heading
+
+        # Experiment state
+        self.time_idle = np.zeros(n_envs, dtype=np.int64)
+        self.time_episode = np.zeros(n_envs, dtype=np.int64)
+        self.collision_impulse = np.zeros(n_envs)
+        self.collision_count = np.zeros(n_envs, dtype=np.int64)
+        self.last_goal_distance = np.zeros(n_envs)
+        self.last_velocity = np.zeros(n_envs)
+        self.done_collision = np.zeros(n_envs, dtype=bool)
+        self.done_parked = np.zeros(n_envs, dtype=bool)
+        self.done_time_idle = np.zeros(n_envs, dtype=bool)
+        self.done_time_episode = np.zeros(n_envs, dtype=bool)
+
+    def get_action_space(self):
+        return Discrete(len(self.actions))
+
+    def get_observation_space(self):
+        return Dict(
+            {
+                "goal": Box(low=-np.inf, high=np.inf, shape=(5,), dtype=np.float32),
+                "obj_distance": Box(
+                    low=-1,
+                    high=self.lidar_range,
+                    shape=(self.max_lidar_actors,),
+                    dtype=np.float32,
+                ),
+            }
+        )
+
+    @property
+    def goal_location(self):
+        return self.parking_points[self.goal_slot]
+
+    def reset(self, env_ids, scenario_index=None):
+        """Starts a new episode in the given envs. The layouts are taken from the
+        scenario bank (scenario_index, or random ones) or sampled"""
+        env_ids = np.asarray(env_ids)
+        n = len(env_ids)
+        n_slots = len(self.parking_points)
+
+        if self.scenario_bank is not None:
+            if scenario_index is None:
+                indices = self.rng.integers(len(self.scenario_bank), size=n)
+            else:
+                indices = np.broadcast_to(scenario_index, n)
+            self.goal_slot[env_ids] = self.scenario_bank.goal_slot[indices]
+            self.occupancy[env_ids] = np.unpackbits(
+                self.scenario_bank.occupancy[indices], axis=1, count=n_slots
+            ).astype(bool)
+            hero_start = self.scenario_bank.hero_start[indices].astype(np.float64)
+        else:
+            # Occupy a random subset of the slots, never the goal one
+            self.goal_slot[env_ids] = self.default_goal_slot
+            n_parked = np.minimum(
+                self.rng.choice(self.n_parked_cars, size=n), n_slots - 1
+            )
+            slot_priority = self.rng.random((n, n_slots))
+            slot_priority[:, self.default_goal_slot] = np.inf
+            slot_rank = np.argsort(np.argsort(slot_priority, axis=1), axis=1)
+            self.occupancy[env_ids] = slot_rank < n_parked[:, np.newaxis]
+            hero_start = np.tile(self.default_hero_start, (n, 1))
+            hero_start[:, :2] += self.rng.uniform(
+                -self.hero_jitter[0], self.hero_jitter[0], size=(n, 2)
+            )
+            hero_start[:, 4] += self.rng.uniform(
+                -self.hero_jitter[1], self.hero_jitter[1], size=n
+            )
+
+        self.location[env_ids] = hero_start[:, :2]
+        self.yaw[env_ids] = np.radians(hero_start[:, 4])
+        self.speed[env_ids] = 0.0
+
+        self.time_idle[env_ids] = 0
+        self.time_episode[env_ids] = 0
+        self.collision_impulse[env_ids] = 0.0
+        self.collision_count[env_ids] = 0
+        self.last_velocity[env_ids] = 0.0
+        self.last_goal_distance[env_ids] = np.nan  # Set at the first tick
+        for flag in (
+            self.done_collision,
+            self.done_parked,
+            self.done_time_idle,
+            self.done_time_episode,
+        ):
+            flag[env_ids] = False
+
+    def step(self, actions):
+        """Applies the actions for action_repeat ticks, stopping each env at its done
+        tick. Returns the reward, terminated, truncated and number of ticks per env"""
+        control = self.actions[np.asarray(actions, dtype=np.int64)]
+        reward = np.zeros(self.n_envs)
+        active = np.ones(self.n_envs, dtype=bool)
+        ticks = np.zeros(self.n_envs, dtype=np.int64)
+        for _ in range(self.action_repeat):
+            self.tick(control, active)
+            ticks += active
+            reward += np.where(active, self.compute_reward(active), 0.0)
+            active &= ~(self.terminated | self.truncated)
+            if not active.any():
+                break
+        return reward, self.terminated.copy(), self.truncated.copy(), ticks
+
+    def tick(self, control, active):
+        """Moves the active heroes by one timestep and updates their done status"""
+        dt = self.timestep
+        throttle, steer, brake = control[:, 0], control[:, 1], control[:, 2]
+        direction = np.where(control[:, 4] > 0, -1.0, 1.0)
+
+        speed = self.speed + direction * throttle * self.max_acceleration * dt
+        deceleration = (
+            brake * self.max_braking + self.rolling_resistance + self.drag * speed**2
+        ) * dt
+        speed = np.sign(speed) * np.maximum(np.abs(speed) - deceleration, 0.0)
+
+        # Bicycle model around the center of mass. Positive steer and yaw turn right
+        steer_angle = steer * self.max_steer_angle
+        slip = np.arctan(self.rear_length / self.wheelbase * np.tan(steer_angle))
+        heading = self.yaw + slip
+        location = self.location + dt * speed[:, np.newaxis] * np.stack(
+            [np.cos(heading), np.sin(heading)], axis=1
+        )
+        yaw = self.yaw + dt * speed / self.rear_length * np.sin(slip)
+
+        self.location = np.where(active[:, np.newaxis], location, self.location)
+        self.yaw = np.where(active, yaw, self.yaw)
+        self.speed = np.where(active, speed, self.speed)
+
+        # update_events: a collision event each tick the hero overlaps a parked car
+        collided = active & self.get_collisions().any(axis=1)
+        self.collision_impulse = np.where(
+            collided, self.mass * np.abs(self.speed), self.collision_impulse
+        )
+        self.collision_count += collided
+        self.done_collision |= collided
+
+        # get_done_status
+        velocity = 3.6 * np.abs(self.speed)
+        self.done_parked |= active & self.get_parked()
+        self.time_idle = np.where(
+            active, np.where(velocity > 1.0, 0, self.time_idle + 1), self.time_idle
+        )
+        self.done_time_idle = self.max_time_idle < self.time_idle
+        self.time_episode += active
+        self.done_time_episode = self.max_time_episode < self.time_episode
+
+    @property
+    def terminated(self):
+        return self.done_collision | self.done_parked
+
+    @property
+    def truncated(self):
+        return self.done_time_episode | self.done_time_idle
+
+    def compute_reward(self, active):
+        velocity = 3.6 * np.abs(self.speed)
+        goal_distance = self.get_goal_distance()
+        self.last_goal_distance = np.where(
+            np.isnan(self.last_goal_distance), goal_distance, self.last_goal_distance
+        )
+        delta_goal_distance = self.last_goal_distance - goal_distance
+        delta_velocity = velocity - self.last_velocity
+        self.last_goal_distance = np.where(
+            active, goal_distance, self.last_goal_distance
+        )
+        self.last_velocity = np.where(active, velocity, self.last_velocity)
+
+        reward = 1 * delta_goal_distance
+        reward += np.where(
+            velocity < 30,
+            0.5 * delta_velocity,
+            np.where(velocity > 40, -1 * delta_velocity, 0.0),
+        )
+        reward += np.where(self.done_time_idle, -100, 0)
+        reward += np.where(self.done_time_episode, -100, 0)
+        reward += np.where(self.done_collision, -0.1 * self.collision_impulse, 0.0)
+        reward += np.where(self.done_parked, 100, 0)
+        return reward
+
+    def get_termination_cause(self):
+        """Index in TERMINATION_CAUSES of the done cause of each env, as
+        Experiment.get_termination_cause"""
+        cause = np.full(self.n_envs, TERMINATION_CAUSES.index("none"))
+        for flag, name in (
+            (self.done_time_episode, "max_time"),
+            (self.done_time_idle, "idle"),
+            (self.done_collision, "collision"),
+            (self.done_parked, "parked"),
+        ):
+            cause[flag] = TERMINATION_CAUSES.index(name)
+        return cause
+
+    def get_goal_distance(self):
+        return np.linalg.norm(self.location - self.goal_location, axis=1)
+
+    def get_local_pose(self):
+        """Hero location and yaw in the frame of the parked cars"""
+        return self.location @ self.parked_rotation.T, self.yaw - self.parked_yaw
+
+    def get_collisions(self):
+        location, yaw = self.get_local_pose()
+        return (
+            boxes_overlap(
+                location,
+                yaw,
+                self.hero_extent,
+                self.parking_points_local,
+                self.parked_extent,
+            )
+            & self.occupancy
+        )
+
+    def get_parked(self):
+        """Whether the hero's footprint is inside the goal box (grown by goal_margin)"""
+        cos = np.abs(np.cos(self.yaw))
+        sin = np.abs(np.sin(self.yaw))
+        footprint = np.stack(
+            [
+                self.hero_extent[0] * cos + self.hero_extent[1] * sin,
+                self.hero_extent[0] * sin + self.hero_extent[1] * cos,
+            ],
+            axis=1,
+        )
+        offset = np.abs(self.location - (self.goal_location + self.goal_offset))
+        return np.all(offset + footprint <= self.goal_extent + self.goal_margin, axis=1)
+
+    def get_observation(self, env_ids=None):
+        """Observations of the given envs (all by default)"""
+        if env_ids is None:
+            env_ids = np.arange(self.n_envs)
+        return {
+            "goal": self.get_goal_state(env_ids),
+            "obj_distance": self.get_obj_distance(env_ids),
+        }
+
+    def get_goal_state(self, env_ids):
+        offset = self.goal_location[env_ids] - self.location[env_ids]
+        yaw = self.yaw[env_ids]
+        cos, sin = np.cos(yaw), np.sin(yaw)
+        relative_yaw = self.parked_yaw - yaw
+        return np.stack(
+            [
+                cos * offset[:, 0] + sin * offset[:, 1],
+                -sin * offset[:, 0] + cos * offset[:, 1],
+                np.cos(relative_yaw),
+                np.sin(relative_yaw),
+                self.speed[env_ids],
+            ],
+            axis=1,
+        ).astype(np.float32)
+
+    def get_obj_distance(self, env_ids):
+        """Distances to the parked cars hit by the lidar rays. Only the cars within
+        range are cast against, in batches of envs to keep the [envs, rays, cars]
+        arrays small"""
+        location, yaw = self.get_local_pose()
+        location, yaw = location[env_ids], yaw[env_ids]
+        distance = np.linalg.norm(
+            self.parking_points[np.newaxis] - self.location[env_ids, np.newaxis], axis=2
+        )
+        candidates = self.occupancy[env_ids] & (
+            distance <= self.lidar_range + np.linalg.norm(self.parked_extent)
+        )
+
+        visible = np.zeros(candidates.shape, dtype=bool)
+        for start in range(0, len(env_ids), self.batch_size):
+            batch = slice(start, start + self.batch_size)
+            # Gather the candidate cars of each env first, padded with masked ones
+            n_candidates = max(int(candidates[batch].sum(axis=1).max()), 1)
+            slots = np.argsort(~candidates[batch], axis=1, kind="stable")
+            slots = slots[:, :n_candidates]
+            first_box = cast_rays(
+                location[batch],
+                yaw[batch, np.newaxis] + self.ray_offsets,
+                self.parking_points_local[slots],
+                self.parked_extent,
+                np.take_along_axis(candidates[batch], slots, axis=1),
+                self.lidar_range,
+            )
+            batch_ids, rays = np.nonzero(first_box >= 0)
+            visible[start + batch_ids, slots[batch_ids, first_box[batch_ids, rays]]] = (
+                True
+            )
+
+        distance = np.sort(np.where(visible, distance, np.inf), axis=1)
+        obj_distance = np.full((len(env_ids), self.max_lidar_actors), -1.0)
+        n = min(self.max_lidar_actors, distance.shape[1])
+        obj_distance[:, :n] = np.where(
+            np.isfinite(distance[:, :n]), distance[:, :n], -1.0
+        )
+        return obj_distance.astype(np.float32)
@@ -0,0 +1,118 @@
+import numpy as np
+
+
+def idle_run_length(idle):
+    """Number of consecutive idle ticks up to each tick (inclusive), along axis 1"""
+    count = np.cumsum(idle, axis=1)
+    last_active = np.maximum.accumulate(np.where(idle, 0, count), axis=1)
+    return count - last_active
+
+
+def last_event_value(events, values):
+    """Value of the last tick with an event up to each tick, 0 before the first one"""
+    ticks = np.arange(events.shape[1])
+    last_event = np.maximum.accumulate(np.where(events, ticks, -1), axis=1)
+    last_value = np.take_along_axis(values, np.maximum(last_event, 0), axis=1)
+    return np.where(last_event >= 0, last_value, 0.0)
+
+
+def compute_rewards(trajectories, exp_config):
+    """Vectorized version of Experiment.get_done_status and Experiment.compute_reward.
+
+    trajectories holds the recorded ticks of N episodes, padded to T ticks:
+        location       [N, T, 2+] hero location (x, y, ...)
+        velocity       [N, T, 3] hero velocity (m/s)
+        collision      [N, T, 4] collision sensor data of the tick
+                       [number of events, max impulse, sum of impulses, actor id]
+        goal_location  [N, 2+] goal of the episode (x, y, ...), e.g. to relabel goals
+        length         [N] number of ticks of each episode (optional)
+        parked         [N, T] the core's parked flag (optional, False by default)
+        goal_distance  [N, T] distance to the goal of each tick (optional), e.g. the
+                       geodesic one of experiment.distance_fields. Straight-line
+                       distance to goal_location by default
+
+    Returns the per-tick reward and done flags ([N, T] arrays), reproducing the
+    online quirks: the collision and parking flags are sticky, the first tick has no
+    goal distance delta but does have a velocity delta (from 0 km/h), and the idle and
+    episode timers are compared with strict inequalities.
+    """
+    location = np.asarray(trajectories["location"], dtype=np.float64)
+    velocity = np.asarray(trajectories["velocity"], dtype=np.float64)
+    collision = np.asarray(trajectories["collision"], dtype=np.float64)
+    goal_location = np.asarray(trajectories["goal_location"], dtype=np.float64)
+    n_episodes, n_ticks = location.shape[:2]
+    ticks = np.arange(n_ticks)
+
+    length = trajectories.get("length")
+    if length is None:
+        valid = np.ones((n_episodes, n_ticks), dtype=bool)
+    else:
+        valid = ticks < np.asarray(length)[:, np.newaxis]
+    parked = trajectories.get("parked")
+    if parked is None:
+        parked = np.zeros((n_episodes, n_ticks), dtype=bool)
+
+    # Same operations (and order) as the online methods, in float64
+    speed = 3.6 * np.sqrt(
+        velocity[..., 0] ** 2 + velocity[..., 1] ** 2 + velocity[..., 2] ** 2
+    )
+
+    # get_done_status
+    collision_events = collision[..., 0] > 0
+    done_collision = np.logical_or.accumulate(collision_events, axis=1)
+    collision_impulse = last_event_value(collision_events, collision[..., 1])
+    done_parked = np.logical_or.accumulate(np.asarray(parked, dtype=bool), axis=1)
+    done_time_idle = exp_config["max_time_idle"] < idle_run_length(speed <= 1.0)
+    done_time_episode = np.broadcast_to(
+        exp_config["max_time_episode"] < ticks + 1, (n_episodes, n_ticks)
+    )
+    terminated = np.logical_or.accumulate(done_collision | done_parked, axis=1)
+    truncated = np.logical_or.accumulate(done_time_episode | done_time_idle, axis=1)
+
+    # compute_reward
+    goal_distance = trajectories.get("goal_distance")
+    if goal_distance is None:
+        goal_distance = np.sqrt(
+            np.square(location[..., 0] - goal_location[:, np.newaxis, 0])
+            + np.square(location[..., 1] - goal_location[:, np.newaxis, 1])
+        )
+    else:
+        goal_distance = np.asarray(goal_distance, dtype=np.float64)
+    last_goal_distance = np.concatenate(
+        [goal_distance[:, :1], goal_distance[:, :-1]], axis=1
+    )
+    last_speed = np.concatenate([np.zeros((n_episodes, 1)), speed[:, :-1]], axis=1)
+    delta_goal_distance = last_goal_distance - goal_distance
+    delta_velocity = speed - last_speed
+
+    reward = np.zeros((n_episodes, n_ticks))
+    reward += 1 * delta_goal_distance
+    reward += np.where(
+        speed < 30,
+        0.5 * delta_velocity,
+        np.where(speed > 40, -1 * delta_velocity, 0.0),
+    )
+    reward += np.where(done_time_idle, -100, 0)
+    reward += np.where(done_time_episode, -100, 0)
+    reward += np.where(done_collision, -0.1 * collision_impulse, 0.0)
+    reward += np.where(done_parked, 100, 0)
+
+    results = {
+        "reward": reward,
+        "terminated": terminated,
+        "truncated": truncated,
+        "done_collision": done_collision,
+        "done_parked": done_parked,
+        "done_time_idle": done_time_idle,
+        "done_time_episode": done_time_episode,
+    }
+    return {key: np.where(valid, value, 0) for key, value in results.items()}
+
+
+def sum_per_step(values, action_repeat):
+    """Groups the ticks of [N, T] arrays into the env steps of action_repeat ticks"""
+    n_episodes, n_ticks = values.shape
+    n_steps = -(-n_ticks // action_repeat)
+    padded = np.zeros((n_episodes, n_steps * action_repeat), dtype=values.dtype)
+    padded[:, :n_ticks] = values
+    return padded.reshape(n_episodes, n_steps, action_repeat).sum(axis=2)
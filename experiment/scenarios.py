@@ -0,0 +1,279 @@
+import argparse
+import re
+
+import numpy as np
+
+LOCATION_PATTERN = re.compile(r"(x|y|z)\s*=\s*(-?[\d.]+)")
+
+
+def parse_location(text):
+    """Parses a 'carla.Location(x=.., y=.., z=..)' config string into an (x, y, z) array
+    without requiring the carla module"""
+    coordinates = dict(LOCATION_PATTERN.findall(text))
+    return np.array(
+        [float(coordinates.get(axis, 0.0)) for axis in ("x", "y", "z")],
+        dtype=np.float32,
+    )
+
+
+def parse_rotation(text):
+    """Parses a 'carla.Rotation(pitch=.., yaw=.., roll=..)' config string into a
+    (pitch, yaw, roll) array"""
+    angles = dict(re.findall(r"(pitch|yaw|roll)\s*=\s*(-?[\d.]+)", text))
+    return np.array(
+        [float(angles.get(axis, 0.0)) for axis in ("pitch", "yaw", "roll")],
+        dtype=np.float32,
+    )
+
+
+class Scenario(object):
+    """Layout of a single episode, as returned by the ScenarioBank"""
+
+    def __init__(
+        self,
+        index,
+        seed,
+        goal_slot,
+        goal_location,
+        parked_slots,
+        parked_locations,
+        walker_blueprints,
+        walker_start,
+        walker_target,
+        walker_speed,
+        hero_start,
+        parking_points,
+    ):
+        self.index = index
+        self.seed = seed
+        self.goal_slot = goal_slot
+        self.goal_location = goal_location  # [x, y, z]
+        self.parked_slots = parked_slots
+        self.parked_locations = parked_locations  # [n_parked, 3]
+        self.walker_blueprints = walker_blueprints  # [n_walkers] blueprint ids
+        self.walker_start = walker_start  # [n_walkers, 3]
+        self.walker_target = walker_target  # [n_walkers, 3]
+        self.walker_speed = walker_speed  # [n_walkers]
+        self.hero_start = hero_start  # [x, y, z, pitch, yaw, roll]
+        self.parking_points = parking_points  # [n_slots, 3] of the bank
+
+
+class ScenarioBank(object):
+    """Set of precomputed episode layouts, stored in a compact .npz file.
+
+    Walker locations are stored as indices into a shared pool of navigation points
+    and the parked-car occupancy as a bit-packed mask, so that thousands of layouts
+    only take a few MB. Layouts are picked in O(1) by index or seed.
+    """
+
+    def __init__(self, arrays):
+        self.parking_points = arrays["parking_points"]
+        self.navigation_points = arrays["navigation_points"]
+        self.walker_blueprint_ids = arrays["walker_blueprint_ids"]
+
+        self.seed = arrays["seed"]
+        self.goal_slot = arrays["goal_slot"]
+        self.occupancy = arrays["occupancy"]
+        self.n_walkers = arrays["n_walkers"]
+        self.walker_blueprint = arrays["walker_blueprint"]
+        self.walker_start = arrays["walker_start"]
+        self.walker_target = arrays["walker_target"]
+        self.walker_speed = arrays["walker_speed"]
+        self.hero_start = arrays["hero_start"]
+
+    def __len__(self):
+        return len(self.goal_slot)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as arrays:
+            return cls({key: arrays[key] for key in arrays.files})
+
+    def save(self, path):
+        np.savez_compressed(
+            path,
+            parking_points=self.parking_points,
+            navigation_points=self.navigation_points,
+            walker_blueprint_ids=self.walker_blueprint_ids,
+            seed=self.seed,
+            goal_slot=self.goal_slot,
+            occupancy=self.occupancy,
+            n_walkers=self.n_walkers,
+            walker_blueprint=self.walker_blueprint,
+            walker_start=self.walker_start,
+            walker_target=self.walker_target,
+            walker_speed=self.walker_speed,
+            hero_start=self.hero_start,
+        )
+
+    def index_from_seed(self, seed):
+        return int(seed) % len(self)
+
+    def get(self, index):
+        """Returns the Scenario at the given index"""
+        n_slots = len(self.parking_points)
+        occupancy = np.unpackbits(self.occupancy[index], count=n_slots).astype(bool)
+        parked_slots = np.flatnonzero(occupancy)
+        n_walkers = int(self.n_walkers[index])
+        goal_slot = int(self.goal_slot[index])
+
+        return Scenario(
+            index=index,
+            seed=int(self.seed[index]),
+            goal_slot=goal_slot,
+            goal_location=self.parking_points[goal_slot],
+            parked_slots=parked_slots,
+            parked_locations=self.parking_points[parked_slots],
+            walker_blueprints=self.walker_blueprint_ids[
+                self.walker_blueprint[index, :n_walkers]
+            ],
+            walker_start=self.navigation_points[self.walker_start[index, :n_walkers]],
+            walker_target=self.navigation_points[self.walker_target[index, :n_walkers]],
+            walker_speed=self.walker_speed[index, :n_walkers],
+            hero_start=self.hero_start[index],
+            parking_points=self.parking_points,
+        )
+
+
+def generate_scenarios(
+    n_scenarios,
+    exp_config,
+    navigation_points,
+    walker_blueprints,
+    random_goal=False,
+    hero_jitter=(0.0, 0.0),
+    percentage_walker_running=0.0,
+    seed=0,
+):
+    """Precomputes n_scenarios episode layouts.
+
+    navigation_points is an [N, 3] pool of points sampled from the navigation mesh,
+    walker_blueprints a list of (blueprint id, walking speed, running speed) and
+    hero_jitter the (location, yaw) noise added to the hero's spawn point.
+    """
+    rng = np.random.default_rng(seed)
+    background_config = exp_config["background_activity"]
+    hero_config = exp_config["hero"]
+
+    parking_points = np.stack(
+        [parse_location(point) for point in background_config["parking_points"]]
+    )
+    n_slots = len(parking_points)
+    default_goal = parse_location(hero_config["goal_boundary"]["center"])
+    default_goal_slot = int(
+        np.argmin(np.linalg.norm(parking_points - default_goal, axis=1))
+    )
+
+    navigation_points = np.asarray(navigation_points, dtype=np.float32)
+    blueprint_ids = np.array([blueprint[0] for blueprint in walker_blueprints])
+    blueprint_speeds = np.array(
+        [blueprint[1:] for blueprint in walker_blueprints], dtype=np.float32
+    )
+    max_walkers = max(background_config["n_walkers"])
+
+    if random_goal:
+        goal_slot = rng.integers(0, n_slots, size=n_scenarios)
+    else:
+        goal_slot = np.full(n_scenarios, default_goal_slot)
+
+    # Occupy a random subset of the slots, never the goal one
+    n_parked = rng.choice(background_config["n_parked_cars"], size=n_scenarios)
+    n_parked = np.minimum(n_parked, n_slots - 1)
+    slot_priority = rng.random((n_scenarios, n_slots))
+    slot_priority[np.arange(n_scenarios), goal_slot] = np.inf
+    slot_rank = np.argsort(np.argsort(slot_priority, axis=1), axis=1)
+    occupancy = np.packbits(slot_rank < n_parked[:, np.newaxis], axis=1)
+
+    n_walkers = rng.choice(background_config["n_walkers"], size=n_scenarios)
+    walker_blueprint = rng.integers(
+        0, len(blueprint_ids), size=(n_scenarios, max_walkers)
+    )
+    walker_start = rng.integers(
+        0, len(navigation_points), size=(n_scenarios, max_walkers)
+    )
+    walker_target = rng.integers(
+        0, len(navigation_points), size=(n_scenarios, max_walkers)
+    )
+    running = rng.random((n_scenarios, max_walkers)) < percentage_walker_running
+    walker_speed = blueprint_speeds[walker_blueprint, running.astype(int)]
+
+    hero_location = parse_location(hero_config["spawn_point_loc"])
+    hero_rotation = parse_rotation(hero_config["spawn_point_rot"])
+    hero_start = np.tile(
+        np.concatenate([hero_location, hero_rotation]), (n_scenarios, 1)
+    )
+    hero_start[:, :2] += rng.uniform(
+        -hero_jitter[0], hero_jitter[0], size=(n_scenarios, 2)
+    )
+    hero_start[:, 4] += rng.uniform(-hero_jitter[1], hero_jitter[1], size=n_scenarios)
+
+    return ScenarioBank(
+        {
+            "parking_points": parking_points,
+            "navigation_points": navigation_points,
+            "walker_blueprint_ids": blueprint_ids,
+            "seed": rng.integers(0, 2**31, size=n_scenarios, dtype=np.uint32),
+            "goal_slot": goal_slot.astype(np.int16),
+            "occupancy": occupancy,
+            "n_walkers": n_walkers.astype(np.int16),
+            "walker_blueprint": walker_blueprint.astype(np.int16),
+            "walker_start": walker_start.astype(np.int32),
+            "walker_target": walker_target.astype(np.int32),
+            "walker_speed": walker_speed.astype(np.float32),
+            "hero_start": hero_start.astype(np.float32),
+        }
+    )
+
+
+def main():
+    """Samples the navigation mesh and walker blueprints of the experiment's town
+    and writes a scenario bank"""
+    from carla_integration.core import CarlaCore
+    from config import read_config
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n-scenarios", type=int, default=5000)
+    parser.add_argument("--n-navigation-points", type=int, default=4096)
+    parser.add_argument("--random-goal", action="store_true")
+    parser.add_argument("--hero-jitter", type=float, nargs=2, default=[0.0, 0.0])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="scenarios.npz")
+    args = parser.parse_args()
+
+    config = read_config()
+    core = CarlaCore(config["carla"], config["experiment"])
+    try:
+        core.setup_experiment()
+        navigation_points = []
+        while len(navigation_points) < args.n_navigation_points:
+            loc = core.world.get_random_location_from_navigation()
+            if loc is not None:
+                navigation_points.append([loc.x, loc.y, loc.z])
+
+        walker_blueprints = []
+        for blueprint in core.world.get_blueprint_library().filter(
+            "walker.pedestrian.*"
+        ):
+            if blueprint.has_attribute("speed"):
+                speeds = blueprint.get_attribute("speed").recommended_values
+                walker_blueprints.append((blueprint.id, speeds[1], speeds[2]))
+            else:
+                walker_blueprints.append((blueprint.id, 0.0, 0.0))
+    finally:
+        core.stop_server()
+
+    bank = generate_scenarios(
+        args.n_scenarios,
+        config["experiment"],
+        navigation_points,
+        walker_blueprints,
+        random_goal=args.random_goal,
+        hero_jitter=args.hero_jitter,
+        seed=args.seed,
+    )
+    bank.save(args.output)
+    print("Saved {} scenarios to {}".format(len(bank), args.output))
+
+
+if __name__ == "__main__":
+    main()
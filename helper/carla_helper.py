@@ -1,21 +1,19 @@
-import collections
+import collections.abc
 import os
 import re
 import signal
 import sys
 
 import carla
-import cv2
 import numpy as np
-import psutil
-from PIL import Image
 
-from helper.list_procs import search_procs_by_name
+# Environment variable tagging the servers with the run that started them
+SERVER_OWNER_VARIABLE = "CARLA_SERVER_OWNER"
 
 
 def update_config(d, u):
     for k, v in u.items():
-        if isinstance(v, collections.Mapping):
+        if isinstance(v, collections.abc.Mapping):
             d[k] = update_config(d.get(k, {}), v)
         else:
             d[k] = v
@@ -52,6 +50,8 @@ def post_process_image(image, normalized=True, grayscale=True):
         image = image[0]
 
     if grayscale:
+        from PIL import Image
+
         image = image.astype(np.uint8)
         image = np.array(Image.fromarray(image).convert("L"))
         image = image[:, :, np.newaxis]
@@ -62,12 +62,59 @@ def post_process_image(image, normalized=True, grayscale=True):
         return image.astype(np.uint8)
 
 
+def concat_cameras(image, num_cameras=4):
+    """Arranges the stacked camera images of an observation into a 2-row RGB mosaic"""
+    if image.dtype != np.uint8:
+        image = np.clip(image * 128 + 128, 0, 255).astype(np.uint8)
+
+    cameras = np.split(image, num_cameras, axis=2)
+    if cameras[0].shape[2] == 1:
+        cameras = [np.repeat(camera, 3, axis=2) for camera in cameras]
+
+    columns = int(np.ceil(num_cameras / 2))
+    cameras += [np.zeros_like(cameras[0])] * (2 * columns - num_cameras)
+    top_row = np.concatenate(cameras[:columns], axis=1)
+    bottom_row = np.concatenate(cameras[columns:], axis=1)
+    return np.concatenate([top_row, bottom_row], axis=0)
+
+
 def kill_server():
     """Kill all PIDs that start with Carla. Do this if you running a single server"""
+    from helper.list_procs import search_procs_by_name
+
     for pid, name in search_procs_by_name("Carla").items():
         os.kill(pid, signal.SIGTERM)
 
 
+def kill_process_tree(pid):
+    """Kills a process and its children, e.g. a server started by this program"""
+    import psutil
+
+    try:
+        process = psutil.Process(pid)
+        for child in process.children(recursive=True):
+            child.kill()
+        process.kill()
+    except psutil.NoSuchProcess:
+        pass
+
+
+def kill_owned_servers(owner):
+    """Kills the servers started with the given SERVER_OWNER_VARIABLE in their
+    environment (inherited from the process that started them), and their children"""
+    import psutil
+
+    from helper.list_procs import search_procs_by_name
+
+    for pid in search_procs_by_name("Carla"):
+        try:
+            environment = psutil.Process(pid).environ()
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+        if environment.get(SERVER_OWNER_VARIABLE) == owner:
+            kill_process_tree(pid)
+
+
 def find_weather_presets():
     rgx = re.compile(".+?(?:(?<=[a-z])(?=[A-Z])|(?<=[A-Z])(?=[A-Z][a-z])|$)")
     name = lambda x: " ".join(m.group(0) for m in rgx.finditer(x))
@@ -80,6 +127,21 @@ def get_actor_display_name(actor, truncate=250):
     return (name[: truncate - 1] + "\u2026") if len(name) > truncate else name
 
 
+def get_map_layers(layer_names, enable_map_assets=True):
+    """Combines the names of the carla.MapLayer flags into a single value. If no names
+    are given, all the layers (or none of them) are used depending on enable_map_assets
+    """
+    if not layer_names:
+        return carla.MapLayer.All if enable_map_assets else carla.MapLayer.NONE
+
+    map_layers = carla.MapLayer.NONE
+    for name in layer_names:
+        map_layers |= getattr(carla.MapLayer, name)
+    return map_layers
+
+
 def is_used(port):
     """Checks whether or not a port is used"""
+    import psutil
+
     return port in [conn.laddr.port for conn in psutil.net_connections()]
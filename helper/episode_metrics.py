@@ -0,0 +1,155 @@
+import json
+import os
+import socket
+import uuid
+
+import numpy as np
+
+TERMINATION_CAUSES = [
+    "none",
+    "parked",
+    "collision",
+    "idle",
+    "max_time",
+    "interrupted",
+    "stalled",
+]
+
+METRICS_COLUMNS = {
+    "episode_return": np.float64,
+    "length": np.int32,  # Agent steps
+    "ticks": np.int32,  # Simulation ticks
+    "termination": np.uint8,  # Index of TERMINATION_CAUSES
+    "wall_time": np.float64,
+    "sim_time": np.float64,
+    "real_time_factor": np.float32,
+    "reset_time": np.float64,
+    "collisions": np.int32,
+    "end_timestamp": np.float64,
+    "tick_p50_ms": np.float32,
+    "tick_p99_ms": np.float32,
+    "tick_p999_ms": np.float32,
+    "recoveries": np.int32,  # Stalled ticks recovered by the watchdog
+}
+
+
+class EpisodeMetrics(object):
+    """Per-episode metrics recorder of an env worker. Rows are buffered in memory and
+    appended in batches to one raw file per column, inside a directory owned by the
+    worker, so workers never share a file (nor a lock). The columns can be memory
+    mapped with load_metrics."""
+
+    def __init__(self, metrics_dir, worker_id=None, flush_every=32):
+        if worker_id is None:
+            worker_id = "{}_{}_{}".format(
+                socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8]
+            )
+        self.path = os.path.join(metrics_dir, worker_id)
+        self.flush_every = flush_every
+        self._rows = []
+
+        os.makedirs(self.path, exist_ok=True)
+        schema = {name: np.dtype(dtype).str for name, dtype in METRICS_COLUMNS.items()}
+        with open(os.path.join(self.path, "schema.json"), "w") as f:
+            json.dump({"columns": schema, "termination": TERMINATION_CAUSES}, f)
+
+    def record(self, **row):
+        """Adds the metrics of an episode. Missing columns are set to 0"""
+        if isinstance(row.get("termination"), str):
+            row["termination"] = TERMINATION_CAUSES.index(row["termination"])
+        self._rows.append(tuple(row.get(name, 0) for name in METRICS_COLUMNS))
+        if len(self._rows) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if not self._rows:
+            return
+        columns = zip(*self._rows)
+        for (name, dtype), values in zip(METRICS_COLUMNS.items(), columns):
+            with open(os.path.join(self.path, name + ".bin"), "ab") as f:
+                f.write(np.asarray(values, dtype=dtype).tobytes())
+        self._rows = []
+
+    def close(self):
+        self.flush()
+
+
+def load_metrics(metrics_dir):
+    """Memory maps the metrics of all the workers in metrics_dir and returns them as a
+    dictionary of columns {name: array}, with an extra 'worker' column"""
+    columns = {name: [] for name in METRICS_COLUMNS}
+    columns["worker"] = []
+
+    for worker_id in sorted(os.listdir(metrics_dir)):
+        worker_path = os.path.join(metrics_dir, worker_id)
+        if not os.path.isfile(os.path.join(worker_path, "schema.json")):
+            continue
+
+        worker_columns = {}
+        for name, dtype in METRICS_COLUMNS.items():
+            path = os.path.join(worker_path, name + ".bin")
+            if not os.path.isfile(path) or os.path.getsize(path) == 0:
+                worker_columns[name] = np.empty(0, dtype=dtype)
+            else:
+                worker_columns[name] = np.memmap(path, dtype=dtype, mode="r")
+        # A worker might have been killed halfway through a flush
+        n_rows = min(len(column) for column in worker_columns.values())
+
+        for name, column in worker_columns.items():
+            columns[name].append(column[:n_rows])
+        columns["worker"].append(np.full(n_rows, worker_id, dtype=object))
+
+    if len(columns["worker"]) == 1:
+        return {name: parts[0] for name, parts in columns.items()}
+    return {
+        name: np.concatenate(parts) if parts else np.empty(0)
+        for name, parts in columns.items()
+    }
+
+
+def summarize_metrics(columns):
+    """Aggregates the metrics of all the episodes"""
+    n_episodes = len(columns["length"])
+    if n_episodes == 0:
+        return {"episodes": 0}
+
+    termination = np.asarray(columns["termination"])
+    causes = np.bincount(termination, minlength=len(TERMINATION_CAUSES))
+    parked = termination == TERMINATION_CAUSES.index("parked")
+    summary = {
+        "episodes": n_episodes,
+        "workers": len(set(columns["worker"])),
+        "success_rate": float(parked.mean()),
+        "collision_rate": float((np.asarray(columns["collisions"]) > 0).mean()),
+        "mean_return": float(np.mean(columns["episode_return"])),
+        "mean_length": float(np.mean(columns["length"])),
+        "mean_real_time_factor": float(np.mean(columns["real_time_factor"])),
+        "mean_reset_time": float(np.mean(columns["reset_time"])),
+        "p50_wall_time": float(np.percentile(columns["wall_time"], 50)),
+        "p95_wall_time": float(np.percentile(columns["wall_time"], 95)),
+        "mean_tick_p50_ms": float(np.mean(columns["tick_p50_ms"])),
+        "mean_tick_p99_ms": float(np.mean(columns["tick_p99_ms"])),
+        "max_tick_p999_ms": float(np.max(columns["tick_p999_ms"])),
+        "recoveries": int(np.sum(columns["recoveries"])),
+        "terminations": {
+            cause: int(count) for cause, count in zip(TERMINATION_CAUSES, causes)
+        },
+    }
+    if parked.any():
+        summary["mean_time_to_park"] = float(np.mean(columns["sim_time"][parked]))
+    return summary
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("metrics_dir")
+    args = parser.parse_args()
+
+    summary = summarize_metrics(load_metrics(args.metrics_dir))
+    print(json.dumps(summary, indent=4))
+
+
+if __name__ == "__main__":
+    main()
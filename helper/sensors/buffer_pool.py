@@ -0,0 +1,35 @@
+import numpy as np
+
+
+class DoubleBuffer(object):
+    """Pair of preallocated arrays used to parse the data of a sensor without
+    allocating new memory every frame. Each reading is copied once into the back
+    buffer, which is then swapped to the front and handed to the consumer.
+
+    Ownership: the array returned by next() belongs to the buffer. It stays valid
+    until next() is called twice more, i.e. until the reading after the next one is
+    parsed. Consumers keeping the data for longer than that must copy it.
+
+    Buffers with a variable number of rows (e.g. lidar points) grow when a reading
+    doesn't fit, and return only the used rows.
+    """
+
+    def __init__(self, shape, dtype):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self._buffers = [np.empty(self.shape, self.dtype) for _ in range(2)]
+        self._back = 0
+
+    @property
+    def capacity(self):
+        return self.shape[0]
+
+    def next(self, rows=None):
+        """Returns the back buffer (only its first rows, if given) and swaps the buffers"""
+        if rows is not None and rows > self.capacity:
+            self.shape = (int(2 ** np.ceil(np.log2(rows))),) + self.shape[1:]
+            self._buffers = [np.empty(self.shape, self.dtype) for _ in range(2)]
+
+        buffer = self._buffers[self._back]
+        self._back = 1 - self._back
+        return buffer if rows is None else buffer[:rows]
@@ -1,39 +1,71 @@
+import carla
+
 from helper.sensors.sensors import *
 
+SENSOR_CLASSES = {
+    "sensor.camera.rgb": CameraRGB,
+    "sensor.camera.depth": CameraDepth,
+    "sensor.camera.semantic_segmentation": CameraSemanticSegmentation,
+    "sensor.camera.dvs": CameraDVS,
+    "sensor.lidar.ray_cast": Lidar,
+    "sensor.lidar.ray_cast_semantic": SemanticLidar,
+    "sensor.other.radar": Radar,
+    "sensor.other.gnss": Gnss,
+    "sensor.other.imu": Imu,
+    "sensor.other.lane_invasion": LaneInvasion,
+    "sensor.other.collision": Collision,
+    "sensor.other.obstacle": Obstacle,
+}
+
 
 class SensorFactory(object):
     """Class to simplify the creation of the different CARLA sensors"""
 
     @staticmethod
-    def spawn(name, attributes, interface, parent):
+    def spawn(name, attributes, interface, parent, **kwargs):
         attributes = attributes.copy()
         type_ = attributes.get("type", "")
 
-        if type_ == "sensor.camera.rgb":
-            sensor = CameraRGB(name, attributes, interface, parent)
-        elif type_ == "sensor.camera.depth":
-            sensor = CameraDepth(name, attributes, interface, parent)
-        elif type_ == "sensor.camera.semantic_segmentation":
-            sensor = CameraSemanticSegmentation(name, attributes, interface, parent)
-        elif type_ == "sensor.camera.dvs":
-            sensor = CameraDVS(name, attributes, interface, parent)
-        elif type_ == "sensor.lidar.ray_cast":
-            sensor = Lidar(name, attributes, interface, parent)
-        elif type_ == "sensor.lidar.ray_cast_semantic":
-            sensor = SemanticLidar(name, attributes, interface, parent)
-        elif type_ == "sensor.other.radar":
-            sensor = Radar(name, attributes, interface, parent)
-        elif type_ == "sensor.other.gnss":
-            sensor = Gnss(name, attributes, interface, parent)
-        elif type_ == "sensor.other.imu":
-            sensor = Imu(name, attributes, interface, parent)
-        elif type_ == "sensor.other.lane_invasion":
-            sensor = LaneInvasion(name, attributes, interface, parent)
-        elif type_ == "sensor.other.collision":
-            sensor = Collision(name, attributes, interface, parent)
-        elif type_ == "sensor.other.obstacle":
-            sensor = Obstacle(name, attributes, interface, parent)
-        else:
+        if type_ not in SENSOR_CLASSES:
             raise RuntimeError("Sensor of type {} not supported".format(type_))
 
-        return sensor
+        return SENSOR_CLASSES[type_](name, attributes, interface, parent, **kwargs)
+
+    @staticmethod
+    def spawn_rig(sensors_config, interface, parent, client, blueprint_library):
+        """Spawns all the sensors of the configuration attached to the parent with a
+        single batch, their blueprints being resolved from the given blueprint library.
+        The listeners are attached once the whole rig exists. Returns the sensors"""
+        sensors = [
+            SensorFactory.spawn(
+                name,
+                attributes,
+                interface,
+                parent,
+                blueprint_library=blueprint_library,
+                spawn=False,
+            )
+            for name, attributes in sensors_config.items()
+        ]
+
+        batch = [
+            carla.command.SpawnActor(sensor.blueprint, sensor.transform, parent.id)
+            for sensor in sensors
+        ]
+        results = client.apply_batch_sync(batch, False)
+        errors = [result.error for result in results if result.error]
+        if errors:
+            client.apply_batch(
+                [
+                    carla.command.DestroyActor(result.actor_id)
+                    for result in results
+                    if not result.error
+                ]
+            )
+            raise RuntimeError("Error spawning the sensor rig: {}".format(errors))
+
+        actors = parent.get_world().get_actors([result.actor_id for result in results])
+        actors = {actor.id: actor for actor in actors}
+        for sensor, result in zip(sensors, results):
+            sensor.attach(actors[result.actor_id])
+        return sensors
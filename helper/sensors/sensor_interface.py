@@ -1,16 +1,27 @@
+import collections
 import queue
+import time
+
+
+class SensorTimeout(RuntimeError):
+    """A sensor did not send its data in time"""
+
+    pass
 
 
 class SensorInterface(object):
     """Class used to handle all the sensor data management"""
 
-    def __init__(self):
+    def __init__(self, event_buffer_size=256, queue_timeout=10):
         self._sensors = {}  # {name: Sensor object}
         self._data_buffers = queue.Queue()
-        self._queue_timeout = 10
+        self._queue_timeout = queue_timeout
 
         self._event_sensors = {}
-        self._event_data_buffers = queue.Queue()
+        self._event_data_buffers = {}  # {name: bounded deque of (frame, data)}
+        self._event_buffer_size = event_buffer_size
+
+        self._latest_data = {}  # {name: [frame, raw data, parsed data]}
 
     @property
     def sensors(self):
@@ -22,31 +33,106 @@ class SensorInterface(object):
         for sensor in self.sensors.values():
             sensor.destroy()
         self._data_buffers = queue.Queue()
-        self._event_data_buffers = queue.Queue()
+        self._event_data_buffers = {}
+        self._latest_data = {}
+
+    def forget(self):
+        """Drops the sensors without destroying them, e.g. once their server is gone"""
+        self._sensors = {}
+        self._event_sensors = {}
+        self._data_buffers = queue.Queue()
+        self._event_data_buffers = {}
+        self._latest_data = {}
 
     def register(self, name, sensor):
         """Adds a specific sensor to the class"""
         if sensor.is_event_sensor():
             self._event_sensors[name] = sensor
+            self._event_data_buffers[name] = collections.deque(
+                maxlen=self._event_buffer_size
+            )
         else:
             self._sensors[name] = sensor
 
-    def get_data(self):
-        """Returns the data of all the registered sensors as a dictionary {sensor_name: sensor_data}"""
+    def is_due(self, name, frame):
+        """Returns whether or not the data of the sensor at the given frame is used.
+        Sensors with a rate lower than the simulation's one only use one frame out of
+        every 'period', besides their first data"""
+        return (
+            frame is None
+            or name not in self._latest_data
+            or frame % self._sensors[name].period == 0
+        )
+
+    def drain(self, frame, names):
+        """Reads the queued data until the given sensors have sent the one of the frame
+        (any data if frame is None), within queue_timeout seconds overall. Older data is
+        kept only if it was due at its frame, e.g. after ticks without get_data, and
+        data of sensors not due is dropped"""
+        pending = set(names)
+        deadline = time.monotonic() + self._queue_timeout
         try:
-            data_dict = {}
-            while len(data_dict.keys()) < len(self._sensors.keys()):
-                sensor_data = self._data_buffers.get(True, self._queue_timeout)
-                data_dict[sensor_data[0]] = (sensor_data[1], sensor_data[2])
+            while pending:
+                name, data_frame, data = self._data_buffers.get(
+                    True, max(deadline - time.monotonic(), 0)
+                )
+                if frame is None or data_frame == frame:
+                    if name not in pending:
+                        continue
+                    pending.discard(name)
+                elif data_frame > frame or not self.is_due(name, data_frame):
+                    continue
+                self._latest_data[name] = [data_frame, data, None]
 
         except queue.Empty:
-            raise RuntimeError("A sensor took too long to send their data")
+            raise SensorTimeout("A sensor took too long to send their data")
 
-        for event_sensor in self._event_sensors:
-            try:
-                sensor_data = self._event_data_buffers.get_nowait()
-                data_dict[sensor_data[0]] = (sensor_data[1], sensor_data[2])
-            except queue.Empty:
-                pass
+    def wait_for_frame(self, frame):
+        """Waits until every sensor has sent the data of the given frame, e.g. the first
+        frame of a new rig. Their older data is dropped"""
+        self._latest_data = {}
+        self.drain(frame, self._sensors)
+
+    def get_data(self, frame=None, parse=True):
+        """Returns the data of all the registered sensors as a dictionary {sensor_name: sensor_data}.
+        Only the sensors due at the frame are waited for, the others return their latest data.
+        The raw data is only parsed if required, see parse_data. Event sensors return a
+        fixed-size summary of all their events up to the frame, see get_event_data"""
+        self.drain(frame, [name for name in self._sensors if self.is_due(name, frame)])
+
+        data_dict = {}
+        for name, (data_frame, raw_data, _) in self._latest_data.items():
+            data_dict[name] = (data_frame, raw_data)
+
+        if parse:
+            data_dict = self.parse_data(data_dict)
+
+        data_dict.update(self.get_event_data(frame))
 
         return data_dict
+
+    def get_event_data(self, frame=None):
+        """Drains the events of each event sensor up to the frame (all of them if None)
+        and aggregates them into a fixed-size summary per sensor"""
+        data_dict = {}
+        for name, sensor in self._event_sensors.items():
+            event_buffer = self._event_data_buffers[name]
+            events = []
+            while event_buffer and (frame is None or event_buffer[0][0] <= frame):
+                event_frame, event_data = event_buffer.popleft()
+                events.append(sensor.parse(event_data))
+            data_dict[name] = (frame, sensor.aggregate(events))
+        return data_dict
+
+    def parse_data(self, data_dict):
+        """Parses the raw data of the non-event sensors returned by get_data(parse=False).
+        Each sensor reading is only parsed once, even if it is returned at several frames
+        """
+        parsed_dict = dict(data_dict)
+        for name, sensor in self._sensors.items():
+            latest_data = self._latest_data[name]
+            if latest_data[2] is None:
+                latest_data[2] = sensor.parse(latest_data[1])
+                latest_data[1] = None
+            parsed_dict[name] = (latest_data[0], latest_data[2])
+        return parsed_dict
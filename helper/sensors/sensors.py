@@ -1,10 +1,33 @@
-import copy
 import math
 
 import carla
 import numpy as np
 from carla import ColorConverter as cc
 
+from helper.sensors.buffer_pool import DoubleBuffer
+
+DVS_EVENT_DTYPE = np.dtype(
+    [("x", np.uint16), ("y", np.uint16), ("t", np.int64), ("pol", np.bool_)]
+)
+
+SEMANTIC_LIDAR_DTYPE = np.dtype(
+    [
+        ("x", np.float32),
+        ("y", np.float32),
+        ("z", np.float32),
+        ("CosAngle", np.float32),
+        ("ObjIdx", np.uint32),
+        ("ObjTag", np.uint32),
+    ]
+)
+
+
+def points_per_rotation(blueprint):
+    """Upper bound of the number of points of a lidar measurement"""
+    points_per_second = blueprint.get_attribute("points_per_second").as_int()
+    rotation_frequency = blueprint.get_attribute("rotation_frequency").as_float()
+    return int(math.ceil(points_per_second / rotation_frequency))
+
 
 class BaseSensor(object):
     def __init__(self, name, attributes, interface, parent):
@@ -12,6 +35,7 @@ class BaseSensor(object):
         self.attributes = attributes
         self.interface = interface
         self.parent = parent
+        self.period = 1  # Frames between two readings
 
         self.interface.register(self.name, self)
 
@@ -21,11 +45,18 @@ class BaseSensor(object):
     def parse(self):
         raise NotImplementedError
 
+    def aggregate(self, events):
+        """Summarizes the parsed events of a tick into a fixed-size value (event sensors only)"""
+        raise NotImplementedError
+
     def update_sensor(self, data, frame):
+        # The data is parsed by the interface, only when it is needed
         if not self.is_event_sensor():
-            self.interface._data_buffers.put((self.name, frame, self.parse(data)))
+            self.interface._data_buffers.put((self.name, frame, data))
         else:
-            self.interface._event_data_buffers.put((self.name, frame, self.parse(data)))
+            event_buffer = self.interface._event_data_buffers.get(self.name)
+            if event_buffer is not None:
+                event_buffer.append((frame, data))
 
     def callback(self, data):
         frame = data.frame
@@ -36,7 +67,9 @@ class BaseSensor(object):
 
 
 class CarlaSensor(BaseSensor):
-    def __init__(self, name, attributes, interface, parent):
+    def __init__(
+        self, name, attributes, interface, parent, blueprint_library=None, spawn=True
+    ):
         super().__init__(name, attributes, interface, parent)
 
         world = self.parent.get_world()
@@ -47,24 +80,50 @@ class CarlaSensor(BaseSensor):
             transform = [float(x) for x in transform.split(",")]
         assert len(transform) == 6
 
-        blueprint = world.get_blueprint_library().find(type_)
+        # Sensors with a lower rate than the simulation only keep the data of one frame
+        # out of every 'period'. They still capture every frame, decimated by the
+        # interface, as the server's sensor_tick drifts from the frames after a stall
+        rate = self.attributes.pop("rate", None)
+        if rate is not None:
+            timestep = world.get_settings().fixed_delta_seconds
+            self.period = max(1, round(1 / (rate * timestep)))
+
+        if blueprint_library is None:
+            blueprint_library = world.get_blueprint_library()
+        blueprint = blueprint_library.find(type_)
         blueprint.set_attribute("role_name", name)
         for key, value in attributes.items():
             blueprint.set_attribute(str(key), str(value))
+        self.create_buffers(blueprint)
+        self.blueprint = blueprint
 
-        transform = carla.Transform(
+        self.transform = carla.Transform(
             carla.Location(transform[0], transform[1], transform[2]),
             carla.Rotation(transform[4], transform[5], transform[3]),
         )
-        self.sensor = world.spawn_actor(
-            blueprint,
-            transform,
-            attach_to=self.parent,
-            attachment_type=carla.AttachmentType.Rigid,
-        )
 
+        # Without 'spawn', the actor is spawned by the caller (e.g. the whole rig in
+        # a single batch, see SensorFactory.spawn_rig) and given to attach
+        self.sensor = None
+        if spawn:
+            self.attach(
+                world.spawn_actor(
+                    blueprint,
+                    self.transform,
+                    attach_to=self.parent,
+                    attachment_type=carla.AttachmentType.Rigid,
+                )
+            )
+
+    def attach(self, actor):
+        """Starts listening to the sensor actor spawned from the blueprint"""
+        self.sensor = actor
         self.sensor.listen(self.callback)
 
+    def create_buffers(self, blueprint):
+        """Preallocates the buffers used to parse the data, sized from the blueprint"""
+        pass
+
     def destroy(self):
         if self.sensor is not None:
             self.sensor.destroy()
@@ -80,8 +139,13 @@ class PseudoSensor(BaseSensor):
 
 
 class BaseCamera(CarlaSensor):
-    def __init__(self, name, attributes, interface, parent):
-        super().__init__(name, attributes, interface, parent)
+    def __init__(self, name, attributes, interface, parent, **kwargs):
+        super().__init__(name, attributes, interface, parent, **kwargs)
+
+    def create_buffers(self, blueprint):
+        height = blueprint.get_attribute("image_size_y").as_int()
+        width = blueprint.get_attribute("image_size_x").as_int()
+        self.buffers = DoubleBuffer((height, width, 3), np.uint8)
 
     def parse(self, sensor_data):
         """Parses the Image into an numpy array"""
@@ -91,65 +155,84 @@ class BaseCamera(CarlaSensor):
         array = np.reshape(array, (sensor_data.height, sensor_data.width, 4))
         array = array[:, :, :3]
         array = array[:, :, ::-1]
-        return array
+        image = self.buffers.next()
+        np.copyto(image, array)
+        return image
 
 
 class CameraRGB(BaseCamera):
-    def __init__(self, name, attributes, interface, parent):
-        super().__init__(name, attributes, interface, parent)
+    def __init__(self, name, attributes, interface, parent, **kwargs):
+        super().__init__(name, attributes, interface, parent, **kwargs)
 
 
 class CameraDepth(BaseCamera):
-    def __init__(self, name, attributes, interface, parent):
-        super().__init__(name, attributes, interface, parent)
+    def __init__(self, name, attributes, interface, parent, **kwargs):
+        super().__init__(name, attributes, interface, parent, **kwargs)
 
 
 class CameraSemanticSegmentation(BaseCamera):
-    def __init__(self, name, attributes, interface, parent):
-        super().__init__(name, attributes, interface, parent)
+    def __init__(self, name, attributes, interface, parent, **kwargs):
+        super().__init__(name, attributes, interface, parent, **kwargs)
 
 
 class CameraDVS(CarlaSensor):
-    def __init__(self, name, attributes, interface, parent):
-        super().__init__(name, attributes, interface, parent)
+    def __init__(self, name, attributes, interface, parent, **kwargs):
+        super().__init__(name, attributes, interface, parent, **kwargs)
 
     def is_event_sensor(self):
         return True
 
+    def create_buffers(self, blueprint):
+        height = blueprint.get_attribute("image_size_y").as_int()
+        width = blueprint.get_attribute("image_size_x").as_int()
+        self.buffers = DoubleBuffer((height, width, 2), np.float32)
+
     def parse(self, sensor_data):
-        """Parses the DVSEvents into an RGB image"""
+        """Parses the DVSEventArray into a structured numpy array"""
         # sensor_data: [x, y, t, polarity]
-        dvs_events = np.frombuffer(
-            sensor_data.raw_data,
-            dtype=np.dtype(
-                [("x", np.uint16), ("y", np.uint16), ("t", np.int64), ("pol", np.bool)]
-            ),
-        )
-
-        dvs_img = np.zeros((sensor_data.height, sensor_data.width, 3), dtype=np.uint8)
-        dvs_img[
-            dvs_events[:]["y"], dvs_events[:]["x"], dvs_events[:]["pol"] * 2
-        ] = 255  # Blue is positive, red is negative
-
-        return dvs_img
+        return np.frombuffer(sensor_data.raw_data, dtype=DVS_EVENT_DTYPE)
+
+    def aggregate(self, events):
+        """Accumulates the events of the tick into a time surface with the number of
+        events per pixel and polarity"""
+        # summary: [height, width, (negative, positive)]
+        time_surface = self.buffers.next()
+        time_surface.fill(0)
+        if events:
+            dvs_events = np.concatenate(events)
+            np.add.at(
+                time_surface,
+                (dvs_events["y"], dvs_events["x"], dvs_events["pol"].astype(np.intp)),
+                1,
+            )
+        return time_surface
 
 
 class Lidar(CarlaSensor):
-    def __init__(self, name, attributes, interface, parent):
-        super().__init__(name, attributes, interface, parent)
+    def __init__(self, name, attributes, interface, parent, **kwargs):
+        super().__init__(name, attributes, interface, parent, **kwargs)
+
+    def create_buffers(self, blueprint):
+        self.buffers = DoubleBuffer((points_per_rotation(blueprint), 4), np.float32)
 
     def parse(self, sensor_data):
         """Parses the LidarMeasurememt into an numpy array"""
         # sensor_data: [x, y, z, intensity]
         points = np.frombuffer(sensor_data.raw_data, dtype=np.dtype("f4"))
-        points = copy.deepcopy(points)
         points = np.reshape(points, (int(points.shape[0] / 4), 4))
-        return points
+        parsed_points = self.buffers.next(len(points))
+        np.copyto(parsed_points, points)
+        return parsed_points
 
 
 class SemanticLidar(CarlaSensor):
-    def __init__(self, name, attributes, interface, parent):
-        super().__init__(name, attributes, interface, parent)
+    def __init__(self, name, attributes, interface, parent, **kwargs):
+        super().__init__(name, attributes, interface, parent, **kwargs)
+
+    def create_buffers(self, blueprint):
+        self.buffers = DoubleBuffer(
+            (points_per_rotation(blueprint),), SEMANTIC_LIDAR_DTYPE
+        )
 
     def parse(self, sensor_data):
         """Parses the SemanticLidarMeasurememt into an numpy array"""
@@ -157,40 +240,33 @@ class SemanticLidar(CarlaSensor):
         # points = np.frombuffer(sensor_data.raw_data, dtype=np.dtype('f4'))
         # points = copy.deepcopy(points)
         # points = np.reshape(points, (int(points.shape[0] / 6), 6))
-        data = np.frombuffer(
-            sensor_data.raw_data,
-            dtype=np.dtype(
-                [
-                    ("x", np.float32),
-                    ("y", np.float32),
-                    ("z", np.float32),
-                    ("CosAngle", np.float32),
-                    ("ObjIdx", np.uint32),
-                    ("ObjTag", np.uint32),
-                ]
-            ),
-        )
-        points = np.array([data["x"], data["y"], data["z"]]).T
-        return data
+        data = np.frombuffer(sensor_data.raw_data, dtype=SEMANTIC_LIDAR_DTYPE)
+        parsed_data = self.buffers.next(len(data))
+        np.copyto(parsed_data, data)
+        return parsed_data
 
 
 class Radar(CarlaSensor):
-    def __init__(self, name, attributes, interface, parent):
-        super().__init__(name, attributes, interface, parent)
+    def __init__(self, name, attributes, interface, parent, **kwargs):
+        super().__init__(name, attributes, interface, parent, **kwargs)
+
+    def create_buffers(self, blueprint):
+        points_per_second = blueprint.get_attribute("points_per_second").as_int()
+        self.buffers = DoubleBuffer((points_per_second, 4), np.float32)
 
     def parse(self, sensor_data):
         """Parses the RadarMeasurement into an numpy array"""
         # sensor_data: [depth, azimuth, altitute, velocity]
         points = np.frombuffer(sensor_data.raw_data, dtype=np.dtype("f4"))
-        points = copy.deepcopy(points)
         points = np.reshape(points, (int(points.shape[0] / 4), 4))
-        points = np.flip(points, 1)
-        return points
+        parsed_points = self.buffers.next(len(points))
+        np.copyto(parsed_points, points[:, ::-1])
+        return parsed_points
 
 
 class Gnss(CarlaSensor):
-    def __init__(self, name, attributes, interface, parent):
-        super().__init__(name, attributes, interface, parent)
+    def __init__(self, name, attributes, interface, parent, **kwargs):
+        super().__init__(name, attributes, interface, parent, **kwargs)
 
     def parse(self, sensor_data):
         """Parses the GnssMeasurement into an numpy array"""
@@ -202,8 +278,8 @@ class Gnss(CarlaSensor):
 
 
 class Imu(CarlaSensor):
-    def __init__(self, name, attributes, interface, parent):
-        super().__init__(name, attributes, interface, parent)
+    def __init__(self, name, attributes, interface, parent, **kwargs):
+        super().__init__(name, attributes, interface, parent, **kwargs)
 
     def parse(self, sensor_data):
         """Parses the IMUMeasurement into an numpy array"""
@@ -223,8 +299,8 @@ class Imu(CarlaSensor):
 
 
 class LaneInvasion(CarlaSensor):
-    def __init__(self, name, attributes, interface, parent):
-        super().__init__(name, attributes, interface, parent)
+    def __init__(self, name, attributes, interface, parent, **kwargs):
+        super().__init__(name, attributes, interface, parent, **kwargs)
 
     def is_event_sensor(self):
         return True
@@ -234,37 +310,65 @@ class LaneInvasion(CarlaSensor):
         # sensor_data: [transform, lane marking]
         return [sensor_data.transform, sensor_data.crossed_lane_markings]
 
+    def aggregate(self, events):
+        """Returns the set of lane marking types crossed during the tick, as a
+        multi-hot array indexed by carla.LaneMarkingType"""
+        crossed_types = np.zeros(len(carla.LaneMarkingType.values), dtype=np.uint8)
+        for _, lane_markings in events:
+            for lane_marking in lane_markings:
+                crossed_types[int(lane_marking.type)] = 1
+        return crossed_types
 
-class Collision(CarlaSensor):
-    def __init__(self, name, attributes, interface, parent):
-        self._last_event_frame = 0
-        super().__init__(name, attributes, interface, parent)
 
-    def callback(self, data):
-        # The collision sensor can have multiple callbacks per tick. Get only the first one
-        if self._last_event_frame != data.frame:
-            self._last_event_frame = data.frame
-            self.update_sensor(data, data.frame)
+class Collision(CarlaSensor):
+    def __init__(self, name, attributes, interface, parent, **kwargs):
+        super().__init__(name, attributes, interface, parent, **kwargs)
 
     def is_event_sensor(self):
         return True
 
     def parse(self, sensor_data):
-        """Parses the ObstacleDetectionEvent into a list"""
-        # sensor_data: [other actor, distance]
+        """Parses the CollisionEvent into a list"""
+        # sensor_data: [other actor id, impulse]
         impulse = sensor_data.normal_impulse
         impulse_value = math.sqrt(impulse.x**2 + impulse.y**2 + impulse.z**2)
-        return [sensor_data.other_actor, impulse_value]
+        return [sensor_data.other_actor.id, impulse_value]
+
+    def aggregate(self, events):
+        """Summarizes the collisions of the tick. The collision sensor can have
+        multiple events per tick"""
+        # summary: [number of events, max impulse, sum of impulses, other actor id of the max]
+        summary = np.zeros(4, dtype=np.float64)
+        if events:
+            actor_ids, impulses = zip(*events)
+            strongest = int(np.argmax(impulses))
+            summary[:] = [
+                len(events),
+                impulses[strongest],
+                sum(impulses),
+                actor_ids[strongest],
+            ]
+        return summary
 
 
 class Obstacle(CarlaSensor):
-    def __init__(self, name, attributes, interface, parent):
-        super().__init__(name, attributes, interface, parent)
+    def __init__(self, name, attributes, interface, parent, **kwargs):
+        super().__init__(name, attributes, interface, parent, **kwargs)
 
     def is_event_sensor(self):
         return True
 
     def parse(self, sensor_data):
         """Parses the ObstacleDetectionEvent into a list"""
-        # sensor_data: [other actor, distance]
-        return [sensor_data.other_actor, sensor_data.distance]
+        # sensor_data: [other actor id, distance]
+        return [sensor_data.other_actor.id, sensor_data.distance]
+
+    def aggregate(self, events):
+        """Summarizes the obstacles detected during the tick"""
+        # summary: [number of events, min distance (-1 if none), other actor id of the min]
+        summary = np.array([0, -1, 0], dtype=np.float64)
+        if events:
+            actor_ids, distances = zip(*events)
+            closest = int(np.argmin(distances))
+            summary[:] = [len(events), distances[closest], actor_ids[closest]]
+        return summary
@@ -0,0 +1,65 @@
+import queue
+import threading
+
+
+class VideoRecorder(object):
+    """Streams frames to a video file from a background thread. The queue of pending
+    frames is bounded: when the writer can't keep up, new frames are dropped instead
+    of stalling the caller or growing the memory usage"""
+
+    def __init__(self, path, fps=30, max_queue_size=64, transform=None):
+        self.path = path
+        self.fps = fps
+        self.transform = transform
+        self.dropped_frames = 0
+        self.written_frames = 0
+        self.error = None  # Exception that stopped the writer, raised by close
+
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def add_frame(self, frame):
+        """Queues the frame without blocking. The frame must not be modified afterwards"""
+        try:
+            self._queue.put_nowait(frame)
+        except queue.Full:
+            self.dropped_frames += 1
+
+    def _run(self):
+        try:
+            import imageio
+
+            with imageio.get_writer(self.path, fps=self.fps) as writer:
+                while True:
+                    frame = self._queue.get()
+                    if frame is None:
+                        break
+                    if self.transform is not None:
+                        frame = self.transform(frame)
+                    writer.append_data(frame)
+                    self.written_frames += 1
+        except Exception as e:
+            self.error = e
+
+    def close(self):
+        """Writes the pending frames and closes the video file. Raises the error of the
+        writer, if it failed"""
+        # A dead writer no longer empties the queue, the sentinel is only sent to a
+        # live one
+        while self._thread.is_alive():
+            try:
+                self._queue.put(None, timeout=1)
+                break
+            except queue.Full:
+                pass
+        self._thread.join()
+        if self.error is not None:
+            raise RuntimeError(
+                "Could not write the video {}".format(self.path)
+            ) from self.error
+        print(
+            "Saved {} frames to {} ({} dropped)".format(
+                self.written_frames, self.path, self.dropped_frames
+            )
+        )
@@ -0,0 +1,103 @@
+import gymnasium as gym
+import numpy as np
+import torch
+from stable_baselines3.common.torch_layers import BaseFeaturesExtractor
+from torch import nn
+
+
+class CustomFeatureExtractor(BaseFeaturesExtractor):
+    """Features extractor for the Dict observation of the experiment.
+
+    A uint8 camera stack (use normalize_images=False in the policy_kwargs) is
+    normalized inside the network, float images are used as they are. Strided convolutions
+    downsample the 256x256 images early, keeping the CPU cost low. The rest of the
+    observation (obj_distance) is concatenated to the image features, so features_dim
+    is the size of the whole output.
+
+    When the env already encodes the cameras (an "embedding" key instead of "image"),
+    the embedding only goes through the final linear layer.
+    """
+
+    def __init__(
+        self, observation_space: gym.spaces.Dict, features_dim=23, channels_last=True
+    ):
+        super().__init__(observation_space, features_dim)
+
+        self.image_key = "image" if "image" in observation_space.spaces else "embedding"
+        self.vector_keys = sorted(
+            key for key in observation_space.spaces if key != self.image_key
+        )
+        vector_dim = sum(
+            int(np.prod(observation_space[key].shape)) for key in self.vector_keys
+        )
+        image_dim = features_dim - vector_dim
+        if image_dim <= 0:
+            raise ValueError(
+                "features_dim ({}) has to be larger than the vector observations ({})".format(
+                    features_dim, vector_dim
+                )
+            )
+
+        if self.image_key == "embedding":
+            self.cnn = None
+            n_flatten = int(np.prod(observation_space["embedding"].shape))
+            self.linear = nn.Sequential(nn.Linear(n_flatten, image_dim), nn.ReLU())
+            return
+
+        image_shape = observation_space["image"].shape
+        # Images stay channels last unless wrapped by SB3's VecTransposeImage
+        self.image_channels_first = image_shape[0] < image_shape[-1]
+        n_channels = image_shape[0] if self.image_channels_first else image_shape[-1]
+        self.channels_last = channels_last
+
+        image_dtype = observation_space["image"].dtype
+        if image_dtype == np.uint8:
+            image_scale = 1.0 / 255.0
+        elif np.issubdtype(image_dtype, np.floating):
+            # Already normalized, e.g. camera_normalized
+            image_scale = 1.0
+        else:
+            raise ValueError(
+                "Images of dtype {} are not supported, use uint8 or floats".format(
+                    image_dtype
+                )
+            )
+        self.register_buffer("image_scale", torch.tensor(image_scale))
+        self.cnn = nn.Sequential(
+            nn.Conv2d(n_channels, 32, kernel_size=8, stride=4, padding=2),
+            nn.ReLU(),
+            nn.Conv2d(32, 64, kernel_size=4, stride=2, padding=1),
+            nn.ReLU(),
+            nn.Conv2d(64, 64, kernel_size=3, stride=2, padding=1),
+            nn.ReLU(),
+            nn.Conv2d(64, 64, kernel_size=3, stride=2, padding=1),
+            nn.ReLU(),
+            nn.Flatten(),
+        )
+        if self.channels_last:
+            self.cnn = self.cnn.to(memory_format=torch.channels_last)
+
+        with torch.no_grad():
+            sample = torch.as_tensor(observation_space["image"].sample()[None])
+            n_flatten = self.cnn(self._to_nchw(sample)).shape[1]
+        self.linear = nn.Sequential(nn.Linear(n_flatten, image_dim), nn.ReLU())
+
+    def _to_nchw(self, image):
+        """Returns the images as a normalized NCHW float tensor. For channels last
+        inputs the permutation is only a view, already laid out as channels_last"""
+        if not self.image_channels_first:
+            image = image.permute(0, 3, 1, 2)
+        image = image.float() * self.image_scale
+        if self.channels_last:
+            image = image.contiguous(memory_format=torch.channels_last)
+        return image
+
+    def forward(self, observations):
+        if self.cnn is None:
+            embedding = torch.flatten(observations["embedding"], start_dim=1).float()
+            features = [self.linear(embedding)]
+        else:
+            features = [self.linear(self.cnn(self._to_nchw(observations["image"])))]
+        for key in self.vector_keys:
+            features.append(torch.flatten(observations[key], start_dim=1).float())
+        return torch.cat(features, dim=1)
@@ -0,0 +1,286 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from gymnasium import spaces
+from stable_baselines3.common.buffers import BaseBuffer
+from stable_baselines3.common.type_aliases import DictReplayBufferSamples
+
+
+class FrameReplayBuffer(BaseBuffer):
+    """Replay buffer for the Dict observations of the experiment, for off-policy
+    algorithms (e.g. DQN(..., replay_buffer_class=FrameReplayBuffer)).
+
+    Every camera frame is stored once, in a memory-mapped file: the observation of a
+    transition is the next observation of the previous one, so only the first frame of
+    an episode and its terminal frame are extra. Transitions keep the frame numbers of
+    their observation and next observation, and stacks of frame_stack frames (e.g.
+    from VecFrameStack) are rebuilt by following the pointer to the previous frame.
+    The rest of the observation (obj_distance), actions and rewards stay in RAM.
+
+    Frames are numbered per env and written to a ring of frame_capacity slots, at
+    least buffer_size + frame_stack. A transition whose frames have been overwritten
+    is never sampled.
+
+    Without a path, the frames go to a temporary directory that close() removes, so
+    such a buffer is not persistent: once pickled (e.g. by save_replay_buffer), its
+    directory is kept and has to be removed by hand. Pass a path to keep the frames.
+    """
+
+    def __init__(
+        self,
+        buffer_size,
+        observation_space,
+        action_space,
+        device="auto",
+        n_envs=1,
+        optimize_memory_usage=False,
+        handle_timeout_termination=True,
+        image_key="image",
+        frame_stack=1,
+        frame_capacity=None,
+        path=None,
+        verbose=0,
+    ):
+        super().__init__(
+            buffer_size, observation_space, action_space, device, n_envs=n_envs
+        )
+        self.buffer_size = max(buffer_size // n_envs, 1)
+        self.handle_timeout_termination = handle_timeout_termination
+        self.image_key = image_key
+        self.frame_stack = frame_stack
+
+        image_shape = observation_space[image_key].shape
+        self.channels_first = image_shape[0] < image_shape[-1]
+        self.channel_axis = 0 if self.channels_first else len(image_shape) - 1
+        if image_shape[self.channel_axis] % frame_stack != 0:
+            raise ValueError(
+                "The image channels ({}) are not a multiple of frame_stack ({})".format(
+                    image_shape[self.channel_axis], frame_stack
+                )
+            )
+        frame_shape = list(image_shape)
+        frame_shape[self.channel_axis] //= frame_stack
+        self.frame_shape = tuple(frame_shape)
+        self.frame_channels = frame_shape[self.channel_axis]
+
+        # Room for the extra frames of the episode starts and terminal observations
+        if frame_capacity is None:
+            frame_capacity = self.buffer_size + self.buffer_size // 10 + frame_stack
+        if frame_capacity < self.buffer_size + frame_stack:
+            # Otherwise all the transitions may be overwritten and sample never ends
+            raise ValueError(
+                "frame_capacity ({}) has to be at least buffer_size + frame_stack "
+                "({})".format(frame_capacity, self.buffer_size + frame_stack)
+            )
+        self.frame_capacity = frame_capacity
+
+        self.owns_path = path is None
+        if path is None:
+            path = tempfile.mkdtemp(prefix="replay_buffer_")
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.frames = np.memmap(
+            os.path.join(path, "frames.bin"),
+            dtype=observation_space[image_key].dtype,
+            mode="w+",
+            shape=(self.n_envs, self.frame_capacity) + self.frame_shape,
+        )
+        if verbose > 0:
+            print(
+                "Replay buffer frames: {:.1f} GB at {}".format(
+                    self.frames.nbytes / 1e9, path
+                )
+            )
+
+        # Frame bookkeeping, per env. -1 means no frame
+        self.frame_count = np.zeros(self.n_envs, dtype=np.int64)
+        self.prev_frame = np.full(
+            (self.n_envs, self.frame_capacity), -1, dtype=np.int64
+        )
+        self.last_next_frame = np.full(self.n_envs, -1, dtype=np.int64)
+
+        self.obs_frame = np.zeros((self.buffer_size, self.n_envs), dtype=np.int64)
+        self.next_obs_frame = np.zeros((self.buffer_size, self.n_envs), dtype=np.int64)
+
+        self.vector_keys = [key for key in observation_space.spaces if key != image_key]
+        self.observations = {
+            key: np.zeros(
+                (self.buffer_size, self.n_envs) + self.obs_shape[key],
+                dtype=observation_space[key].dtype,
+            )
+            for key in self.vector_keys
+        }
+        self.next_observations = {
+            key: np.zeros_like(array) for key, array in self.observations.items()
+        }
+
+        action_dtype = action_space.dtype
+        if isinstance(action_space, spaces.Discrete):
+            action_dtype = np.int64
+        self.actions = np.zeros(
+            (self.buffer_size, self.n_envs, self.action_dim), dtype=action_dtype
+        )
+        self.rewards = np.zeros((self.buffer_size, self.n_envs), dtype=np.float32)
+        self.dones = np.zeros((self.buffer_size, self.n_envs), dtype=np.float32)
+        self.timeouts = np.zeros((self.buffer_size, self.n_envs), dtype=np.float32)
+
+    def _frame_block(self, image, index):
+        """Returns the index-th frame of a stacked image"""
+        start = index * self.frame_channels
+        return np.take(
+            image, range(start, start + self.frame_channels), axis=self.channel_axis
+        )
+
+    def _write_frame(self, env_idx, frame, prev_frame):
+        frame_number = self.frame_count[env_idx]
+        slot = frame_number % self.frame_capacity
+        self.frames[env_idx, slot] = frame
+        self.prev_frame[env_idx, slot] = prev_frame
+        self.frame_count[env_idx] += 1
+        return frame_number
+
+    def add(self, obs, next_obs, action, reward, done, infos):
+        for env_idx in range(self.n_envs):
+            obs_frame = self.last_next_frame[env_idx]
+            if obs_frame < 0:
+                # First observation of the episode, store its whole stack
+                image = obs[self.image_key][env_idx]
+                for index in range(self.frame_stack):
+                    obs_frame = self._write_frame(
+                        env_idx, self._frame_block(image, index), obs_frame
+                    )
+            next_image = next_obs[self.image_key][env_idx]
+            next_obs_frame = self._write_frame(
+                env_idx,
+                self._frame_block(next_image, self.frame_stack - 1),
+                obs_frame,
+            )
+
+            self.obs_frame[self.pos, env_idx] = obs_frame
+            self.next_obs_frame[self.pos, env_idx] = next_obs_frame
+            # After a done, the next obs is the terminal one, not the reset one
+            self.last_next_frame[env_idx] = -1 if done[env_idx] else next_obs_frame
+
+        for key in self.vector_keys:
+            self.observations[key][self.pos] = np.array(obs[key]).reshape(
+                (self.n_envs,) + self.obs_shape[key]
+            )
+            self.next_observations[key][self.pos] = np.array(next_obs[key]).reshape(
+                (self.n_envs,) + self.obs_shape[key]
+            )
+
+        self.actions[self.pos] = np.array(action).reshape(
+            (self.n_envs, self.action_dim)
+        )
+        self.rewards[self.pos] = np.array(reward)
+        self.dones[self.pos] = np.array(done)
+        if self.handle_timeout_termination:
+            self.timeouts[self.pos] = np.array(
+                [info.get("TimeLimit.truncated", False) for info in infos]
+            )
+
+        self.pos += 1
+        if self.pos == self.buffer_size:
+            self.full = True
+            self.pos = 0
+
+    def reset(self):
+        super().reset()
+        self.last_next_frame[:] = -1
+
+    def close(self):
+        """Releases the frames file, removing the frame directory if the buffer
+        created it and has never been pickled"""
+        if self.frames is None:
+            return
+        self.frames = None
+        if self.owns_path:
+            shutil.rmtree(self.path, ignore_errors=True)
+
+    def is_valid(self, batch_inds, env_inds):
+        """Whether the frames of the transitions (and their stacks) are still stored"""
+        oldest_frame = self.obs_frame[batch_inds, env_inds] - (self.frame_stack - 1)
+        return self.frame_count[env_inds] - oldest_frame <= self.frame_capacity
+
+    def sample(self, batch_size, env=None):
+        upper_bound = self.buffer_size if self.full else self.pos
+        batch_inds = np.random.randint(0, upper_bound, size=batch_size)
+        env_inds = np.random.randint(0, self.n_envs, size=batch_size)
+
+        # Resample the transitions whose frames have been overwritten. The most
+        # recent ones are always valid
+        invalid = np.flatnonzero(~self.is_valid(batch_inds, env_inds))
+        while len(invalid) > 0:
+            batch_inds[invalid] = np.random.randint(0, upper_bound, size=len(invalid))
+            env_inds[invalid] = np.random.randint(0, self.n_envs, size=len(invalid))
+            invalid = invalid[~self.is_valid(batch_inds[invalid], env_inds[invalid])]
+
+        return self._get_samples(batch_inds, env_inds, env)
+
+    def get_images(self, frame_numbers, env_inds):
+        """Rebuilds the stacked images ending at the given frames"""
+        blocks = []
+        frame_numbers = frame_numbers.copy()
+        for index in range(self.frame_stack):
+            slots = frame_numbers % self.frame_capacity
+            blocks.append(self.frames[env_inds, slots])
+            if index < self.frame_stack - 1:
+                prev_frame = self.prev_frame[env_inds, slots]
+                frame_numbers = np.where(prev_frame >= 0, prev_frame, frame_numbers)
+        blocks.reverse()
+        # The channel axis is shifted by the batch dimension
+        return np.concatenate(blocks, axis=self.channel_axis + 1)
+
+    def _get_samples(self, batch_inds, env_inds, env=None):
+        obs = {
+            key: array[batch_inds, env_inds] for key, array in self.observations.items()
+        }
+        obs[self.image_key] = self.get_images(
+            self.obs_frame[batch_inds, env_inds], env_inds
+        )
+        next_obs = {
+            key: array[batch_inds, env_inds]
+            for key, array in self.next_observations.items()
+        }
+        next_obs[self.image_key] = self.get_images(
+            self.next_obs_frame[batch_inds, env_inds], env_inds
+        )
+
+        obs = self._normalize_obs(obs, env)
+        next_obs = self._normalize_obs(next_obs, env)
+        dones = self.dones[batch_inds, env_inds] * (
+            1 - self.timeouts[batch_inds, env_inds]
+        )
+        return DictReplayBufferSamples(
+            observations={key: self.to_torch(value) for key, value in obs.items()},
+            actions=self.to_torch(self.actions[batch_inds, env_inds]),
+            next_observations={
+                key: self.to_torch(value) for key, value in next_obs.items()
+            },
+            dones=self.to_torch(dones).reshape(-1, 1),
+            rewards=self.to_torch(
+                self._normalize_reward(
+                    self.rewards[batch_inds, env_inds].reshape(-1, 1), env
+                )
+            ),
+        )
+
+    def __getstate__(self):
+        # The frames stay in their file instead of being pickled, which has to outlive
+        # this buffer for the copy
+        self.frames.flush()
+        self.owns_path = False
+        state = self.__dict__.copy()
+        del state["frames"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.frames = np.memmap(
+            os.path.join(self.path, "frames.bin"),
+            dtype=self.observation_space[self.image_key].dtype,
+            mode="r+",
+            shape=(self.n_envs, self.frame_capacity) + self.frame_shape,
+        )
@@ -0,0 +1,329 @@
+"""Trains a PPO agent with the hyperparameters of rl.toml.
+
+Usage: python train.py [--env Carla-v1] [--log-dir logs] [--resume]
+    [--remote host:5555 ...]
+"""
+import argparse
+import io
+import math
+import os
+import queue
+import re
+import threading
+import time
+
+import numpy as np
+import toml
+from stable_baselines3 import PPO
+from stable_baselines3.common.callbacks import BaseCallback, CallbackList
+from stable_baselines3.common.env_util import make_vec_env
+from stable_baselines3.common.vec_env import DummyVecEnv, SubprocVecEnv, VecMonitor
+
+from carla_integration import NATIVE_VEC_ENVS
+from carla_integration.remote import RemoteVecEnv
+from carla_integration.scheduler import TownScheduler
+from carla_integration.vec_env import ThreadedVecEnv
+from carla_integration.watchdog import EpisodeInterrupted
+from config import read_config
+from helper.carla_helper import SERVER_OWNER_VARIABLE, kill_owned_servers
+from helper.sensors.sensor_interface import SensorTimeout
+from models.feature_extractor import CustomFeatureExtractor
+
+RL_CONFIG_FILE = "rl.toml"
+VEC_ENV_CLASSES = {
+    "dummy": DummyVecEnv,
+    "subproc": SubprocVecEnv,
+    "threaded": ThreadedVecEnv,
+}
+CHECKPOINT_PATTERN = re.compile(r"^checkpoint_(\d+)_steps\.zip$")
+
+
+def linear_schedule(initial_value):
+    def schedule(progress_remaining):
+        return progress_remaining * initial_value
+
+    return schedule
+
+
+def parse_schedule(value):
+    """Parses the 'lin_<value>' schedules of rl.toml into a callable"""
+    if isinstance(value, str) and value.startswith("lin_"):
+        return linear_schedule(float(value[len("lin_") :]))
+    return float(value)
+
+
+def read_hyperparams(env_id):
+    """Returns the number of envs, total timesteps and PPO arguments of the env"""
+    with open(RL_CONFIG_FILE, "r") as f:
+        hyperparams = dict(toml.loads(f.read())[env_id])
+
+    n_envs = int(hyperparams.pop("n_envs"))
+    n_timesteps = int(hyperparams.pop("n_timesteps"))
+    for key in ("learning_rate", "clip_range"):
+        if key in hyperparams:
+            hyperparams[key] = parse_schedule(hyperparams[key])
+    if isinstance(hyperparams.get("policy_kwargs"), str):
+        hyperparams["policy_kwargs"] = eval(
+            hyperparams["policy_kwargs"],
+            {"dict": dict, "CustomFeatureExtractor": CustomFeatureExtractor},
+        )
+    return n_envs, n_timesteps, hyperparams
+
+
+def find_latest_checkpoint(log_dir):
+    """Returns the path of the checkpoint with the most timesteps, if any"""
+    if not os.path.isdir(log_dir):
+        return None
+    checkpoints = []
+    for file_name in os.listdir(log_dir):
+        match = CHECKPOINT_PATTERN.match(file_name)
+        if match is not None:
+            checkpoints.append((int(match.group(1)), file_name))
+    if not checkpoints:
+        return None
+    return os.path.join(log_dir, max(checkpoints)[1])
+
+
+class ThroughputCallback(BaseCallback):
+    """Reports the env-steps/sec of the rollout collection and the learner updates/sec
+    of the training phase separately"""
+
+    def __init__(self, verbose=0):
+        super().__init__(verbose)
+        self.rollout_start_time = None
+        self.rollout_start_steps = 0
+        self.train_start_time = None
+
+    def _on_rollout_start(self):
+        now = time.perf_counter()
+        if self.train_start_time is not None:
+            n_updates = self.model.n_epochs * math.ceil(
+                self.model.n_steps * self.model.n_envs / self.model.batch_size
+            )
+            train_time = now - self.train_start_time
+            self.logger.record("time/learner_updates_per_sec", n_updates / train_time)
+            self.logger.record("time/learner_seconds", train_time)
+        self.rollout_start_time = now
+        self.rollout_start_steps = self.num_timesteps
+
+    def _on_rollout_end(self):
+        now = time.perf_counter()
+        rollout_time = now - self.rollout_start_time
+        env_steps = self.num_timesteps - self.rollout_start_steps
+        self.logger.record("time/env_steps_per_sec", env_steps / rollout_time)
+        self.logger.record("time/rollout_seconds", rollout_time)
+        self.train_start_time = now
+
+    def _on_step(self):
+        return True
+
+
+class AsyncCheckpointCallback(BaseCallback):
+    """Saves the model every save_freq timesteps. The model is serialized in memory
+    and written to disk by a background thread, so slow disks never block the
+    rollouts. Files are written atomically and only the last keep_last are kept"""
+
+    def __init__(self, save_freq, save_path, keep_last=3, verbose=1):
+        super().__init__(verbose)
+        self.save_freq = save_freq
+        self.save_path = save_path
+        self.keep_last = keep_last
+        self.last_save_timesteps = 0
+
+        self._queue = queue.Queue(maxsize=2)
+        self._thread = None
+
+    def _init_callback(self):
+        os.makedirs(self.save_path, exist_ok=True)
+        self.last_save_timesteps = self.num_timesteps
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _on_step(self):
+        return True
+
+    def _on_rollout_end(self):
+        if self.num_timesteps - self.last_save_timesteps >= self.save_freq:
+            self.save()
+
+    def _on_training_end(self):
+        if self.num_timesteps != self.last_save_timesteps:
+            self.save(block=True)
+        self._queue.put(None)
+        self._thread.join()
+
+    def save(self, block=False):
+        buffer = io.BytesIO()
+        self.model.save(buffer)
+        path = os.path.join(
+            self.save_path, "checkpoint_{}_steps.zip".format(self.num_timesteps)
+        )
+        try:
+            self._queue.put((path, buffer.getvalue()), block=block)
+            self.last_save_timesteps = self.num_timesteps
+        except queue.Full:
+            print("Skipping checkpoint, the previous ones are still being written")
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            path, data = item
+            with open(path + ".tmp", "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(path + ".tmp", path)
+            if self.verbose > 0:
+                print("Saved checkpoint to {}".format(path))
+            self._prune()
+
+    def _prune(self):
+        checkpoints = []
+        for file_name in os.listdir(self.save_path):
+            match = CHECKPOINT_PATTERN.match(file_name)
+            if match is not None:
+                checkpoints.append((int(match.group(1)), file_name))
+        for _, file_name in sorted(checkpoints)[: -self.keep_last]:
+            os.remove(os.path.join(self.save_path, file_name))
+
+
+class TownScheduleCallback(BaseCallback):
+    """Picks the town and layout of every episode with a TownScheduler, each env being
+    one server. The options of an env's next episode are queued as soon as its
+    current one starts, so that the auto-reset of the VecEnv uses them"""
+
+    def __init__(self, scheduler, verbose=0):
+        super().__init__(verbose)
+        self.scheduler = scheduler
+
+    def queue_episodes(self, env, env_ids):
+        for env_id in env_ids:
+            options = self.scheduler.next_episode(int(env_id))
+            env.env_method("set_next_options", options, indices=[int(env_id)])
+
+    def _on_training_start(self):
+        # The first episodes were queued before learn reset the envs
+        self.queue_episodes(self.training_env, range(self.training_env.num_envs))
+
+    def _on_step(self):
+        self.queue_episodes(self.training_env, np.flatnonzero(self.locals["dones"]))
+        return True
+
+    def _on_rollout_end(self):
+        self.logger.record("scheduler/map_reloads", self.scheduler.n_reloads)
+
+
+def train(args, resume):
+    n_envs, n_timesteps, hyperparams = read_hyperparams(args.env)
+    if args.remote:
+        # The workers serve the envs, n_envs of rl.toml is not used
+        env = RemoteVecEnv(args.remote)
+    elif args.env in NATIVE_VEC_ENVS:
+        env = VecMonitor(NATIVE_VEC_ENVS[args.env](n_envs, seed=args.seed))
+    else:
+        if args.vec_env == "auto":
+            vec_env_cls = SubprocVecEnv if n_envs > 1 else DummyVecEnv
+        else:
+            vec_env_cls = VEC_ENV_CLASSES[args.vec_env]
+        env = make_vec_env(
+            args.env, n_envs=n_envs, seed=args.seed, vec_env_cls=vec_env_cls
+        )
+
+    callbacks = [
+        ThroughputCallback(),
+        AsyncCheckpointCallback(args.save_freq, args.log_dir, args.keep_last),
+    ]
+    scenario_mix = read_config()["experiment"]["scenario_mix"]
+    if scenario_mix and args.env not in NATIVE_VEC_ENVS:
+        scheduler = TownScheduler(
+            scenario_mix, env.num_envs, tolerance=args.town_tolerance, seed=args.seed
+        )
+        schedule_callback = TownScheduleCallback(scheduler)
+        # Options of the first reset, done by learn
+        schedule_callback.queue_episodes(env, range(env.num_envs))
+        callbacks.append(schedule_callback)
+
+    try:
+        checkpoint = find_latest_checkpoint(args.log_dir) if resume else None
+        if checkpoint is not None:
+            print("Resuming from {}".format(checkpoint))
+            model = PPO.load(checkpoint, env=env, tensorboard_log=args.tensorboard)
+        else:
+            model = PPO(
+                env=env, seed=args.seed, tensorboard_log=args.tensorboard, **hyperparams
+            )
+
+        model.learn(
+            total_timesteps=n_timesteps - model.num_timesteps,
+            callback=CallbackList(callbacks),
+            reset_num_timesteps=checkpoint is None,
+        )
+        model.save(os.path.join(args.log_dir, "final_model.zip"))
+    finally:
+        env.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--env", default="Carla-v1")
+    parser.add_argument("--log-dir", default="logs")
+    parser.add_argument("--tensorboard", default=None)
+    parser.add_argument("--save-freq", type=int, default=50000)
+    parser.add_argument("--keep-last", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument(
+        "--vec-env", choices=["auto"] + list(VEC_ENV_CLASSES), default="auto"
+    )
+    parser.add_argument(
+        "--remote",
+        nargs="+",
+        default=None,
+        help="Addresses of rollout workers (python -m carla_integration.remote)",
+    )
+    parser.add_argument(
+        "--town-tolerance",
+        type=int,
+        default=10,
+        help="Episodes a town can be ahead of its share before its server switches map",
+    )
+    parser.add_argument("--resume", action="store_true")
+    parser.add_argument(
+        "--max-restarts",
+        type=int,
+        default=3,
+        help="Times the training is resumed from the last checkpoint after a crash",
+    )
+    args = parser.parse_args()
+
+    # The servers started by the envs inherit the tag, so that a restart only kills
+    # the ones of this run
+    owner = "train-{}".format(os.getpid())
+    os.environ[SERVER_OWNER_VARIABLE] = owner
+
+    resume = args.resume
+    for attempt in range(args.max_restarts + 1):
+        try:
+            train(args, resume)
+            return
+        except (
+            SensorTimeout,
+            EpisodeInterrupted,
+            ConnectionError,
+            EOFError,
+            BrokenPipeError,
+        ) as e:
+            if attempt == args.max_restarts:
+                raise
+            print(
+                "Training crashed ({}), restarting {} of {}".format(
+                    e, attempt + 1, args.max_restarts
+                )
+            )
+            kill_owned_servers(owner)
+            resume = True
+
+
+if __name__ == "__main__":
+    main()